@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ASGI вход приложения (uvicorn)
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 2
+
+Медленные по природе запросы обслуживаются в цикле событий и не занимают поток:
+
+- загрузки (POST /uploads, /uploads/batch): тело принимается асинхронно,
+  multipart разбирается по мере поступления, файлы пишутся во временные файлы
+  папки загрузок; Flask получает уже принятую форму;
+- поток событий задачи (GET /jobs/<id>/events): лента читается из jobs.db
+  между паузами asyncio.sleep, отключение клиента обнаруживается сразу;
+- скачивание результатов (GET /downloads/<name>) блоками из файла или, при
+  заданном X_ACCEL_REDIRECT, ответом с X-Accel-Redirect для nginx;
+- архив результатов задачи (GET /jobs/<id>/bundle) по мере формирования ZIP;
+- пробы /health/live и /health/ready отвечают из цикла событий, не дожидаясь
+  свободного потока (кешированный результат готовности).
+
+Остальные запросы (страницы, статус задач, авторизация) передаются Flask
+через asgiref в пул потоков.
+"""
+
+import io
+import os
+import json
+import asyncio
+import logging
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.exceptions import HTTPException, BadRequest, RequestEntityTooLarge
+from werkzeug.http import parse_options_header, parse_etags, quote_etag
+from werkzeug.sansio.multipart import MultipartDecoder, Field, File, Data, Epilogue, NeedData
+
+import main
+from job_queue import TERMINAL_EVENTS, EVENTS_POLL_INTERVAL, EVENTS_KEEPALIVE_INTERVAL
+from job_queue import format_sse_event, parse_last_event_id, get_owned_job
+from upload_storage import PREFETCHED_FORM_KEY, open_upload_spool
+from download_variants import open_decoded, iter_zip_bundle
+
+logger = logging.getLogger('ifc-exporter')
+
+# Пути загрузок, принимаемых асинхронно
+UPLOAD_PATHS = {'/uploads', '/uploads/batch'}
+
+# Размер блока при отдаче файлов
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Объем принятых данных, после которого блок пишется во временный файл
+SPOOL_WRITE_SIZE = 256 * 1024
+
+
+async def send_json(send, status, payload, headers=None):
+    """Простой JSON ответ без участия Flask"""
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+                   + list(headers or [])
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class FlaskBridge:
+    """Вызов Flask приложения в потоке для запросов, частично обработанных в цикле событий"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+
+    def environ(self, scope, extra=None):
+        """WSGI environ запроса без тела"""
+        instance = WsgiToAsgiInstance(self.flask_app)
+        instance.scope = scope
+        environ = instance.build_environ(scope, io.BytesIO(b''))
+        environ.update(extra or {})
+        return environ
+
+    def _call(self, environ):
+        """Синхронный вызов приложения: (статус, заголовки, тело)"""
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'] = int(status.split(' ', 1)[0])
+            started['headers'] = headers
+
+        result = self.flask_app(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return started['status'], started['headers'], body
+
+    def _admission(self, environ):
+        """Проверка допуска в очередь до приема тела: (статус, заголовки, тело) отказа или None"""
+        with self.flask_app.request_context(environ):
+            response = main.check_admission()
+            if response is None:
+                return None
+            response = self.flask_app.make_response(response)
+            return response.status_code, list(response.headers.items()), response.get_data()
+
+    async def admission(self, scope):
+        return await asyncio.to_thread(self._admission, self.environ(scope))
+
+    def _in_request(self, environ, func, *args):
+        with self.flask_app.request_context(environ):
+            return func(*args)
+
+    async def in_request(self, scope, func, *args):
+        """Вызов функции приложения в контексте запроса (сессия клиента) в потоке"""
+        return await asyncio.to_thread(self._in_request, self.environ(scope), func, *args)
+
+    async def call(self, scope, extra, send):
+        status, headers, body = await asyncio.to_thread(self._call, self.environ(scope, extra))
+        await send_response(send, status, headers, body)
+
+
+async def send_response(send, status, headers, body):
+    """Отправка ответа, собранного Flask"""
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def discard_spools(spools):
+    """Удаление временных файлов незавершенной загрузки"""
+    for spool in spools:
+        try:
+            spool.discard()
+        except OSError:
+            pass
+
+
+async def receive_form(receive, content_type, config):
+    """
+    Асинхронный прием multipart формы
+
+    :return: (поля формы, файлы, временные файлы)
+    :raises BadRequest: некорректное тело запроса
+    :raises RequestEntityTooLarge: превышен MAX_CONTENT_LENGTH
+    """
+    mimetype, options = parse_options_header(content_type)
+    boundary = options.get('boundary')
+    if mimetype != 'multipart/form-data' or not boundary:
+        raise BadRequest("Expected multipart/form-data")
+
+    decoder = MultipartDecoder(boundary.encode('latin1'), config.get('MAX_FORM_MEMORY_SIZE'),
+                               max_parts=config.get('MAX_FORM_PARTS', 1000))
+    max_length = config.get('MAX_CONTENT_LENGTH')
+    form, files, spools = MultiDict(), MultiDict(), []
+    received = 0
+    part, field_data, pending = None, [], []
+
+    async def flush():
+        # Запись во временный файл (хеширование, распаковка) - в пуле потоков
+        if pending:
+            chunk = b''.join(pending)
+            pending.clear()
+            await asyncio.to_thread(part[2].write, chunk)
+
+    try:
+        more_body = True
+        while True:
+            event = decoder.next_event()
+
+            if isinstance(event, NeedData):
+                if not more_body:
+                    raise BadRequest("Unexpected end of form data")
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    raise BadRequest("Client disconnected")
+                chunk = message.get('body', b'')
+                more_body = message.get('more_body', False)
+                received += len(chunk)
+                if max_length is not None and received > max_length:
+                    raise RequestEntityTooLarge()
+                decoder.receive_data(chunk)
+                if not more_body:
+                    decoder.receive_data(None)
+
+            elif isinstance(event, File):
+                stream = open_upload_spool(config, event.headers.get('Content-Type'))
+                spools.append(stream)
+                part, pending = ('file', event, stream), []
+
+            elif isinstance(event, Field):
+                part, field_data = ('field', event, None), []
+
+            elif isinstance(event, Data):
+                if part[0] == 'file':
+                    pending.append(event.data)
+                    if sum(len(data) for data in pending) >= SPOOL_WRITE_SIZE or not event.more_data:
+                        await flush()
+                    if not event.more_data:
+                        part[2].seek(0)
+                        files.add(part[1].name, FileStorage(part[2], filename=part[1].filename, name=part[1].name,
+                                                            headers=part[1].headers))
+                else:
+                    field_data.append(event.data)
+                    if not event.more_data:
+                        charset = parse_options_header(part[1].headers.get('Content-Type', ''))[1].get('charset')
+                        form.add(part[1].name, b''.join(field_data).decode(charset or 'utf-8', 'replace'))
+
+            elif isinstance(event, Epilogue):
+                return form, files, spools
+    except Exception:
+        await asyncio.to_thread(discard_spools, spools)
+        raise
+
+
+class Application:
+    """ASGI приложение: асинхронные загрузки, SSE и скачивание, остальное - Flask"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.bridge = FlaskBridge(flask_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        path, method = scope['path'], scope['method']
+        headers = {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope['headers']}
+
+        if method == 'GET' and path == '/health/live':
+            return await send_json(send, 200, {'status': 'alive'})
+        if method == 'GET' and path == '/health/ready':
+            return await self.health_ready(send)
+        if method == 'POST' and path in UPLOAD_PATHS:
+            return await self.upload(scope, receive, send, headers)
+        if method == 'GET' and path.startswith('/jobs/') and path.endswith('/events'):
+            return await self.job_events(scope, receive, send, headers, path[len('/jobs/'):-len('/events')])
+        if method == 'GET' and path.startswith('/jobs/') and path.endswith('/bundle'):
+            return await self.bundle(scope, send, path[len('/jobs/'):-len('/bundle')])
+        if method == 'GET' and path.startswith('/downloads/') and 'range' not in headers:
+            return await self.download(scope, send, headers, path[len('/downloads/'):])
+
+        return await self.bridge.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        """
+        Запуск обработчиков очереди при старте процесса и остановка при завершении
+
+        При остановке текущие конвертации дорабатываются (не дольше JOB_DRAIN_TIMEOUT)
+        """
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await asyncio.to_thread(main.elect_job_workers)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await asyncio.to_thread(main.stop_job_workers, main.JOB_DRAIN_TIMEOUT)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def health_ready(self, send):
+        """Проба готовности: кешированный результат проверок, 503 если узел не готов"""
+        if main.readiness.computed:
+            result = main.readiness.result()
+        else:
+            # Первые проверки выполняются синхронно - вне цикла событий
+            result = await asyncio.to_thread(main.readiness.result)
+        await send_json(send, 200 if result['ready'] else 503, result, [(b'cache-control', b'no-store')])
+
+    async def upload(self, scope, receive, send, headers):
+        """Загрузка файлов: проверка очереди до приема тела, асинхронный прием, обработка во Flask"""
+        rejected = await self.bridge.admission(scope)
+        if rejected is not None:
+            return await send_response(send, *rejected)
+
+        try:
+            form, files, spools = await receive_form(receive, headers.get('content-type', ''), self.flask_app.config)
+        except HTTPException as e:
+            logger.warning(f"Upload rejected: {e.description}")
+            return await send_json(send, e.code, {"error": e.description})
+
+        try:
+            await self.bridge.call(scope, {PREFETCHED_FORM_KEY: (form, files, spools)}, send)
+        finally:
+            # Flask удаляет временные файлы, только если обработчик обратился к форме;
+            # при раннем ответе (повторная проверка допуска, авторизация, ошибка) их
+            # удаляем здесь. Сохраненные обработчиком (store_upload) файлы не трогаются
+            await asyncio.to_thread(discard_spools, spools)
+
+    async def job_events(self, scope, receive, send, headers, job_id):
+        """Поток Server-Sent Events задачи без занятого потока на время ожидания"""
+        job_queue = main.job_queue
+        # Чужая задача неотличима от несуществующей
+        if '/' in job_id or await self.bridge.in_request(scope, get_owned_job, job_queue, job_id) is None:
+            return await send_json(send, 404, {'error': 'Job not found'})
+
+        query = parse_qs(scope.get('query_string', b'').decode('latin1'))
+        after_id = parse_last_event_id(headers.get('last-event-id', (query.get('last_event_id') or [None])[0]))
+
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream; charset=utf-8'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no')  # Отключаем буферизацию ответа в nginx
+            ]
+        })
+
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+
+        watcher = asyncio.create_task(watch_disconnect())
+        loop = asyncio.get_running_loop()
+        last_sent = loop.time()
+        try:
+            while not disconnected.is_set():
+                events = await asyncio.to_thread(job_queue.get_events, job_id, after_id)
+
+                for event in events:
+                    after_id = event['id']
+                    await send({'type': 'http.response.body', 'body': format_sse_event(event).encode('utf-8'),
+                                'more_body': True})
+                    if event['event'] in TERMINAL_EVENTS:
+                        return
+
+                now = loop.time()
+                if events:
+                    last_sent = now
+                elif now - last_sent >= EVENTS_KEEPALIVE_INTERVAL:
+                    # Комментарий не дает прокси закрыть неактивное соединение
+                    last_sent = now
+                    await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+
+                try:
+                    await asyncio.wait_for(disconnected.wait(), EVENTS_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            watcher.cancel()
+            if not disconnected.is_set():
+                await send({'type': 'http.response.body', 'body': b''})
+
+    async def bundle(self, scope, send, job_id):
+        """Архив результатов задачи: блоки ZIP формируются в потоке и отправляются по мере готовности"""
+        bundle = await self.bridge.in_request(scope, main.resolve_bundle, job_id)
+        if bundle is None:
+            return await send_json(send, 404, {"error": "Bundle not found"})
+
+        zip_name, entries = bundle
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'application/zip'),
+                (b'content-disposition', main.download_disposition(zip_name).encode('latin1'))
+            ]
+        })
+        chunks = iter_zip_bundle(entries)
+        try:
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            chunks.close()
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def download(self, scope, send, headers, filename):
+        """Скачивание файла результата блоками без потока на все время передачи"""
+        if 'if-none-match' in headers:
+            etag = await asyncio.to_thread(main.download_not_modified, filename,
+                                           parse_etags(headers['if-none-match']), headers.get('accept-encoding'))
+            if etag:
+                return await send_response(send, 304, [('ETag', quote_etag(etag)), ('Vary', 'Accept-Encoding')], b'')
+
+        path = await asyncio.to_thread(main.resolve_download_path, filename)
+        if path is None:
+            return await send_json(send, 404, {"error": "File not found"})
+
+        if self.flask_app.config['X_ACCEL_REDIRECT']:
+            with self.flask_app.app_context():
+                response = main.accel_redirect_response(path)
+            return await send_response(send, response.status_code, list(response.headers), b'')
+
+        name = os.path.basename(path)
+        response_headers = [
+            (b'content-type', main.download_mimetype(name).encode('latin1')),
+            (b'content-disposition', main.download_disposition(name).encode('latin1')),
+            (b'vary', b'Accept-Encoding')
+        ]
+
+        # Сжатый вариант отдается как есть, исходные байты без хранимого CSV - распаковкой на лету
+        variant = main.select_variant(path, headers.get('accept-encoding'))
+        etag = await asyncio.to_thread(main.variant_etag, path, variant)
+        response_headers.append((b'etag', quote_etag(etag).encode('latin1')))
+        if variant.decode:
+            f = await asyncio.to_thread(open_decoded, variant)
+        else:
+            f = await asyncio.to_thread(open, variant.path, 'rb')
+            response_headers += [(b'content-length', str(os.fstat(f.fileno()).st_size).encode()),
+                                 (b'accept-ranges', b'bytes')]
+            if variant.encoding:
+                response_headers.append((b'content-encoding', variant.encoding.encode('latin1')))
+
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': response_headers})
+            while True:
+                chunk = await asyncio.to_thread(f.read, DOWNLOAD_CHUNK_SIZE)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': bool(chunk)})
+                if not chunk:
+                    break
+        finally:
+            f.close()
+
+
+# Обработчики очереди запускаются в lifespan: у каждого процесса uvicorn свои
+application = Application(main.create_app(start_workers=False))
@@ -7,13 +7,20 @@ OAuth2 Google авторизация и система истории конве
 import os
 import json
 import sqlite3
+import threading
+import time
 from datetime import datetime, timedelta
 from functools import wraps
 
-from flask import session, redirect, url_for, request, jsonify, render_template
-from authlib.integrations.flask_client import OAuth
+from flask import session, redirect, url_for, request, jsonify, render_template, current_app
 import logging
 
+from lazy_imports import lazy_module, require_modules
+
+# authlib загружается при первом входе через Google, а не при старте приложения
+require_modules('authlib')
+flask_client = lazy_module('authlib.integrations.flask_client')
+
 logger = logging.getLogger('ifc-exporter')
 
 
@@ -22,18 +29,30 @@ class AuthManager:
 
     def __init__(self, app):
         self.app = app
-        self.oauth = OAuth(app)
+        # На нескольких узлах БД пользователей лежит на общем томе (DB_PATH)
+        self.db_path = os.getenv('DB_PATH', 'users_history.db')
+        self.oauth = None
+        self._google = None
+        self._oauth_lock = threading.Lock()
         self.setup_database()
-        self.setup_google_oauth()
+
+    @property
+    def google(self):
+        """Клиент Google OAuth2 (создается при первом входе)"""
+        if self._google is None:
+            with self._oauth_lock:
+                if self._google is None:
+                    self.setup_google_oauth()
+        return self._google
 
     def setup_database(self):
         """Создание базы данных для хранения истории"""
-        # db_path = 'users_history.db'
-        db_path = db_path = os.getenv('DB_PATH', 'users_history.db') # ======================= ВТОРОЙ СЕРВЕР ======================= #
-
-        conn = sqlite3.connect(db_path)
+        conn = sqlite3.connect(self.db_path, timeout=30)
         cursor = conn.cursor()
 
+        # WAL: узлы и воркеры пишут историю параллельно с чтением дашборда
+        cursor.execute('PRAGMA journal_mode=WAL')
+
         # Таблица пользователей
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -64,6 +83,21 @@ class AuthManager:
             )
         ''')
 
+        # Миграция существующих БД: предсказанная длительность и счетчики для калибровки оценки
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(conversions)')]
+        for column, column_type in (('predicted_time_seconds', 'REAL'), ('entity_count', 'INTEGER'),
+                                    ('zone_count', 'INTEGER')):
+            if column not in columns:
+                cursor.execute(f'ALTER TABLE conversions ADD COLUMN {column} {column_type}')
+
+        # Версия истории пользователя: растет с каждой записью о конвертации (ETag /api/history, /api/stats)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS history_versions (
+                user_id TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        ''')
+
         conn.commit()
         conn.close()
         logger.info("Database initialized successfully")
@@ -71,7 +105,8 @@ class AuthManager:
     def setup_google_oauth(self):
         """Настройка Google OAuth2"""
         # Регистрация Google OAuth провайдера
-        self.google = self.oauth.register(
+        self.oauth = flask_client.OAuth(self.app)
+        self._google = self.oauth.register(
             name='google',
             client_id=os.getenv('GOOGLE_CLIENT_ID'),
             client_secret=os.getenv('GOOGLE_CLIENT_SECRET'),
@@ -98,7 +133,7 @@ class AuthManager:
 
     def save_user(self, user_info):
         """Сохранение информации о пользователе"""
-        conn = sqlite3.connect('users_history.db')
+        conn = sqlite3.connect(self.db_path, timeout=30)
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -117,14 +152,15 @@ class AuthManager:
 
     def save_conversion(self, user_id, conversion_data):
         """Сохранение записи о конвертации"""
-        conn = sqlite3.connect('users_history.db')
+        conn = sqlite3.connect(self.db_path, timeout=30)
         cursor = conn.cursor()
 
         cursor.execute('''
             INSERT INTO conversions 
             (user_id, original_filename, csv_filename, sheet_url, file_size, 
-             processed_flats, processing_time_seconds, status, error_message)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+             processed_flats, processing_time_seconds, predicted_time_seconds, entity_count, zone_count,
+             status, error_message)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             user_id,
             conversion_data.get('original_filename'),
@@ -133,16 +169,32 @@ class AuthManager:
             conversion_data.get('file_size', 0),
             conversion_data.get('processed_flats', 0),
             conversion_data.get('processing_time', 0.0),
+            conversion_data.get('predicted_time'),
+            conversion_data.get('entity_count'),
+            conversion_data.get('zone_count'),
             conversion_data.get('status', 'success'),
             conversion_data.get('error_message')
         ))
 
+        # В той же транзакции: ETag по версии не переживет изменения истории
+        cursor.execute('''
+            INSERT INTO history_versions (user_id, version) VALUES (?, 1)
+            ON CONFLICT(user_id) DO UPDATE SET version = version + 1
+        ''', (user_id,))
+
         conn.commit()
         conn.close()
 
+    def get_history_version(self, user_id):
+        """Версия истории пользователя (0 - записей еще не было)"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        row = conn.execute('SELECT version FROM history_versions WHERE user_id = ?', (user_id,)).fetchone()
+        conn.close()
+        return row[0] if row else 0
+
     def get_user_history(self, user_id, limit=50):
         """Получение истории конвертаций пользователя"""
-        conn = sqlite3.connect('users_history.db')
+        conn = sqlite3.connect(self.db_path, timeout=30)
         conn.row_factory = sqlite3.Row  # Для доступа по именам колонок
         cursor = conn.cursor()
 
@@ -161,7 +213,7 @@ class AuthManager:
 
     def get_user_stats(self, user_id):
         """Получение статистики пользователя"""
-        conn = sqlite3.connect('users_history.db')
+        conn = sqlite3.connect(self.db_path, timeout=30)
         cursor = conn.cursor()
 
         # Общее количество конвертаций
@@ -201,6 +253,29 @@ class AuthManager:
         }
 
 
+def history_etag(auth_manager, user_id, *parts):
+    """
+    ETag ответа, построенного из истории пользователя
+
+    Строится по версии истории и параметрам ответа; версия читается одним
+    запросом по ключу вместо запросов истории и статистики.
+    """
+    version = auth_manager.get_history_version(user_id)
+    return '-'.join(str(part) for part in (user_id, version) + parts)
+
+
+def conditional_json(etag, build):
+    """JSON ответ с ETag; при совпадении If-None-Match - 304 без вызова build()"""
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    # Данные пользователя: кешировать можно только в браузере и с проверкой ETag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 def setup_auth_routes(app, auth_manager):
     """Настройка маршрутов авторизации"""
 
@@ -278,10 +353,9 @@ def setup_auth_routes(app, auth_manager):
         user_id = session['user']['id']
         limit = request.args.get('limit', 50, type=int)
 
-        history = auth_manager.get_user_history(user_id, limit)
-        return jsonify({
+        return conditional_json(history_etag(auth_manager, user_id, 'history', limit), lambda: {
             'status': 'success',
-            'history': history
+            'history': auth_manager.get_user_history(user_id, limit)
         })
 
     @app.route('/api/stats')
@@ -289,10 +363,12 @@ def setup_auth_routes(app, auth_manager):
     def api_stats():
         """API для получения статистики пользователя"""
         user_id = session['user']['id']
-        stats = auth_manager.get_user_stats(user_id)
 
-        return jsonify({
+        # recent_conversions считается за последние 30 дней и меняется без новых записей,
+        # поэтому ETag статистики действует в пределах часа
+        hour = int(time.time() // 3600)
+        return conditional_json(history_etag(auth_manager, user_id, 'stats', hour), lambda: {
             'status': 'success',
-            'stats': stats
+            'stats': auth_manager.get_user_stats(user_id)
         })
 
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочное сравнение dev-сервера Flask, gunicorn (gunicorn.conf.py) и uvicorn (asgi.py)
+
+Каждый сервер запускается во временной папке (свои jobs.db, uploads, downloads),
+затем CONCURRENCY клиентов отправляют запросы к легким страницам. Выводится
+пропускная способность и задержки (p50/p95/p99/max).
+
+С --convert во время замера в очередь непрерывно ставится конвертация указанного
+IFC файла, что показывает влияние разбора моделей на задержки веб-запросов.
+С --slow-uploads N во время замера N клиентов медленно (по блоку в секунду)
+передают загрузку - как пользователи на плохом канале.
+
+    python bench_serving.py --requests 2000 --concurrency 16
+    python bench_serving.py --server gunicorn --convert model.ifc
+    python bench_serving.py --server all --slow-uploads 20
+"""
+
+import os
+import sys
+import time
+import uuid
+import shutil
+import socket
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Запросы замера: главная страница (шаблон) и статус задачи (чтение jobs.db)
+DEFAULT_PATHS = ['/', f'/jobs/{uuid.uuid4().hex}']
+
+
+def start_server(kind, port, workdir):
+    """Запуск сервера в отдельном процессе и ожидание готовности порта"""
+    env = dict(os.environ, PORT=str(port), PYTHONPATH=REPO_DIR, PYTHONUNBUFFERED='1')
+    env.pop('NGROK_URL', None)
+
+    if kind == 'dev':
+        command = [sys.executable, os.path.join(REPO_DIR, 'main.py')]
+    elif kind == 'uvicorn':
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:application', '--port', str(port), '--no-access-log']
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO_DIR, 'gunicorn.conf.py'),
+                   '--chdir', workdir]
+
+    log = open(os.path.join(workdir, f'{kind}.log'), 'w')
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+                               start_new_session=True)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.5)
+
+    stop_server(process)
+    raise RuntimeError(f"{kind} server did not start, see {log.name}")
+
+
+def stop_server(process):
+    """Остановка сервера вместе с дочерними процессами"""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        os.killpg(process.pid, signal.SIGKILL)
+
+
+def timed_request(port, path):
+    """Один запрос по новому соединению (как nginx к upstream): (задержка, код ответа)"""
+    started = time.perf_counter()
+    try:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        status = response.status
+    except OSError:
+        status = None
+    return time.perf_counter() - started, status
+
+
+def keep_converting(port, ifc_path, stop_event):
+    """Фоновая постановка конвертаций во время замера"""
+    with open(ifc_path, 'rb') as f:
+        data = f.read()
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="files"; filename="{os.path.basename(ifc_path)}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+
+    while not stop_event.is_set():
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            connection.request('POST', '/uploads', body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+            connection.getresponse().read()
+            connection.close()
+        except OSError:
+            pass
+        stop_event.wait(1.0)
+
+
+def slow_upload(port, stop_event):
+    """Загрузка, тело которой передается по блоку в секунду до конца замера"""
+    boundary = uuid.uuid4().hex
+    head = (f'--{boundary}\r\nContent-Disposition: form-data; name="files"; filename="slow.ifc"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n').encode()
+    try:
+        sock = socket.create_connection(('127.0.0.1', port), timeout=60)
+        sock.sendall(f'POST /uploads HTTP/1.1\r\nHost: localhost\r\n'
+                     f'Content-Type: multipart/form-data; boundary={boundary}\r\n'
+                     f'Content-Length: {100 * 1024 * 1024}\r\n\r\n'.encode() + head)
+        while not stop_event.wait(1.0):
+            sock.sendall(b'#' * 1024)
+        sock.close()
+    except OSError:
+        pass
+
+
+def percentile(values, fraction):
+    """Процентиль отсортированного списка"""
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_benchmark(port, paths, total, concurrency):
+    """Замер: total запросов по кругу из paths в concurrency потоков"""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda i: timed_request(port, paths[i % len(paths)]), range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    errors = sum(1 for _, status in results if status is None or status >= 500)
+    return {
+        'rps': total / elapsed,
+        'p50': percentile(latencies, 0.50) * 1000,
+        'p95': percentile(latencies, 0.95) * 1000,
+        'p99': percentile(latencies, 0.99) * 1000,
+        'max': latencies[-1] * 1000,
+        'errors': errors
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение dev-сервера Flask, gunicorn и uvicorn")
+    parser.add_argument('--server', choices=['dev', 'gunicorn', 'uvicorn', 'both', 'all'], default='both')
+    parser.add_argument('--requests', type=int, default=2000, help="число запросов замера")
+    parser.add_argument('--concurrency', type=int, default=16, help="число одновременных клиентов")
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--path', action='append', help="путь запроса (можно несколько)")
+    parser.add_argument('--convert', metavar='IFC', help="непрерывно конвертировать файл во время замера")
+    parser.add_argument('--slow-uploads', type=int, default=0, metavar='N',
+                        help="число медленных загрузок во время замера")
+    args = parser.parse_args(argv)
+
+    paths = args.path or DEFAULT_PATHS
+    kinds = {'both': ['dev', 'gunicorn'], 'all': ['dev', 'gunicorn', 'uvicorn']}.get(args.server, [args.server])
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, paths {paths}"
+          + (f", converting {args.convert}" if args.convert else "")
+          + (f", {args.slow_uploads} slow uploads" if args.slow_uploads else ""))
+    print(f"{'server':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+
+    for kind in kinds:
+        workdir = tempfile.mkdtemp(prefix=f'bench-{kind}-')
+        process = start_server(kind, args.port, workdir)
+        stop_event = threading.Event()
+        converter = None
+        uploaders = []
+        try:
+            # Прогрев: импорт шаблонов и соединений с БД
+            run_benchmark(args.port, paths, min(100, args.requests), args.concurrency)
+
+            if args.convert:
+                converter = threading.Thread(target=keep_converting,
+                                             args=(args.port, os.path.abspath(args.convert), stop_event))
+                converter.start()
+                time.sleep(2)
+
+            for _ in range(args.slow_uploads):
+                uploader = threading.Thread(target=slow_upload, args=(args.port, stop_event))
+                uploader.start()
+                uploaders.append(uploader)
+            if uploaders:
+                time.sleep(2)
+
+            stats = run_benchmark(args.port, paths, args.requests, args.concurrency)
+            print(f"{kind:<10}{stats['rps']:>10.1f}{stats['p50']:>10.1f}{stats['p95']:>10.1f}"
+                  f"{stats['p99']:>10.1f}{stats['max']:>10.1f}{stats['errors']:>8}")
+        finally:
+            stop_event.set()
+            if converter:
+                converter.join()
+            for uploader in uploaders:
+                uploader.join()
+            stop_server(process)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
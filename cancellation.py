@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кооперативная отмена задач конвертации
+
+Токен отмены проверяется в цикле по зонам, между файлами и перед загрузкой
+в Google Sheets. Флаг отмены хранится в таблице jobs (jobs.db), поэтому
+отменить задачу можно из любого процесса приложения, а токен передается в
+процессы разбора IFC как обычный аргумент.
+"""
+
+import time
+import sqlite3
+import logging
+
+logger = logging.getLogger('ifc-exporter')
+
+
+class ConversionCancelled(Exception):
+    """Задача конвертации отменена пользователем"""
+
+
+class DeadlineExceeded(ConversionCancelled):
+    """Истек срок выполнения задачи конвертации"""
+
+
+class CancellationToken:
+    """
+    Токен отмены выполняемой задачи
+
+    Хранит только путь к БД, идентификатор задачи и срок выполнения.
+    Флаг отмены читается из БД не чаще одного раза в poll_interval секунд,
+    поэтому check() можно вызывать для каждой зоны.
+
+    С номером попытки токен прерывает и обработку, потерявшую аренду: задачу
+    после истечения аренды захватил другой обработчик.
+    """
+
+    def __init__(self, db_path, job_id, deadline_at=None, poll_interval=1.0, attempt=None):
+        """
+        :param db_path: путь к БД очереди
+        :param job_id: идентификатор задачи
+        :param deadline_at: unix-время, после которого задача прерывается (None - без срока)
+        :param poll_interval: интервал чтения флага отмены из БД (секунды)
+        :param attempt: номер попытки выполнения (None - не проверять аренду)
+        """
+        self.db_path = db_path
+        self.job_id = job_id
+        self.deadline_at = deadline_at
+        self.poll_interval = poll_interval
+        self.attempt = attempt
+        self.lease_lost = False
+        self._last_poll = 0.0
+        self._cancelled = False
+
+    def cancelled(self):
+        """Запрошена ли отмена задачи"""
+        if self._cancelled:
+            return True
+
+        now = time.monotonic()
+        if now - self._last_poll < self.poll_interval:
+            return False
+        self._last_poll = now
+
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            row = conn.execute('SELECT cancel_requested, attempts FROM jobs WHERE id = ?', (self.job_id,)).fetchone()
+            conn.close()
+        except sqlite3.Error as e:
+            # Недоступная БД не должна прерывать конвертацию
+            logger.warning(f"Failed to read cancellation flag for {self.job_id}: {e}")
+            return False
+
+        self.lease_lost = bool(row and self.attempt is not None and row[1] != self.attempt)
+        self._cancelled = bool(row and row[0]) or self.lease_lost
+        return self._cancelled
+
+    def check(self):
+        """
+        Прерывание обработки при отмене или истечении срока
+
+        :raises DeadlineExceeded: срок выполнения истек
+        :raises ConversionCancelled: отмена запрошена пользователем
+        """
+        if self.deadline_at is not None and time.time() > self.deadline_at:
+            raise DeadlineExceeded("Conversion deadline exceeded")
+        if self.cancelled():
+            raise ConversionCancelled("Job lease lost" if self.lease_lost else "Conversion cancelled")
@@ -0,0 +1,570 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Возобновляемая загрузка больших IFC файлов частями (chunked upload)
+
+Протокол:
+    POST   /uploads/chunked          - создание сессии {filename, size}
+    GET    /uploads/chunked/<id>     - текущее смещение для возобновления
+    PUT    /uploads/chunked/<id>     - часть файла, заголовок Upload-Offset
+    DELETE /uploads/chunked/<id>     - отмена загрузки
+
+Части принимаются строго по порядку и сразу добавляются в SHA-256, поэтому
+хеш содержимого известен в момент сборки файла. Если вошедший пользователь
+заранее передал sha256 файла, который он сам уже загружал (есть его ссылка
+в upload_refs), сессия создается завершенной без передачи данных. Чужие файлы
+по одному хешу не выдаются: знание хеша не доказывает наличие данных.
+
+Сессия доступна только создавшему ее клиенту: вошедшему пользователю по
+учетной записи, анонимному - по подписанной сессии Flask (remember_upload).
+Чужая сессия неотличима от несуществующей (404).
+
+Сессии, не обновлявшиеся дольше CHUNKED_UPLOAD_TTL секунд, удаляются вместе
+с недокачанными .part файлами.
+
+Сессия с content_encoding=gzip принимает сжатый в браузере файл: size - это
+размер сжатых данных, а при сборке файл распаковывается в хранилище.
+"""
+
+import os
+import time
+import uuid
+import fcntl
+import hashlib
+import sqlite3
+import threading
+import logging
+
+from flask import jsonify, request, session, url_for
+from werkzeug.exceptions import HTTPException
+
+from upload_storage import GzipUploadFile
+
+logger = logging.getLogger('ifc-exporter')
+
+# Размер части по умолчанию (укладывается в MAX_CONTENT_LENGTH одного запроса)
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Размер блока при чтении тела запроса и пересчете хеша
+COPY_BUFFER_SIZE = 1024 * 1024
+
+UPLOAD_IN_PROGRESS = 'uploading'
+UPLOAD_COMPLETE = 'complete'
+
+# Поддерживаемые кодировки сжатых загрузок
+CONTENT_ENCODINGS = {'gzip'}
+
+# Срок жизни неактивной сессии (секунды) и период очистки устаревших сессий
+CHUNKED_UPLOAD_TTL = float(os.getenv('CHUNKED_UPLOAD_TTL', str(24 * 3600)))
+CHUNKED_CLEANUP_INTERVAL = 600
+
+# Сколько последних сессий загрузки помнит сессия клиента без учетной записи
+SESSION_UPLOADS_LIMIT = 20
+
+
+class ChunkedUploadError(Exception):
+    """Ошибка протокола частичной загрузки с HTTP статусом"""
+
+    def __init__(self, message, status_code=400, offset=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+class ChunkedUploadManager:
+    """Менеджер сессий частичной загрузки"""
+
+    def __init__(self, upload_folder, blob_store, db_path=None, chunk_size=DEFAULT_CHUNK_SIZE, max_file_size=None,
+                 max_decompressed_size=None, session_ttl=None):
+        self.upload_folder = upload_folder
+        self.blob_store = blob_store
+        self.parts_folder = os.path.join(upload_folder, '.chunks')
+        self.db_path = db_path or os.getenv('JOBS_DB_PATH', 'jobs.db')
+        self.chunk_size = chunk_size
+        self.max_file_size = max_file_size
+        self.max_decompressed_size = max_decompressed_size or max_file_size
+        self.session_ttl = session_ttl if session_ttl is not None else CHUNKED_UPLOAD_TTL
+        self._last_cleanup = 0
+
+        # Текущее состояние SHA-256 по сессиям: {upload_id: (offset, hasher)}
+        self._hashers = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(self.parts_folder, exist_ok=True)
+        self.setup_database()
+        self.expire_sessions()
+
+    def _connect(self):
+        """Открытие соединения с БД сессий"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def setup_database(self):
+        """Создание таблицы сессий загрузки"""
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                id TEXT PRIMARY KEY,
+                user_id TEXT,
+                filename TEXT NOT NULL,
+                total_size INTEGER NOT NULL,
+                chunk_size INTEGER NOT NULL,
+                received INTEGER NOT NULL DEFAULT 0,
+                state TEXT NOT NULL DEFAULT 'uploading',
+                sha256 TEXT,
+                path TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+        # Миграция существующих БД: кодировка сжатых загрузок
+        columns = [row['name'] for row in conn.execute('PRAGMA table_info(upload_sessions)')]
+        if 'content_encoding' not in columns:
+            conn.execute('ALTER TABLE upload_sessions ADD COLUMN content_encoding TEXT')
+
+        conn.commit()
+        conn.close()
+
+    def _part_path(self, upload_id):
+        """Путь к собираемому файлу сессии"""
+        return os.path.join(self.parts_folder, f"{upload_id}.part")
+
+    def create(self, filename, total_size, user_id=None, sha256=None, content_encoding=None, original_size=None):
+        """
+        Создание новой сессии загрузки
+
+        :param filename: исходное имя файла
+        :param total_size: полный размер передаваемых данных в байтах
+        :param user_id: идентификатор пользователя
+        :param sha256: хеш исходного файла, если клиент вычислил его заранее
+        :param content_encoding: gzip, если файл сжат в браузере
+        :param original_size: размер исходного файла до сжатия
+        :return: словарь сессии
+        """
+        if total_size <= 0:
+            raise ChunkedUploadError("File size must be positive")
+        if self.max_file_size and total_size > self.max_file_size:
+            raise ChunkedUploadError(f"File too large. Maximum size is {self.max_file_size} bytes", 413)
+        if content_encoding and content_encoding not in CONTENT_ENCODINGS:
+            raise ChunkedUploadError(f"Unsupported content encoding: {content_encoding}")
+        if self.max_decompressed_size and original_size and original_size > self.max_decompressed_size:
+            raise ChunkedUploadError(f"File too large. Maximum size is {self.max_decompressed_size} bytes", 413)
+
+        if time.time() - self._last_cleanup > CHUNKED_CLEANUP_INTERVAL:
+            self.expire_sessions()
+
+        upload_id = uuid.uuid4().hex
+        now = time.time()
+
+        # Пользователь уже загружал этот файл - данные передавать не нужно
+        blob = self.blob_store.find(sha256.lower(), user_id=user_id) if sha256 and user_id else None
+        expected_size = original_size if content_encoding else total_size
+        if blob and blob['size'] == expected_size:
+            conn = self._connect()
+            conn.execute('''
+                INSERT INTO upload_sessions
+                (id, user_id, filename, total_size, chunk_size, received, state, sha256, path, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (upload_id, user_id, filename, total_size, self.chunk_size, total_size,
+                  UPLOAD_COMPLETE, blob['sha256'], blob['path'], now, now))
+            conn.commit()
+            conn.close()
+
+            logger.info(f"Chunked upload deduplicated: {filename} -> {blob['sha256']}")
+            return self.get(upload_id)
+
+        # Пустой файл сразу, чтобы смещение 0 было валидным
+        open(self._part_path(upload_id), 'wb').close()
+
+        conn = self._connect()
+        conn.execute('''
+            INSERT INTO upload_sessions
+            (id, user_id, filename, total_size, chunk_size, content_encoding, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (upload_id, user_id, filename, total_size, self.chunk_size, content_encoding, now, now))
+        conn.commit()
+        conn.close()
+
+        with self._lock:
+            self._hashers[upload_id] = (0, hashlib.sha256())
+
+        logger.info(f"Chunked upload started: {filename} ({total_size} bytes) -> {upload_id}")
+        return self.get(upload_id)
+
+    def get(self, upload_id):
+        """Получение сессии по идентификатору"""
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def _get_hasher(self, upload_id, offset):
+        """
+        Состояние SHA-256 для указанного смещения
+
+        Если сессию продолжает другой процесс (или сервер был перезапущен),
+        хеш восстанавливается перечитыванием уже принятой части файла.
+        """
+        with self._lock:
+            state = self._hashers.get(upload_id)
+        if state and state[0] == offset:
+            return state[1]
+
+        hasher = hashlib.sha256()
+        remaining = offset
+        with open(self._part_path(upload_id), 'rb') as f:
+            while remaining > 0:
+                block = f.read(min(COPY_BUFFER_SIZE, remaining))
+                if not block:
+                    break
+                hasher.update(block)
+                remaining -= len(block)
+
+        logger.info(f"Rebuilt hash state for upload {upload_id} at offset {offset}")
+        return hasher
+
+    def append(self, upload_id, offset, stream, length):
+        """
+        Добавление части файла
+
+        :param upload_id: идентификатор сессии
+        :param offset: смещение части, должно совпадать с принятым размером
+        :param stream: поток тела запроса
+        :param length: размер части в байтах
+        :return: обновленный словарь сессии
+        """
+        part_path = self._part_path(upload_id)
+
+        try:
+            part = open(part_path, 'r+b')
+        except FileNotFoundError:
+            # Собранный или отмененный файл уже перенесен из папки частей
+            upload = self.get(upload_id)
+            if upload is None:
+                raise ChunkedUploadError("Upload not found", 404)
+            raise ChunkedUploadError("Upload already completed", 409, upload['received'])
+
+        with part:
+            # Блокировка файла защищает от параллельной записи из разных воркеров
+            fcntl.flock(part, fcntl.LOCK_EX)
+
+            upload = self.get(upload_id)
+            if upload is None:
+                raise ChunkedUploadError("Upload not found", 404)
+            if upload['state'] != UPLOAD_IN_PROGRESS:
+                raise ChunkedUploadError("Upload already completed", 409, upload['received'])
+            if offset != upload['received']:
+                raise ChunkedUploadError("Offset mismatch", 409, upload['received'])
+            if length <= 0 or length > upload['chunk_size']:
+                raise ChunkedUploadError(f"Chunk size must be between 1 and {upload['chunk_size']} bytes")
+            if offset + length > upload['total_size']:
+                raise ChunkedUploadError("Chunk exceeds declared file size")
+
+            hasher = self._get_hasher(upload_id, offset).copy()
+
+            part.seek(offset)
+            part.truncate()
+
+            written = 0
+            while written < length:
+                block = stream.read(min(COPY_BUFFER_SIZE, length - written))
+                if not block:
+                    break
+                part.write(block)
+                hasher.update(block)
+                written += len(block)
+
+            if written != length:
+                # Обрыв соединения посреди части: откатываемся к началу части
+                part.truncate(offset)
+                raise ChunkedUploadError("Incomplete chunk", 400, offset)
+
+            part.flush()
+            received = offset + written
+
+            with self._lock:
+                self._hashers[upload_id] = (received, hasher)
+
+            conn = self._connect()
+            conn.execute('UPDATE upload_sessions SET received = ?, updated_at = ? WHERE id = ?',
+                         (received, time.time(), upload_id))
+            conn.commit()
+            conn.close()
+
+            if received == upload['total_size']:
+                if upload['content_encoding'] == 'gzip':
+                    self._assemble_compressed(upload)
+                else:
+                    self._assemble(upload, hasher.hexdigest())
+
+        return self.get(upload_id)
+
+    def _assemble(self, upload, sha256, final_path=None):
+        """Перенос собранного файла в хранилище по хешу"""
+        if final_path is None:
+            final_path, _ = self.blob_store.add_file(
+                self._part_path(upload['id']), sha256, upload['total_size'], upload['filename']
+            )
+
+        conn = self._connect()
+        conn.execute('''
+            UPDATE upload_sessions SET state = ?, sha256 = ?, path = ?, updated_at = ? WHERE id = ?
+        ''', (UPLOAD_COMPLETE, sha256, final_path, time.time(), upload['id']))
+        conn.commit()
+        conn.close()
+
+        with self._lock:
+            self._hashers.pop(upload['id'], None)
+
+        logger.info(f"Chunked upload assembled: {upload['filename']} -> {final_path}")
+
+    def _assemble_compressed(self, upload):
+        """
+        Распаковка собранного gzip файла в хранилище
+
+        Хеш и размер считаются по распакованным данным в том же проходе.
+        Поврежденный или слишком большой после распаковки файл отменяет сессию.
+        """
+        part_path = self._part_path(upload['id'])
+        stream = GzipUploadFile(self.blob_store.root, self.max_decompressed_size)
+
+        try:
+            with open(part_path, 'rb') as part:
+                while True:
+                    block = part.read(COPY_BUFFER_SIZE)
+                    if not block:
+                        break
+                    stream.write(block)
+
+            final_path, _, sha256, _ = self.blob_store.add_stream(stream, upload['filename'])
+        except HTTPException as e:
+            stream.discard()
+            self.abort(upload['id'])
+            raise ChunkedUploadError(e.description, e.code)
+
+        os.remove(part_path)
+        self._assemble(upload, sha256, final_path)
+
+    def abort(self, upload_id):
+        """Отмена незавершенной загрузки"""
+        upload = self.get(upload_id)
+        if upload is None:
+            return False
+
+        if upload['state'] == UPLOAD_IN_PROGRESS:
+            try:
+                os.remove(self._part_path(upload_id))
+            except FileNotFoundError:
+                pass
+
+        conn = self._connect()
+        conn.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+        conn.commit()
+        conn.close()
+
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+        return True
+
+    def expire_sessions(self):
+        """
+        Удаление сессий, не обновлявшихся дольше session_ttl
+
+        Недокачанные .part файлы удаляются, собранные файлы остаются в
+        хранилище. Файл, в который сейчас пишет другой процесс (flock),
+        пропускается. Удаляются и .part файлы без записи в БД.
+
+        :return: число удаленных сессий
+        """
+        self._last_cleanup = time.time()
+        if not self.session_ttl:
+            return 0
+        cutoff = self._last_cleanup - self.session_ttl
+
+        conn = self._connect()
+        rows = conn.execute('SELECT id, state FROM upload_sessions WHERE updated_at < ?', (cutoff,)).fetchall()
+        conn.close()
+
+        expired = []
+        for row in rows:
+            if row['state'] == UPLOAD_IN_PROGRESS and not self._remove_part(row['id']):
+                continue
+            expired.append(row['id'])
+
+        if expired:
+            conn = self._connect()
+            conn.executemany('DELETE FROM upload_sessions WHERE id = ?', [(upload_id,) for upload_id in expired])
+            conn.commit()
+            conn.close()
+
+            with self._lock:
+                for upload_id in expired:
+                    self._hashers.pop(upload_id, None)
+            logger.info(f"Expired {len(expired)} chunked upload sessions")
+
+        # .part файлы, оставшиеся от потерянных сессий
+        for name in os.listdir(self.parts_folder):
+            upload_id, extension = os.path.splitext(name)
+            try:
+                if extension == '.part' and os.path.getmtime(self._part_path(upload_id)) < cutoff \
+                        and self.get(upload_id) is None:
+                    self._remove_part(upload_id)
+            except OSError:
+                pass
+
+        return len(expired)
+
+    def _remove_part(self, upload_id):
+        """Удаление .part файла, если в него сейчас никто не пишет"""
+        try:
+            part = open(self._part_path(upload_id), 'r+b')
+        except FileNotFoundError:
+            return True
+
+        with part:
+            try:
+                fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            os.remove(self._part_path(upload_id))
+        return True
+
+    def get_completed(self, upload_id):
+        """Получение завершенной загрузки для постановки в задачу конвертации"""
+        upload = self.get(upload_id)
+        if upload is None or upload['state'] != UPLOAD_COMPLETE or not os.path.exists(upload['path']):
+            return None
+        return upload
+
+
+def remember_upload(upload_id):
+    """Запоминание сессии загрузки в подписанной сессии клиента, создавшего ее"""
+    uploads = [known for known in session.get('uploads', []) if known != upload_id]
+    session['uploads'] = (uploads + [upload_id])[-SESSION_UPLOADS_LIMIT:]
+
+
+def owns_upload(upload):
+    """
+    Принадлежит ли сессия загрузки текущему клиенту
+
+    Загрузка пользователя доступна ему под его учетной записью, загрузка без
+    пользователя - только сессии, которая ее создала (remember_upload).
+    """
+    user = session.get('user')
+    if user and upload['user_id'] is not None and str(upload['user_id']) == str(user['id']):
+        return True
+    return upload['id'] in session.get('uploads', [])
+
+
+def get_owned_upload(upload_manager, upload_id):
+    """Сессия загрузки текущего клиента или None, если ее нет или она чужая"""
+    upload = upload_manager.get(upload_id)
+    if upload is None or not owns_upload(upload):
+        return None
+    return upload
+
+
+def upload_to_response(upload):
+    """Публичное представление сессии загрузки"""
+    response = {
+        'upload_id': upload['id'],
+        'filename': upload['filename'],
+        'size': upload['total_size'],
+        'chunk_size': upload['chunk_size'],
+        'offset': upload['received'],
+        'complete': upload['state'] == UPLOAD_COMPLETE,
+        'upload_url': url_for('chunked_upload_append', upload_id=upload['id'])
+    }
+    if upload['sha256']:
+        response['sha256'] = upload['sha256']
+    if upload['content_encoding']:
+        response['content_encoding'] = upload['content_encoding']
+    return response
+
+
+def setup_chunked_upload_routes(app, upload_manager, allowed_file):
+    """Настройка маршрутов частичной загрузки"""
+
+    def error_response(error):
+        body = {'error': str(error)}
+        if error.offset is not None:
+            body['offset'] = error.offset
+        return jsonify(body), error.status_code
+
+    @app.route('/uploads/chunked', methods=['POST'])
+    def chunked_upload_create():
+        """Создание сессии частичной загрузки"""
+        data = request.get_json(silent=True) or request.form
+        filename = data.get('filename', '')
+
+        try:
+            total_size = int(data.get('size', 0))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid file size'}), 400
+
+        if not filename or not allowed_file(filename):
+            return jsonify({'error': 'Invalid file type'}), 400
+
+        try:
+            original_size = int(data['original_size']) if data.get('original_size') else None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid original file size'}), 400
+
+        user = session.get('user')
+        try:
+            upload = upload_manager.create(
+                filename,
+                total_size,
+                user_id=user['id'] if user else None,
+                sha256=data.get('sha256'),
+                content_encoding=data.get('content_encoding') or None,
+                original_size=original_size
+            )
+        except ChunkedUploadError as e:
+            return error_response(e)
+
+        remember_upload(upload['id'])
+        return jsonify(upload_to_response(upload)), 201
+
+    @app.route('/uploads/chunked/<upload_id>', methods=['GET', 'HEAD'])
+    def chunked_upload_status(upload_id):
+        """Текущее смещение загрузки для возобновления"""
+        upload = get_owned_upload(upload_manager, upload_id)
+        if upload is None:
+            return jsonify({'error': 'Upload not found'}), 404
+
+        response = jsonify(upload_to_response(upload))
+        response.headers['Upload-Offset'] = str(upload['received'])
+        return response
+
+    @app.route('/uploads/chunked/<upload_id>', methods=['PUT', 'PATCH'])
+    def chunked_upload_append(upload_id):
+        """Прием очередной части файла"""
+        offset = request.headers.get('Upload-Offset', request.args.get('offset'))
+        if offset is None or not str(offset).isdigit():
+            return jsonify({'error': 'Upload-Offset header required'}), 400
+
+        length = request.content_length
+        if length is None:
+            return jsonify({'error': 'Content-Length required'}), 411
+
+        if get_owned_upload(upload_manager, upload_id) is None:
+            return jsonify({'error': 'Upload not found'}), 404
+
+        try:
+            upload = upload_manager.append(upload_id, int(offset), request.stream, length)
+        except ChunkedUploadError as e:
+            return error_response(e)
+
+        response = jsonify(upload_to_response(upload))
+        response.headers['Upload-Offset'] = str(upload['received'])
+        return response
+
+    @app.route('/uploads/chunked/<upload_id>', methods=['DELETE'])
+    def chunked_upload_abort(upload_id):
+        """Отмена загрузки"""
+        if get_owned_upload(upload_manager, upload_id) is None or not upload_manager.abort(upload_id):
+            return jsonify({'error': 'Upload not found'}), 404
+        return jsonify({'status': 'aborted'})
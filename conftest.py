@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Общие фикстуры тестов (pytest)
+
+Приложение (main) создается один раз за сессию во временной папке: папки
+загрузок и результатов заданы относительно текущей папки, БД - переменными
+окружения. Фоновые обработчики очереди не запускаются, задачи остаются в очереди
+и удаляются после каждого теста.
+"""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def app_dir(tmp_path_factory):
+    """Рабочая папка приложения на время сессии"""
+    directory = tmp_path_factory.mktemp('app')
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(directory)
+        patch.setenv('JOBS_DB_PATH', str(directory / 'jobs.db'))
+        patch.setenv('DB_PATH', str(directory / 'users_history.db'))
+        yield directory
+
+
+@pytest.fixture(scope='session')
+def main_module(app_dir):
+    import main
+
+    main.create_app(start_workers=False)
+    return main
+
+
+@pytest.fixture
+def flask_app(main_module):
+    yield main_module.app
+
+    conn = sqlite3.connect(main_module.job_queue.db_path)
+    with conn:
+        conn.execute('DELETE FROM job_events')
+        conn.execute('DELETE FROM jobs')
+    conn.close()
+
+
+@pytest.fixture
+def client(flask_app):
+    return flask_app.test_client()
+
+
+@pytest.fixture
+def asgi_request(flask_app):
+    """
+    Вызов ASGI приложения (asgi.py) без сервера
+
+    :return: функция (method, path, body, headers) -> (статус, заголовки, тело)
+    """
+    import asgi
+
+    def request(method, path, body=b'', headers=None):
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+            'method': method, 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+            'root_path': '', 'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1'))
+                        for name, value in (headers or {}).items()]
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(asgi.application(scope, receive, send))
+        start = sent[0]
+        response_headers = {name.decode('latin1'): value.decode('latin1') for name, value in start['headers']}
+        return start['status'], response_headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+    return request
@@ -68,8 +68,8 @@ docker-compose up -d
 # Ожидание запуска
 sleep 5
 
-# Проверка
-if curl -f http://localhost:5000/health > /dev/null 2>&1; then
+# Проверка готовности (БД, место на диске, обработчики очереди)
+if curl -f http://localhost:5000/health/ready > /dev/null 2>&1; then
     echo "✅ Приложение запущено: http://localhost:5000/"
 else
     echo "❌ Ошибка запуска. Проверьте логи: docker-compose logs -f"
@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сжатые варианты файлов результатов
+
+CSV пишется за один проход сразу в несколько файлов: исходный (по настройке)
+и сжатые рядом с ним (name.csv.gz, name.csv.zst). При скачивании вариант
+выбирается по Accept-Encoding: клиент получает сжатый файл как есть с
+Content-Encoding, а исходные байты распаковываются на лету только для
+клиентов без поддержки сжатия, если исходный файл не хранится.
+
+Варианты пишутся во временные файлы (file_naming_utils.temporary_path) и
+переносятся на место готовыми: под зарезервированным именем результата до
+этого лежит пустой файл, который не отдается.
+
+SHA-256 исходных байтов считается в том же проходе и хранится в индексе папки
+(.download_index.db) вместе со списком вариантов: по нему строится ETag
+ответа, а If-None-Match проверяется без чтения файла. Записи индекса кешируются
+в процессе по (mtime, размер) вариантов, поэтому повторная условная проверка
+стоит нескольких stat без открытия БД.
+
+Несколько результатов (общий CSV и CSV отдельных файлов) отдаются одним ZIP,
+который собирается по мере отправки (iter_zip_bundle) без архива на диске.
+
+zstd требует пакета zstandard и без него пропускается.
+"""
+
+import os
+import io
+import gzip
+import time
+import zipfile
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+from file_naming_utils import temporary_path
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger('ifc-exporter')
+
+# Суффиксы файлов сжатых вариантов
+ENCODING_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+
+# Порядок предпочтения при равном q в Accept-Encoding
+ENCODING_PREFERENCE = ['zstd', 'gzip']
+
+# Уровни сжатия: файл пишется один раз, а скачивается многократно
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 10
+
+# Размер блока при распаковке на лету
+DECODE_CHUNK_SIZE = 256 * 1024
+
+# Индекс хешей содержимого внутри папки результатов (скрыт от скачивания)
+DOWNLOAD_INDEX_FILENAME = '.download_index.db'
+
+# Имя исходного варианта в индексе
+IDENTITY = 'identity'
+
+# Кеш записей индекса в процессе: {путь: (подпись вариантов, запись)}
+DIGEST_CACHE_MAX_ENTRIES = 1024
+_digest_cache = OrderedDict()
+_digest_cache_lock = threading.Lock()
+
+
+class DownloadVariant(namedtuple('DownloadVariant', ['path', 'encoding', 'decode'])):
+    """
+    Выбранный для клиента файл
+
+    path - файл на диске, encoding - его сжатие (None - исходный файл),
+    decode - файл нужно распаковать перед отправкой (клиент не поддерживает сжатие).
+    """
+
+
+def parse_encodings(value):
+    """Список сжатий из настройки вида "gzip,zstd" (неизвестные и недоступные пропускаются)"""
+    encodings = []
+    for encoding in (item.strip().lower() for item in (value or '').split(',')):
+        if not encoding or encoding in encodings:
+            continue
+        if encoding not in ENCODING_SUFFIXES:
+            logger.warning(f"Unknown download encoding ignored: {encoding}")
+        elif encoding == 'zstd' and zstandard is None:
+            logger.warning("zstandard is not installed, zstd downloads disabled")
+        else:
+            encodings.append(encoding)
+    return encodings
+
+
+def variant_path(path, encoding):
+    """Путь к варианту файла (None - исходный файл)"""
+    return path + ENCODING_SUFFIXES[encoding] if encoding else path
+
+
+class VariantsWriter(io.RawIOBase):
+    """
+    Запись одних и тех же байтов в исходный файл и сжатые варианты
+
+    Данные пишутся во временные файлы; на место вариантов (paths) они
+    переносятся publish() после закрытия, discard() удаляет их при ошибке.
+    """
+
+    def __init__(self, path, encodings, keep_plain=True):
+        super().__init__()
+        self.path = path
+        self.encodings = []
+        self.paths = []
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self._temp_paths = []
+        self._streams = []
+        self._closers = []
+        try:
+            if keep_plain:
+                self._open(path, None)
+            for encoding in encodings:
+                self._open(path, encoding)
+        except Exception:
+            self.close()
+            self.discard()
+            raise
+
+    def _open(self, path, encoding):
+        target = variant_path(path, encoding)
+        temp_path = temporary_path(target)
+        raw = open(temp_path, 'wb')
+        self._temp_paths.append(temp_path)
+        if encoding == 'gzip':
+            stream = gzip.GzipFile(filename=os.path.basename(path), mode='wb', fileobj=raw,
+                                   compresslevel=GZIP_LEVEL)
+            self._closers.extend([stream, raw])
+        elif encoding == 'zstd':
+            stream = zstandard.ZstdCompressor(level=ZSTD_LEVEL).stream_writer(raw, closefd=False)
+            self._closers.extend([stream, raw])
+        else:
+            stream = raw
+            self._closers.append(raw)
+        self.encodings.append(encoding or IDENTITY)
+        self.paths.append(target)
+        self._streams.append(stream)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        for stream in self._streams:
+            stream.write(data)
+        return len(data)
+
+    def publish(self):
+        """
+        Перенос записанных вариантов на место и запись хеша в индекс папки
+
+        Вызывается после закрытия файла (все буферы сброшены).
+        """
+        for temp_path, target in zip(self._temp_paths, self.paths):
+            os.replace(temp_path, target)
+        self._temp_paths = []
+        record_digest(self.path, self.sha256.hexdigest(), self.size, self.encodings)
+
+    def discard(self):
+        """Удаление временных файлов незавершенной записи"""
+        for temp_path in self._temp_paths:
+            try:
+                os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+        self._temp_paths = []
+
+    def close(self):
+        if not self.closed:
+            for stream in self._closers:
+                stream.close()
+        super().close()
+
+
+def open_variants_writer(path, encodings, keep_plain=True):
+    """
+    Текстовый файл CSV, записываемый сразу во все варианты
+
+    Писатель вариантов (VariantsWriter: paths, publish(), discard()) - в атрибуте variants.
+
+    :param encodings: сжатия вариантов (ENCODING_SUFFIXES)
+    :param keep_plain: сохранять ли исходный файл (без сжатых вариантов - всегда)
+    """
+    raw = VariantsWriter(path, encodings, keep_plain or not encodings)
+    text = io.TextIOWrapper(io.BufferedWriter(raw, DECODE_CHUNK_SIZE), encoding='utf-8', newline='')
+    text.variants = raw
+    return text
+
+
+def _connect_index(directory):
+    """Открытие индекса хешей, хранящегося в самой папке результатов"""
+    conn = sqlite3.connect(os.path.join(directory, DOWNLOAD_INDEX_FILENAME), timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS download_digests (
+            name TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            encodings TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    return conn
+
+
+def record_digest(path, sha256, size, encodings):
+    """Хеш исходных байтов файла и его варианты (IDENTITY - файл без сжатия)"""
+    with _digest_cache_lock:
+        _digest_cache.pop(path, None)
+    conn = _connect_index(os.path.dirname(path) or '.')
+    try:
+        conn.execute('''
+            INSERT OR REPLACE INTO download_digests (name, sha256, size, encodings, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (os.path.basename(path), sha256, size, ','.join(encodings), time.time()))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _variants_signature(path):
+    """(сжатие, mtime_ns, размер) существующих вариантов: меняется при перезаписи файла"""
+    signature = []
+    for encoding in [None] + ENCODING_PREFERENCE:
+        try:
+            stat = os.stat(variant_path(path, encoding))
+        except FileNotFoundError:
+            continue
+        signature.append((encoding, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def lookup_digest(path):
+    """Запись индекса о файле: (sha256, варианты) или None"""
+    signature = _variants_signature(path)
+    with _digest_cache_lock:
+        cached = _digest_cache.get(path)
+        if cached and cached[0] == signature:
+            _digest_cache.move_to_end(path)
+            return cached[1]
+
+    directory = os.path.dirname(path) or '.'
+    if not os.path.exists(os.path.join(directory, DOWNLOAD_INDEX_FILENAME)):
+        return None
+    conn = _connect_index(directory)
+    try:
+        row = conn.execute('SELECT sha256, encodings FROM download_digests WHERE name = ?',
+                           (os.path.basename(path),)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+
+    digest = row[0], [None if encoding == IDENTITY else encoding for encoding in row[1].split(',')]
+    # Файла на диске нет - запись не кешируется, следующий запрос перечитает индекс
+    if signature:
+        with _digest_cache_lock:
+            _digest_cache[path] = (signature, digest)
+            _digest_cache.move_to_end(path)
+            while len(_digest_cache) > DIGEST_CACHE_MAX_ENTRIES:
+                _digest_cache.popitem(last=False)
+    return digest
+
+
+def representation_etag(sha256, encoding):
+    """Сильный ETag варианта: сжатые байты отличаются от исходных, поэтому и ETag свой"""
+    return f"{sha256[:32]}-{encoding}" if encoding else sha256[:32]
+
+
+def cached_etag(path, accept_encoding):
+    """
+    ETag ответа по индексу, без обращения к файлу
+
+    :return: ETag варианта, который получит клиент, или None (файла нет в индексе)
+    """
+    digest = lookup_digest(path)
+    if digest is None:
+        return None
+    sha256, encodings = digest
+    encoding, decode = choose_encoding(encodings, accept_encoding)
+    return representation_etag(sha256, None if decode else encoding)
+
+
+def variant_etag(path, variant):
+    """
+    ETag выбранного варианта
+
+    Файлы, записанные до появления индекса, хешируются один раз при первом скачивании.
+    """
+    digest = lookup_digest(path)
+    if digest is None:
+        sha256, size = hashlib.sha256(), 0
+        source = existing_variants(path)
+        encoding = None if None in source else next(iter(source))
+        with open_decoded(DownloadVariant(source[encoding], encoding, True)) as f:
+            for chunk in iter(lambda: f.read(DECODE_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+                size += len(chunk)
+        record_digest(path, sha256.hexdigest(), size, [encoding or IDENTITY for encoding in source])
+        digest = sha256.hexdigest(), list(source)
+    return representation_etag(digest[0], None if variant.decode else variant.encoding)
+
+
+def existing_variants(path):
+    """
+    Существующие варианты файла: {сжатие или None: путь}
+
+    Пустой файл - имя, зарезервированное под еще не записанный результат
+    (get_next_indexed_filename): такой вариант не учитывается.
+    """
+    variants = {}
+    for encoding in [None] + ENCODING_PREFERENCE:
+        candidate = variant_path(path, encoding)
+        if os.path.isfile(candidate) and os.path.getsize(candidate) > 0:
+            variants[encoding] = candidate
+    return variants
+
+
+def parse_accept_encoding(value):
+    """Заголовок Accept-Encoding: {сжатие: q}"""
+    accepted = {}
+    for item in (value or '').split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip().replace(' ', '')
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted['gzip' if name == 'x-gzip' else name] = q
+    return accepted
+
+
+def choose_encoding(available, accept_encoding):
+    """
+    Выбор варианта по Accept-Encoding среди имеющихся
+
+    :param available: имеющиеся варианты (None - исходный файл)
+    :return: (сжатие или None, нужно ли распаковать перед отправкой)
+    """
+    accepted = parse_accept_encoding(accept_encoding)
+    candidates = [encoding for encoding in ENCODING_PREFERENCE
+                  if encoding in available and accepted.get(encoding, accepted.get('*', 0)) > 0]
+    if candidates:
+        return max(candidates, key=lambda item: accepted.get(item, accepted.get('*', 0))), False
+
+    if None in available:
+        return None, False
+
+    # Исходный файл не хранится - распаковываем вариант, который есть
+    return next(encoding for encoding in ENCODING_PREFERENCE if encoding in available), True
+
+
+def select_variant(path, accept_encoding):
+    """
+    Вариант файла для клиента по Accept-Encoding
+
+    :return: DownloadVariant или None, если файла нет ни в одном варианте
+    """
+    variants = existing_variants(path)
+    if not variants:
+        return None
+
+    encoding, decode = choose_encoding(variants, accept_encoding)
+    return DownloadVariant(variants[encoding], encoding, decode)
+
+
+def open_decoded(variant):
+    """Двоичный поток исходных байтов сжатого варианта"""
+    if variant.encoding == 'gzip':
+        return gzip.open(variant.path, 'rb')
+    if variant.encoding == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstandard is not installed")
+        return zstandard.ZstdDecompressor().stream_reader(open(variant.path, 'rb'), closefd=True)
+    return open(variant.path, 'rb')
+
+
+class _ZipOutput(io.RawIOBase):
+    """Несохраняемый (unseekable) вывод ZipFile: записанные байты забираются блоками"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        """Байты, записанные с прошлого вызова"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip_bundle(entries, chunk_size=DECODE_CHUNK_SIZE):
+    """
+    ZIP архив результатов, формируемый по мере чтения
+
+    Вывод не поддерживает seek, поэтому ZipFile пишет размеры и CRC после
+    данных каждого файла (data descriptor), а архив не собирается целиком ни
+    в памяти, ни на диске. Сжатые варианты распаковываются и сжимаются заново
+    (deflate), исходные CSV читаются как есть.
+
+    :param entries: список (имя в архиве, путь к результату)
+    :return: генератор блоков архива
+    """
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for arcname, path in entries:
+            variant = select_variant(path, None)
+            if variant is None:
+                logger.warning(f"Bundle entry not found: {path}")
+                continue
+
+            info = zipfile.ZipInfo(arcname, time.localtime(os.path.getmtime(variant.path))[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open_decoded(variant) as source, archive.open(info, 'w', force_zip64=True) as target:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    target.write(chunk)
+                    data = output.take()
+                    if data:
+                        yield data
+
+    # Остаток последнего файла и оглавление архива (пишется при закрытии)
+    yield output.take()
+
+
+def iter_decoded(variant, chunk_size=DECODE_CHUNK_SIZE):
+    """Исходные байты сжатого варианта блоками (для ответа Flask)"""
+    with open_decoded(variant) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
@@ -7,13 +7,29 @@
 
 import sys
 import csv
+import json
+import time
+import argparse
 import re
 import os
 import glob
-import ifcopenshell
+import zipfile
+import tempfile
+import threading
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from collections import namedtuple
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from file_naming_utils import get_next_indexed_filename
+from file_naming_utils import get_next_indexed_filename, make_unique_names
+from download_variants import open_variants_writer
+from cancellation import ConversionCancelled
+from lazy_imports import lazy_module, require_modules
+
+# ifcopenshell (с numpy) загружается при первом разборе модели, а не при импорте модуля
+require_modules('ifcopenshell')
+ifcopenshell = lazy_module('ifcopenshell')
 
 # Настройка логгера
 logger = logging.getLogger('ifc-exporter')
@@ -21,30 +37,50 @@ logger = logging.getLogger('ifc-exporter')
 # ------------------------------------------------------------
 # универсальная функция получения p-сетов
 # ------------------------------------------------------------
-try:
-    from ifcopenshell.util.element import get_psets as _get_psets  # nightly/0.7
-except Exception:
+def _load_get_psets():
+    """Функция получения p-сетов для установленной версии ifcopenshell"""
     try:
-        from ifcopenshell.util.pset import get_pset as _get_pset_single  # 0.6
+        from ifcopenshell.util.element import get_psets  # nightly/0.7
+        return get_psets
+    except Exception:
+        pass
 
+    try:
+        from ifcopenshell.util.pset import get_pset as _get_pset_single  # 0.6
 
-        def _get_psets(ent):
+        def _get_psets_single(ent):
             return {k: v for k, v in _get_pset_single(ent).items()}
+
+        return _get_psets_single
     except Exception:
-        def _get_psets(ent):  # fallback
-            res = {}
-            for rel in getattr(ent, "IsDefinedBy", []):
-                if not rel.is_a("IfcRelDefinesByProperties"):
-                    continue
-                pset = rel.RelatingPropertyDefinition
-                if not pset.is_a("IfcPropertySet"):
-                    continue
-                props = {}
-                for p in pset.HasProperties:
-                    if p.is_a("IfcPropertySingleValue") and p.NominalValue:
-                        props[p.Name] = p.NominalValue.wrappedValue
-                res[pset.Name] = props
-            return res
+        pass
+
+    def _get_psets_fallback(ent):  # fallback
+        res = {}
+        for rel in getattr(ent, "IsDefinedBy", []):
+            if not rel.is_a("IfcRelDefinesByProperties"):
+                continue
+            pset = rel.RelatingPropertyDefinition
+            if not pset.is_a("IfcPropertySet"):
+                continue
+            props = {}
+            for p in pset.HasProperties:
+                if p.is_a("IfcPropertySingleValue") and p.NominalValue:
+                    props[p.Name] = p.NominalValue.wrappedValue
+            res[pset.Name] = props
+        return res
+
+    return _get_psets_fallback
+
+
+_get_psets_impl = None
+
+
+def _get_psets(ent):
+    global _get_psets_impl
+    if _get_psets_impl is None:
+        _get_psets_impl = _load_get_psets()
+    return _get_psets_impl(ent)
 
 # ------------------------------------------------------------
 # константы
@@ -75,10 +111,83 @@ MILLI_METRE_FACTOR = 1.0  # 0.000001 — если площадь хранитс
 # Коэффициент площади по умолчанию
 DEFAULT_AREA_COEFFICIENT = 0.9
 
+# Счетчик зон передается в progress не чаще, чем раз в столько зон
+PROGRESS_BATCH_SIZE = 50
+
+# Размер блока при распаковке элемента архива во временный файл
+MEMBER_COPY_BUFFER_SIZE = 1024 * 1024
+
+# Максимум байт, распаковываемых из одного элемента архива (защита от "zip-бомб")
+MAX_ARCHIVE_MEMBER_SIZE = int(os.getenv('MAX_ARCHIVE_MEMBER_SIZE', str(2 * 1024 * 1024 * 1024)))
+
+# Число процессов для параллельного разбора файлов одной задачи
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', str(os.cpu_count() or 1)))
+
+# Пул процессов разбора создается один раз и переиспользуется задачами
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+
 
 # ------------------------------------------------------------
 # helpers
 # ------------------------------------------------------------
+class ArchiveMember(namedtuple('ArchiveMember', ['archive_path', 'member'])):
+    """IFC файл внутри ZIP архива (распаковывается во временный файл только на время разбора)"""
+
+    def __str__(self):
+        return f"{self.archive_path}!{self.member}"
+
+
+def source_stem(source):
+    """Имя источника без пути и расширения (путь к файлу или ArchiveMember)"""
+    if isinstance(source, ArchiveMember):
+        return Path(source.member).stem
+    return Path(source).stem
+
+
+def copy_archive_member(member, target, limit):
+    """Копирование распакованных байт элемента архива, не больше limit байт"""
+    copied = 0
+    for block in iter(lambda: member.read(MEMBER_COPY_BUFFER_SIZE), b''):
+        copied += len(block)
+        if copied > limit:
+            raise ValueError(f"Archive member exceeds {limit} bytes after decompression")
+        target.write(block)
+    return copied
+
+
+def open_ifc_model(source):
+    """
+    Открытие IFC модели из файла или из элемента ZIP архива
+
+    Элемент архива распаковывается потоком во временный файл рядом с архивом
+    и удаляется сразу после разбора: в памяти не держатся ни байты элемента,
+    ни их декодированная копия, только модель ifcopenshell. Распаковывается
+    не больше размера из оглавления архива (проверенного при загрузке)
+    и MAX_ARCHIVE_MEMBER_SIZE.
+    """
+    if not isinstance(source, ArchiveMember):
+        return ifcopenshell.open(source)
+
+    # Расширение .ifc: по нему ifcopenshell выбирает формат разбора
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(source.archive_path), suffix='.ifc',
+                                     delete=False) as temp:
+        try:
+            with zipfile.ZipFile(source.archive_path) as archive:
+                limit = min(archive.getinfo(source.member).file_size, MAX_ARCHIVE_MEMBER_SIZE)
+                with archive.open(source.member) as member:
+                    copy_archive_member(member, temp, limit)
+        except Exception:
+            temp.close()
+            os.remove(temp.name)
+            raise
+
+    try:
+        return ifcopenshell.open(temp.name)
+    finally:
+        os.remove(temp.name)
+
+
 def get_flat_main_group(spatial_zone):
     """Получение основной группы квартиры"""
     for rel in getattr(spatial_zone, "HasAssignments", []):
@@ -274,17 +383,21 @@ def sort_rows_complex(rows):
     rows.sort(key=sort_key)
 
 
-def process_single_ifc(ifc_path, area_coefficient=DEFAULT_AREA_COEFFICIENT):
+def process_single_ifc(ifc_path, area_coefficient=DEFAULT_AREA_COEFFICIENT, progress=None, file_name=None,
+                       cancel=None):
     """
     Обработка одного IFC файла
 
     :param ifc_path: путь к IFC файлу
     :param area_coefficient: коэффициент корректировки площади
+    :param progress: публикатор прогресса (JobProgress) или None
+    :param file_name: имя источника для столбца File (по умолчанию имя файла без расширения)
+    :param cancel: токен отмены (CancellationToken) или None
     :return: список строк данных
     """
     try:
         logger.info(f"Processing IFC file: {ifc_path}")
-        model = ifcopenshell.open(ifc_path)
+        model = open_ifc_model(ifc_path)
         logger.info(f"IFC model loaded successfully. Schema: {model.schema}")
     except Exception as e:
         logger.error(f"Error opening IFC file: {str(e)}")
@@ -294,12 +407,17 @@ def process_single_ifc(ifc_path, area_coefficient=DEFAULT_AREA_COEFFICIENT):
     processed_zones = 0
 
     # Получаем имя файла без пути и расширения
-    file_name = Path(ifc_path).stem
+    if not file_name:
+        file_name = source_stem(ifc_path)
 
     # Обработка всех зон в модели
     logger.info("Starting zone processing...")
 
     for zone in model.by_type("IfcSpatialZone"):
+        # Отмена и срок проверяются на каждой зоне (флаг в БД читается с ограничением частоты)
+        if cancel is not None:
+            cancel.check()
+
         zone_type = (zone.ObjectType or "").strip()
 
         if zone_type not in ALLOWED_ZONE_TYPES:
@@ -308,6 +426,10 @@ def process_single_ifc(ifc_path, area_coefficient=DEFAULT_AREA_COEFFICIENT):
 
         processed_zones += 1
 
+        # Пакетная публикация прогресса: в цикле остается только сравнение
+        if progress is not None and processed_zones % PROGRESS_BATCH_SIZE == 0:
+            progress.zones(file_name, processed_zones)
+
         # Извлечение типа квартиры (убираем префикс)
         flat_type = strip_prefix(zone_type, "BRU_Zone_")
         flat_number = zone.Name or ""
@@ -359,35 +481,188 @@ def process_single_ifc(ifc_path, area_coefficient=DEFAULT_AREA_COEFFICIENT):
         rows.append(row_data)
         logger.debug(f"Processed flat: {flat_number}, type: {flat_type}, area: {area}, storey: {storey_name}")
 
+    if progress is not None:
+        progress.zones(file_name, processed_zones, force=True)
+
     logger.info(f"Processed {processed_zones} zones from {file_name}")
     return rows
 
 
-def export_flats_multiple(ifc_paths, download_dir, area_coefficient=DEFAULT_AREA_COEFFICIENT,
-                          combined_filename=None):
+def _get_extract_pool(max_workers=None):
+    """Общий пул процессов разбора IFC (создается при первом обращении)"""
+    global _extract_pool
+
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            # spawn: пул создается из потоков воркеров очереди, fork там небезопасен
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=max(max_workers or 0, EXTRACT_WORKERS),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _extract_pool
+
+
+def _reset_extract_pool():
+    """Сброс пула после аварийного завершения процесса разбора"""
+    global _extract_pool
+
+    with _extract_pool_lock:
+        if _extract_pool is not None:
+            _extract_pool.shutdown(wait=False, cancel_futures=True)
+            _extract_pool = None
+
+
+def iter_extracted_rows(ifc_paths, area_coefficient=DEFAULT_AREA_COEFFICIENT, progress=None,
+                        file_names=None, workers=None, cancel=None):
     """
-    Обработка нескольких IFC файлов с объединением результатов
+    Разбор IFC файлов в пуле процессов с выдачей результатов по мере готовности
+
+    В работе одновременно не больше workers + 1 файлов: следующий файл
+    отправляется в пул, когда готов один из предыдущих, поэтому память
+    под строки еще не прочитанных результатов ограничена.
+
+    При отмене ожидание прерывается в течение секунды, неначатые файлы
+    снимаются с пула, а уже разбираемые прерываются своим токеном в цикле зон.
 
     :param ifc_paths: список путей к IFC файлам
-    :param download_dir: папка для сохранения CSV
     :param area_coefficient: коэффициент корректировки площади
-    :param combined_filename: имя для объединенного файла
-    :return: путь к созданному CSV файлу
+    :param progress: публикатор прогресса (JobProgress) или None
+    :param file_names: имена источников для столбца File
+    :param workers: число процессов (по умолчанию EXTRACT_WORKERS)
+    :param cancel: токен отмены (CancellationToken) или None
+    :return: генератор (индекс файла, строки или None, ошибка или None)
+    """
+    if not file_names:
+        file_names = [source_stem(ifc_path) for ifc_path in ifc_paths]
+
+    workers = min(workers or EXTRACT_WORKERS, len(ifc_paths))
+    total = len(ifc_paths)
+
+    # Один файл или один процесс - разбираем в текущем процессе
+    if workers <= 1:
+        for index, (ifc_path, file_name) in enumerate(zip(ifc_paths, file_names)):
+            if cancel is not None:
+                cancel.check()
+            if progress is not None:
+                progress.publish('parsing', file=file_name, index=index + 1, total=total)
+            try:
+                yield index, process_single_ifc(ifc_path, area_coefficient, progress, file_name, cancel), None
+            except ConversionCancelled:
+                raise
+            except Exception as e:
+                yield index, None, e
+        return
+
+    pool = _get_extract_pool(workers)
+    pending = {}
+    next_index = 0
+
+    try:
+        while next_index < total or pending:
+            # Дозаполняем ограниченную очередь файлов в работе
+            while next_index < total and len(pending) <= workers:
+                file_name = file_names[next_index]
+                if progress is not None:
+                    progress.publish('parsing', file=file_name, index=next_index + 1, total=total)
+                future = pool.submit(process_single_ifc, ifc_paths[next_index],
+                                     area_coefficient, progress, file_name, cancel)
+                pending[future] = next_index
+                next_index += 1
+
+            # С токеном отмены ожидание прерывается раз в секунду для проверки
+            done, _ = wait(pending, timeout=1.0 if cancel is not None else None, return_when=FIRST_COMPLETED)
+            if cancel is not None:
+                cancel.check()
+
+            for future in done:
+                index = pending.pop(future)
+                try:
+                    yield index, future.result(), None
+                except (BrokenProcessPool, ConversionCancelled):
+                    raise
+                except Exception as e:
+                    yield index, None, e
+    except BrokenProcessPool:
+        _reset_extract_pool()
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def export_flats_table(ifc_paths, download_dir, area_coefficient=DEFAULT_AREA_COEFFICIENT,
+                       combined_filename=None, progress=None, file_names=None, workers=None,
+                       errors=None, cache=None, cache_keys=None, cancel=None, encodings=None,
+                       keep_plain=True, file_outputs=None):
+    """
+    Обработка нескольких IFC файлов с объединением результатов
+
+    Файлы разбираются параллельно (iter_extracted_rows), строки остаются в
+    памяти и возвращаются вместе с CSV, чтобы следующие этапы (подсчет
+    квартир, Google Sheets) не перечитывали файл.
+
+    :param ifc_paths: пути к IFC файлам или элементы архивов (ArchiveMember)
+    :param errors: список, в который добавляются ошибки отдельных файлов
+    :param cache: кеш извлеченных строк (ExtractionCache) или None
+    :param cache_keys: ключи кеша по одному на каждый путь (None - файл не кешируется)
+    :param cancel: токен отмены (CancellationToken) или None
+    :param encodings: сжатые варианты CSV, записываемые в том же проходе ('gzip', 'zstd')
+    :param keep_plain: сохранять ли CSV без сжатия рядом со сжатыми вариантами
+    :param file_outputs: список, в который добавляются (имя источника, путь к CSV) отдельных
+                         файлов; CSV каждого файла пишется из тех же строк, что и общий.
+                         None - только общий CSV
+    :return: (путь к CSV файлу, строки данных без заголовка); без keep_plain на
+             диске есть только сжатые варианты (name.csv.gz, ...)
     """
     if not ifc_paths:
         raise ValueError("No IFC files provided")
 
-    all_rows = []
+    if not file_names:
+        file_names = [source_stem(ifc_path) for ifc_path in ifc_paths]
 
-    # Обрабатываем каждый файл
-    for ifc_path in ifc_paths:
-        try:
-            rows = process_single_ifc(ifc_path, area_coefficient)
-            all_rows.extend(rows)
-        except Exception as e:
-            logger.error(f"Failed to process {ifc_path}: {str(e)}")
+    # Результаты приходят в порядке готовности, порядок файлов восстанавливаем по индексу
+    rows_by_file = [None] * len(ifc_paths)
+
+    if cache is None or not cache_keys:
+        cache_keys = [None] * len(ifc_paths)
+
+    # Неизмененные файлы берем из кеша, в пул отправляются только остальные
+    pending = []
+    for index, cache_key in enumerate(cache_keys):
+        rows = cache.get(cache_key, area_coefficient, file_names[index]) if cache_key else None
+        if rows is None:
+            pending.append(index)
+            continue
+
+        rows_by_file[index] = rows
+        logger.info(f"Extraction cache hit: {file_names[index]} ({len(rows)} rows)")
+        if progress is not None:
+            progress.publish('cached', file=file_names[index], rows=len(rows))
+
+    extracted = iter_extracted_rows([ifc_paths[i] for i in pending], area_coefficient, progress,
+                                    [file_names[i] for i in pending], workers, cancel)
+
+    for pending_index, rows, error in extracted:
+        # Между файлами: отмена не ждет разбора остальных файлов
+        if cancel is not None:
+            cancel.check()
+
+        index = pending[pending_index]
+        if error is not None:
+            logger.error(f"Failed to process {ifc_paths[index]}: {str(error)}")
+            if progress is not None:
+                progress.publish('file_failed', file=file_names[index], error=str(error))
+            if errors is not None:
+                errors.append({'file': file_names[index], 'error': str(error)})
             # Продолжаем с остальными файлами
             continue
+        rows_by_file[index] = rows
+
+        # В кеш попадают строки до нумерации секций и сортировки
+        if cache_keys[index]:
+            cache.put(cache_keys[index], area_coefficient, rows)
+
+    all_rows = [row for rows in rows_by_file if rows for row in rows]
 
     if not all_rows:
         raise ValueError("No data extracted from IFC files")
@@ -405,46 +680,322 @@ def export_flats_multiple(ifc_paths, download_dir, area_coefficient=DEFAULT_AREA
     if combined_filename:
         csv_base_filename = f"{combined_filename}.csv"
     elif len(ifc_paths) == 1:
-        base_name = Path(ifc_paths[0]).stem
-        csv_base_filename = f"{base_name}.csv"
+        csv_base_filename = f"{file_names[0]}.csv"
     else:
         csv_base_filename = "combined_export.csv"
 
+    if progress is not None:
+        progress.publish('writing_csv', rows=len(all_rows))
+
+    csv_path = write_export_csv(download_dir, csv_base_filename, all_rows, encodings, keep_plain)
+
+    # CSV отдельных файлов - из тех же строк: нумерация секций и порядок как в общем CSV
+    if file_outputs is not None:
+        rows_by_name = {}
+        for row in all_rows:
+            rows_by_name.setdefault(row[8], []).append(row)
+        for file_name in file_names:
+            if file_name in rows_by_name:
+                file_path = write_export_csv(download_dir, f"{file_name}.csv", rows_by_name[file_name],
+                                             encodings, keep_plain)
+                file_outputs.append((file_name, file_path))
+
+    return csv_path, all_rows
+
+
+def write_export_csv(download_dir, base_filename, rows, encodings=None, keep_plain=True):
+    """
+    Запись CSV результата под уникальным именем
+
+    :param encodings: сжатые варианты, записываемые в том же проходе
+    :param keep_plain: сохранять ли CSV без сжатия
+    :return: путь к CSV файлу (без keep_plain на диске только сжатые варианты)
+    """
     # Получаем уникальное имя
-    csv_filename = get_next_indexed_filename(download_dir, csv_base_filename)
+    csv_filename = get_next_indexed_filename(download_dir, base_filename)
     csv_path = os.path.join(download_dir, csv_filename)
 
-    # Запись CSV
+    # Запись CSV: исходный файл и сжатые варианты за один проход во временные файлы,
+    # которые переносятся на зарезервированное имя готовыми
+    variants = None
     try:
-        with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        with open_variants_writer(csv_path, encodings or [], keep_plain) as f:
+            variants = f.variants
             writer = csv.writer(f, delimiter=";")
             writer.writerow(CSV_HEADER)
-            writer.writerows(all_rows)
+            writer.writerows(rows)
+        written_paths = variants.paths
+        variants.publish()
+
+        # Имя зарезервировано пустым файлом; если исходный CSV не хранится, убираем его
+        if csv_path not in written_paths:
+            os.remove(csv_path)
 
-        logger.info(f"Successfully exported {len(all_rows)} flats to {csv_path}")
+        logger.info(f"Successfully exported {len(rows)} flats to {csv_path}")
 
-        # Проверка файла
-        if not os.path.exists(csv_path):
-            raise Exception("CSV file was not created")
+        # Проверка файлов
+        for written_path in written_paths:
+            if not os.path.exists(written_path):
+                raise Exception(f"CSV file was not created: {written_path}")
 
-        file_size = os.path.getsize(csv_path)
-        if file_size == 0:
-            raise Exception("CSV file is empty")
+            file_size = os.path.getsize(written_path)
+            if file_size == 0:
+                raise Exception(f"CSV file is empty: {written_path}")
 
-        logger.info(f"CSV file created: {csv_filename} ({file_size} bytes)")
+            logger.info(f"CSV file created: {os.path.basename(written_path)} ({file_size} bytes)")
 
     except Exception as e:
         logger.error(f"CSV write error: {str(e)}")
+        if variants is not None:
+            variants.discard()
+        # Пустой файл, занимавший имя, результатом не станет
+        if os.path.exists(csv_path) and os.path.getsize(csv_path) == 0:
+            os.remove(csv_path)
         raise Exception(f"Failed to write CSV file: {str(e)}")
 
     return csv_path
 
 
+def export_flats_multiple(ifc_paths, download_dir, area_coefficient=DEFAULT_AREA_COEFFICIENT,
+                          combined_filename=None, progress=None, file_names=None, cancel=None,
+                          file_outputs=None):
+    """
+    Обработка нескольких IFC файлов с объединением результатов
+
+    :param ifc_paths: список путей к IFC файлам
+    :param download_dir: папка для сохранения CSV
+    :param area_coefficient: коэффициент корректировки площади
+    :param combined_filename: имя для объединенного файла
+    :param progress: публикатор прогресса (JobProgress) или None
+    :param file_names: имена источников для столбца File, по одному на каждый путь
+    :param cancel: токен отмены (CancellationToken) или None
+    :param file_outputs: список для (имя источника, путь к CSV) отдельных файлов или None
+    :return: путь к созданному CSV файлу
+    """
+    csv_path, _ = export_flats_table(ifc_paths, download_dir, area_coefficient,
+                                     combined_filename, progress, file_names, cancel=cancel,
+                                     file_outputs=file_outputs)
+    return csv_path
+
+
 # Обратная совместимость - оставляем старую функцию
-def export_flats(ifc_path, download_dir, original_filename=None):
+def export_flats(ifc_path, download_dir, original_filename=None, progress=None):
     """
     Обрабатывает IFC-файл и сохраняет CSV (обратная совместимость)
     """
+    file_names = [Path(original_filename).stem] if original_filename else None
     return export_flats_multiple([ifc_path], download_dir,
                                  DEFAULT_AREA_COEFFICIENT,
-                                 original_filename)
\ No newline at end of file
+                                 original_filename,
+                                 progress,
+                                 file_names)
+
+
+# ------------------------------------------------------------
+# пакетная конвертация из командной строки
+# ------------------------------------------------------------
+# Манифест выполненных файлов в папке результатов (для возобновления)
+MANIFEST_FILENAME = '.export_manifest.jsonl'
+
+
+def collect_ifc_paths(inputs):
+    """
+    Список IFC файлов по папкам (рекурсивно) и glob шаблонам
+
+    :param inputs: пути к файлам, папкам или шаблоны вида "models/**/*.ifc"
+    :return: отсортированный список абсолютных путей без повторов
+    """
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, '**', '*.ifc'), recursive=True)
+        else:
+            matches = glob.glob(item, recursive=True)
+        paths.update(os.path.abspath(path) for path in matches
+                     if os.path.isfile(path) and path.lower().endswith('.ifc'))
+    return sorted(paths)
+
+
+def load_manifest(manifest_path):
+    """Последние записи манифеста по путям файлов"""
+    entries = {}
+    if not os.path.exists(manifest_path):
+        return entries
+
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Последняя строка могла оборваться при аварийной остановке
+                continue
+            entries[entry['path']] = entry
+    return entries
+
+
+def read_rows_csv(csv_path):
+    """Строки ранее записанного CSV в виде, пригодном для объединения"""
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f, delimiter=';')
+        next(reader, None)
+        rows = []
+        for row in reader:
+            row[4] = ""  # Section№ пересчитывается для объединенного файла
+            row[5] = int(row[5]) if row[5].isdigit() else row[5]
+            rows.append(row)
+    return rows
+
+
+def write_rows_csv(csv_path, rows):
+    """Запись строк в CSV с заголовком (через временный файл)"""
+    temp_path = f"{csv_path}.tmp"
+    with open(temp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(CSV_HEADER)
+        writer.writerows(rows)
+    os.replace(temp_path, csv_path)
+
+
+def main(argv=None):
+    """Пакетная конвертация папок с IFC файлами с возобновлением по манифесту"""
+    parser = argparse.ArgumentParser(
+        description="Экспорт квартир из IFC файлов в CSV (по файлу и объединенный)"
+    )
+    parser.add_argument('inputs', nargs='+', help="IFC файлы, папки (рекурсивно) или glob шаблоны")
+    parser.add_argument('-o', '--output-dir', default='downloads', help="папка для CSV (по умолчанию downloads)")
+    parser.add_argument('-j', '--jobs', type=int, default=EXTRACT_WORKERS,
+                        help=f"число процессов разбора (по умолчанию {EXTRACT_WORKERS})")
+    parser.add_argument('-c', '--coefficient', type=float, default=DEFAULT_AREA_COEFFICIENT,
+                        help=f"коэффициент площади (по умолчанию {DEFAULT_AREA_COEFFICIENT})")
+    parser.add_argument('--combined', metavar='NAME', help="дополнительно записать объединенный NAME.csv")
+    parser.add_argument('--formats', metavar='LIST', default='',
+                        help="форматы объединенного результата кроме CSV: parquet, arrow, xlsx (через запятую)")
+    parser.add_argument('--restart', action='store_true', help="игнорировать манифест и обработать все файлы заново")
+    parser.add_argument('-v', '--verbose', action='store_true', help="подробный журнал")
+    args = parser.parse_args(argv)
+
+    # Писатели форматов импортируют CSV_HEADER из этого модуля, поэтому импорт - здесь
+    from export_writers import EXPORT_WRITERS, parse_formats
+
+    try:
+        formats = parse_formats(args.formats)
+    except ValueError as e:
+        parser.error(str(e))
+    if formats and not args.combined:
+        parser.error("--formats requires --combined")
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+
+    ifc_paths = collect_ifc_paths(args.inputs)
+    if not ifc_paths:
+        print("No IFC files found", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = os.path.join(args.output_dir, MANIFEST_FILENAME)
+    manifest = {} if args.restart else load_manifest(manifest_path)
+
+    # Имена детерминированы порядком файлов, поэтому совпадают между запусками
+    file_names = make_unique_names(ifc_paths)
+    csv_paths = [os.path.join(args.output_dir, f"{name}.csv") for name in file_names]
+
+    # Файлы, не изменившиеся с прошлого запуска, пропускаем. Размер и время изменения
+    # берутся до разбора: файл, измененный во время запуска, будет обработан в следующем
+    stats = [os.stat(ifc_path) for ifc_path in ifc_paths]
+    # Файлы, CSV которых актуален и входит в объединенный результат
+    converted = [False] * len(ifc_paths)
+    pending = []
+    for index, ifc_path in enumerate(ifc_paths):
+        stat = stats[index]
+        entry = manifest.get(ifc_path)
+        if (entry and entry['status'] == 'ok' and entry['size'] == stat.st_size
+                and entry['mtime_ns'] == stat.st_mtime_ns and entry['coefficient'] == args.coefficient
+                and entry['csv'] == os.path.basename(csv_paths[index]) and os.path.exists(csv_paths[index])):
+            converted[index] = True
+            continue
+        pending.append(index)
+
+    skipped = len(ifc_paths) - len(pending)
+    print(f"{len(ifc_paths)} files found, {skipped} already converted, {len(pending)} to process "
+          f"with {args.jobs} processes")
+
+    started = time.monotonic()
+    done_files = 0
+    done_zones = 0
+    failed = 0
+
+    with open(manifest_path, 'a', encoding='utf-8') as manifest_file:
+        extracted = iter_extracted_rows([ifc_paths[i] for i in pending], args.coefficient, None,
+                                        [file_names[i] for i in pending], args.jobs)
+
+        for pending_index, rows, error in extracted:
+            index = pending[pending_index]
+            ifc_path = ifc_paths[index]
+            stat = stats[index]
+            entry = {
+                'path': ifc_path,
+                'size': stat.st_size,
+                'mtime_ns': stat.st_mtime_ns,
+                'coefficient': args.coefficient,
+                'csv': os.path.basename(csv_paths[index]),
+                'finished_at': time.time()
+            }
+
+            if error is not None:
+                failed += 1
+                entry.update(status='error', error=str(error))
+                print(f"  FAILED {ifc_path}: {error}", file=sys.stderr)
+                # CSV прошлого запуска устарел: в объединенный результат он не попадает
+                try:
+                    os.remove(csv_paths[index])
+                except FileNotFoundError:
+                    pass
+            else:
+                # CSV по файлу: своя нумерация секций и сортировка
+                file_rows = assign_section_numbers_improved([list(row) for row in rows])
+                sort_rows_complex(file_rows)
+                write_rows_csv(csv_paths[index], file_rows)
+                entry.update(status='ok', rows=len(rows))
+                converted[index] = True
+                done_zones += len(rows)
+
+            done_files += 1
+            manifest_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            manifest_file.flush()
+
+            elapsed = max(time.monotonic() - started, 1e-6)
+            print(f"[{done_files}/{len(pending)}] {file_names[index]}: {entry.get('rows', 0)} zones | "
+                  f"{done_files / elapsed:.2f} files/s, {done_zones / elapsed:.0f} zones/s")
+
+    elapsed = time.monotonic() - started
+    print(f"Processed {done_files} files ({failed} failed), {done_zones} zones in {elapsed:.1f}s"
+          + (f" - {done_files / elapsed:.2f} files/s, {done_zones / elapsed:.0f} zones/s" if elapsed > 0 else ""))
+
+    # Объединенный CSV собирается из актуальных CSV по файлам, включая обработанные в прошлых
+    # запусках; файлы с ошибкой в него не входят
+    if args.combined:
+        all_rows = []
+        for index, csv_path in enumerate(csv_paths):
+            if converted[index]:
+                all_rows.extend(read_rows_csv(csv_path))
+
+        if all_rows:
+            all_rows = assign_section_numbers_improved(all_rows)
+            sort_rows_complex(all_rows)
+            combined_path = os.path.join(args.output_dir, f"{args.combined}.csv")
+            write_rows_csv(combined_path, all_rows)
+            print(f"Combined CSV: {combined_path} ({len(all_rows)} rows)")
+
+            # Те же строки с типами значений (площади - числа, а не строки с запятой)
+            for export_format in formats:
+                writer = EXPORT_WRITERS[export_format]()
+                export_path = os.path.join(args.output_dir, f"{args.combined}{writer.extension}")
+                writer.write(export_path, all_rows)
+                print(f"Combined {export_format}: {export_path} ({os.path.getsize(export_path)} bytes)")
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
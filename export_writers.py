@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Дополнительные форматы результатов: Parquet, Arrow IPC, XLSX
+
+CSV с разделителем ';' и запятой в дробной части удобен для Excel, но при
+загрузке в аналитику числа приходится разбирать заново. Здесь те же строки,
+что пишутся в CSV (столбцы CSV_HEADER), сохраняются с типами:
+
+- parquet, arrow: площади float64, номера секции и этажа int32, повторяющиеся
+  строковые столбцы (тип, секция, этаж, файл) - словарные; сжатие zstd;
+- xlsx: строки пишутся потоково (constant_memory), площади и номера - числа.
+
+Формат подключается через register_writer(); библиотеки (pyarrow, XlsxWriter)
+необязательны и загружаются при первой записи.
+"""
+
+import os
+import hashlib
+import logging
+import mimetypes
+import importlib.util
+from abc import ABC, abstractmethod
+
+from lazy_imports import lazy_module
+from export_flats import CSV_HEADER
+from file_naming_utils import get_next_indexed_filename, temporary_path
+from download_variants import record_digest, IDENTITY
+
+logger = logging.getLogger('ifc-exporter')
+
+pa = lazy_module('pyarrow')
+pq = lazy_module('pyarrow.parquet')
+xlsxwriter = lazy_module('xlsxwriter')
+
+# Номера столбцов CSV_HEADER по типам значений
+FLOAT_COLUMNS = {1, 2}
+INT_COLUMNS = {4, 5}
+DICTIONARY_COLUMNS = {0, 3, 6, 8}
+
+# Типы содержимого для скачивания
+mimetypes.add_type('application/vnd.apache.parquet', '.parquet')
+mimetypes.add_type('application/vnd.apache.arrow.file', '.arrow')
+
+# Зарегистрированные форматы: {имя: класс писателя}
+EXPORT_WRITERS = {}
+
+
+def register_writer(name, writer_class):
+    """Подключение формата результата"""
+    EXPORT_WRITERS[name] = writer_class
+    return writer_class
+
+
+def _to_float(value):
+    """Площадь из строки с запятой ('45,3') или числа; None - пусто"""
+    if value in ('', None):
+        return None
+    try:
+        return float(str(value).replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def _to_int(value):
+    """Номер секции или этажа; None - пусто"""
+    if value in ('', None):
+        return None
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def typed_columns(rows):
+    """Строки CSV -> столбцы значений с типами (float, int, str)"""
+    columns = [[] for _ in CSV_HEADER]
+    for row in rows:
+        for index, value in enumerate(row):
+            if index in FLOAT_COLUMNS:
+                value = _to_float(value)
+            elif index in INT_COLUMNS:
+                value = _to_int(value)
+            else:
+                value = '' if value is None else str(value)
+            columns[index].append(value)
+    return columns
+
+
+class ExportWriter(ABC):
+    """Писатель формата: имя, расширение, необходимые библиотеки и запись строк в файл"""
+
+    name = None
+    extension = None
+    requires = ()
+
+    @classmethod
+    def available(cls):
+        """Установлены ли библиотеки формата (без их загрузки)"""
+        return all(importlib.util.find_spec(module) is not None for module in cls.requires)
+
+    @abstractmethod
+    def write(self, path, rows):
+        """Запись строк результата (в порядке столбцов CSV_HEADER) в файл path"""
+
+
+class ArrowTableWriter(ExportWriter):
+    """Общая часть Parquet и Arrow IPC: таблица pyarrow со словарными строковыми столбцами"""
+
+    requires = ('pyarrow',)
+
+    def table(self, rows):
+        arrays = []
+        for index, values in enumerate(typed_columns(rows)):
+            if index in FLOAT_COLUMNS:
+                arrays.append(pa.array(values, type=pa.float64()))
+            elif index in INT_COLUMNS:
+                arrays.append(pa.array(values, type=pa.int32()))
+            elif index in DICTIONARY_COLUMNS:
+                arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, type=pa.string()))
+        return pa.Table.from_arrays(arrays, names=CSV_HEADER)
+
+
+class ParquetWriter(ArrowTableWriter):
+    name = 'parquet'
+    extension = '.parquet'
+
+    def write(self, path, rows):
+        pq.write_table(self.table(rows), path, compression='zstd')
+
+
+class ArrowWriter(ArrowTableWriter):
+    name = 'arrow'
+    extension = '.arrow'
+
+    def write(self, path, rows):
+        table = self.table(rows)
+        options = pa.ipc.IpcWriteOptions(compression='zstd')
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema, options=options) as writer:
+            writer.write_table(table)
+
+
+class XlsxWriter(ExportWriter):
+    name = 'xlsx'
+    extension = '.xlsx'
+    requires = ('xlsxwriter',)
+
+    def write(self, path, rows):
+        # constant_memory: строки сбрасываются на диск по мере записи, а не хранятся до закрытия
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        try:
+            sheet = workbook.add_worksheet('Flats')
+            header = workbook.add_format({'bold': True})
+            area = workbook.add_format({'num_format': '0.00'})
+            sheet.write_row(0, 0, CSV_HEADER, header)
+            sheet.freeze_panes(1, 0)
+
+            for row_index, row in enumerate(rows, start=1):
+                for column, value in enumerate(row):
+                    if column in FLOAT_COLUMNS:
+                        number = _to_float(value)
+                        if number is not None:
+                            sheet.write_number(row_index, column, number, area)
+                    elif column in INT_COLUMNS:
+                        number = _to_int(value)
+                        if number is not None:
+                            sheet.write_number(row_index, column, number)
+                    elif value not in ('', None):
+                        sheet.write_string(row_index, column, str(value))
+        finally:
+            workbook.close()
+
+
+for _writer in (ParquetWriter, ArrowWriter, XlsxWriter):
+    register_writer(_writer.name, _writer)
+
+
+def available_formats():
+    """Форматы, библиотеки которых установлены"""
+    return [name for name, writer in EXPORT_WRITERS.items() if writer.available()]
+
+
+def parse_formats(value):
+    """
+    Список форматов из запроса ("parquet,xlsx" или список)
+
+    :raises ValueError: неизвестный формат или формат без установленной библиотеки
+    """
+    if not value:
+        return []
+    items = [value] if isinstance(value, str) else value
+    formats = []
+    for name in (name.strip().lower() for item in items for name in str(item).split(',')):
+        if not name or name == 'csv' or name in formats:
+            continue
+        if name not in EXPORT_WRITERS:
+            raise ValueError(f"Unknown export format: {name}")
+        if not EXPORT_WRITERS[name].available():
+            raise ValueError(f"Export format {name} is not available on this server "
+                             f"(requires {', '.join(EXPORT_WRITERS[name].requires)})")
+        formats.append(name)
+    return formats
+
+
+def write_export(fmt, download_dir, base_name, rows):
+    """
+    Запись строк результата в формате fmt под уникальным именем
+
+    Хеш файла записывается в индекс результатов (ETag при скачивании).
+
+    :return: путь к файлу
+    """
+    writer = EXPORT_WRITERS[fmt]()
+    filename = get_next_indexed_filename(download_dir, f"{base_name}{writer.extension}")
+    path = os.path.join(download_dir, filename)
+
+    # Файл пишется рядом и переносится на зарезервированное имя готовым
+    temp_path = temporary_path(path)
+    try:
+        writer.write(temp_path, rows)
+
+        sha256 = hashlib.sha256()
+        with open(temp_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        size = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+    except Exception:
+        # Ни недописанный файл, ни пустое зарезервированное имя не должны остаться результатом
+        for leftover in (temp_path, path):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+
+    record_digest(path, sha256.hexdigest(), size, [IDENTITY])
+
+    logger.info(f"Export file created: {filename} ({size} bytes, {len(rows)} rows)")
+    return path
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Кеш результатов разбора IFC файлов по хешу содержимого
+
+Разбор модели - самый долгий этап конвертации, а одни и те же файлы часто
+конвертируются повторно (общие папки проекта, повторная загрузка). Строки
+квартир сохраняются по SHA-256 файла и коэффициенту площади, при повторной
+конвертации неизмененный файл не открывается вовсе.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import logging
+
+logger = logging.getLogger('ifc-exporter')
+
+# Версия формата строк: увеличивается при изменении логики извлечения,
+# чтобы старые записи кеша не использовались
+EXTRACTION_CACHE_VERSION = 1
+
+# Столбец File в строках (заполняется именем источника при чтении из кеша)
+FILE_COLUMN = 8
+
+
+class ExtractionCache:
+    """Кеш строк квартир, извлеченных из IFC файлов"""
+
+    def __init__(self, db_path=None, max_entries=None):
+        """
+        :param db_path: путь к БД кеша
+        :param max_entries: максимальное число записей (старые по использованию удаляются)
+        """
+        self.db_path = db_path or os.getenv('JOBS_DB_PATH', 'jobs.db')
+        self.max_entries = max_entries or int(os.getenv('EXTRACTION_CACHE_MAX_ENTRIES', '1000'))
+        self.setup_database()
+
+    def _connect(self):
+        """Открытие соединения с БД кеша"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def setup_database(self):
+        """Создание таблицы кеша"""
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                cache_key TEXT NOT NULL,
+                area_coefficient REAL NOT NULL,
+                version INTEGER NOT NULL,
+                rows TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL,
+                PRIMARY KEY (cache_key, area_coefficient, version)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_extraction_cache_used ON extraction_cache (last_used_at)')
+        conn.commit()
+        conn.close()
+
+    def get(self, cache_key, area_coefficient, file_name):
+        """
+        Строки ранее разобранного файла
+
+        :param cache_key: ключ файла (sha256, для элементов архива - sha256 архива и имя элемента)
+        :param area_coefficient: коэффициент площади, с которым считались строки
+        :param file_name: имя источника для столбца File
+        :return: список строк или None
+        """
+        conn = self._connect()
+        row = conn.execute('''
+            SELECT rows FROM extraction_cache WHERE cache_key = ? AND area_coefficient = ? AND version = ?
+        ''', (cache_key, area_coefficient, EXTRACTION_CACHE_VERSION)).fetchone()
+
+        if row is None:
+            conn.close()
+            return None
+
+        conn.execute('''
+            UPDATE extraction_cache SET last_used_at = ? WHERE cache_key = ? AND area_coefficient = ? AND version = ?
+        ''', (time.time(), cache_key, area_coefficient, EXTRACTION_CACHE_VERSION))
+        conn.commit()
+        conn.close()
+
+        rows = json.loads(row['rows'])
+        for data_row in rows:
+            data_row[FILE_COLUMN] = file_name
+        return rows
+
+    def put(self, cache_key, area_coefficient, rows):
+        """Сохранение строк разобранного файла (до нумерации секций)"""
+        now = time.time()
+
+        conn = self._connect()
+        conn.execute('''
+            INSERT OR REPLACE INTO extraction_cache
+            (cache_key, area_coefficient, version, rows, created_at, last_used_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (cache_key, area_coefficient, EXTRACTION_CACHE_VERSION, json.dumps(rows, ensure_ascii=False), now, now))
+
+        # Ограничение размера кеша: удаляем давно не использованные записи
+        conn.execute('''
+            DELETE FROM extraction_cache WHERE rowid IN (
+                SELECT rowid FROM extraction_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (self.max_entries,))
+        conn.commit()
+        conn.close()
+
+
+def cache_key_for(file_info):
+    """
+    Ключ кеша для файла задачи
+
+    :param file_info: описание файла из payload задачи (sha256, для архивов - member)
+    :return: ключ или None, если хеш файла неизвестен
+    """
+    if not file_info.get('sha256'):
+        return None
+    if file_info.get('member'):
+        return f"{file_info['sha256']}:{file_info['member']}"
+    return file_info['sha256']
@@ -6,15 +6,93 @@
 
 import os
 import re
+import uuid
+import sqlite3
+
+# Индекс счетчиков имен внутри директории с файлами (скрыт от скачивания)
+NAMING_INDEX_FILENAME = '.naming_index.db'
+
+# Сжатые варианты файла (download_variants.py) занимают то же имя
+VARIANT_SUFFIXES = r'(?:\.gz|\.zst)?'
+
+
+def _connect_naming_index(directory):
+    """Открытие индекса счетчиков имен, хранящегося в самой директории"""
+    conn = sqlite3.connect(os.path.join(directory, NAMING_INDEX_FILENAME), timeout=30)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS name_counters (
+            name TEXT PRIMARY KEY,
+            next_index INTEGER NOT NULL
+        )
+    ''')
+    conn.commit()
+    return conn
+
+
+def _scan_next_index(directory, name_part, ext_part):
+    """
+    Начальное значение счетчика для имени, которого еще нет в индексе
+
+    Директория просматривается один раз на имя, чтобы учесть файлы,
+    созданные до появления индекса (в том числе сжатые варианты name.csv.gz).
+
+    :return: 0, если свободно исходное имя, иначе максимальный индекс + 1
+    """
+    pattern = re.compile(rf"^{re.escape(name_part)}_(\d+){re.escape(ext_part)}{VARIANT_SUFFIXES}$")
+    base_pattern = re.compile(rf"^{re.escape(name_part)}{re.escape(ext_part)}{VARIANT_SUFFIXES}$")
+    base_exists = False
+    max_index = 0
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if base_pattern.match(entry.name):
+                base_exists = True
+                continue
+            match = pattern.match(entry.name)
+            if match:
+                max_index = max(max_index, int(match.group(1)))
+
+    if max_index:
+        return max_index + 1
+    return 1 if base_exists else 0
+
+
+def _allocate_index(conn, directory, safe_filename, name_part, ext_part):
+    """Атомарная выдача следующего индекса для имени"""
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute(
+            'SELECT next_index FROM name_counters WHERE name = ?', (safe_filename,)
+        ).fetchone()
+        index = row[0] if row else _scan_next_index(directory, name_part, ext_part)
+
+        conn.execute(
+            'INSERT OR REPLACE INTO name_counters (name, next_index) VALUES (?, ?)',
+            (safe_filename, index + 1)
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return index
 
 
 def get_next_indexed_filename(directory, base_filename):
     """
-    Получает следующее доступное имя файла с числовой индексацией
+    Резервирует следующее доступное имя файла с числовой индексацией
+
+    Индекс берется из счетчика в SQLite (.naming_index.db в той же директории),
+    а файл сразу создается с O_EXCL, поэтому одновременные запросы не получат
+    одно и то же имя, а выдача не требует перебора name_1, name_2, ...
+
+    Созданный файл пуст и только занимает имя: результат пишется во временный
+    файл (temporary_path) и переносится на его место готовым (os.replace).
+    Пустой файл при скачивании не отдается (download_variants.existing_variants).
 
     :param directory: директория для проверки
     :param base_filename: базовое имя файла
-    :return: уникальное имя файла
+    :return: уникальное имя файла (пустой файл с этим именем уже создан)
     """
     # Очищаем имя от недопустимых символов
     safe_filename = re.sub(r'[<>:"/\\|?*]', '_', base_filename)
@@ -23,30 +101,62 @@ def get_next_indexed_filename(directory, base_filename):
     name_part = os.path.splitext(safe_filename)[0]
     ext_part = os.path.splitext(safe_filename)[1]
 
-    # Полный путь к файлу
-    full_path = os.path.join(directory, safe_filename)
+    os.makedirs(directory, exist_ok=True)
+    conn = _connect_naming_index(directory)
 
-    # Если файл не существует, возвращаем оригинальное имя
-    if not os.path.exists(full_path):
-        return safe_filename
+    try:
+        while True:
+            index = _allocate_index(conn, directory, safe_filename, name_part, ext_part)
+            indexed_filename = f"{name_part}_{index}{ext_part}" if index else safe_filename
 
-    # Ищем следующий доступный индекс
-    index = 1
-    while True:
-        indexed_filename = f"{name_part}_{index}{ext_part}"
-        indexed_path = os.path.join(directory, indexed_filename)
+            try:
+                fd = os.open(os.path.join(directory, indexed_filename), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+                return indexed_filename
+            except FileExistsError:
+                # Файл создан в обход индекса - берем следующий индекс
+                continue
+    finally:
+        conn.close()
 
-        if not os.path.exists(indexed_path):
-            return indexed_filename
 
-        index += 1
+def temporary_path(path):
+    """
+    Скрытый временный файл рядом с path для записи результата
 
-        # Защита от бесконечного цикла (максимум 1000 файлов)
-        if index > 1000:
-            # Используем timestamp как fallback
-            import uuid
-            timestamp = uuid.uuid4().hex[:8]
-            return f"{name_part}_{timestamp}{ext_part}"
+    Та же папка (os.replace без копирования), то же расширение (библиотеки
+    форматов проверяют его), точка в начале имени - файл не отдается при
+    скачивании и не учитывается при выдаче индексов.
+    """
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{uuid.uuid4().hex[:12]}.{name}")
+
+
+def make_unique_names(filenames):
+    """
+    Имена источников без расширения, уникальные в пределах одной конвертации
+
+    Одинаковые имена получают числовой индекс, как при сохранении файлов:
+    ["A.ifc", "A.ifc", "B.ifc"] -> ["A", "A_1", "B"]
+
+    :param filenames: исходные имена файлов
+    :return: список уникальных имен
+    """
+    used = set()
+    result = []
+
+    for filename in filenames:
+        name_part = os.path.splitext(os.path.basename(filename))[0]
+        unique_name = name_part
+        index = 1
+        while unique_name in used:
+            unique_name = f"{name_part}_{index}"
+            index += 1
+
+        used.add(unique_name)
+        result.append(unique_name)
+
+    return result
 
 
 def get_unique_sheet_name(spreadsheet, base_name):
@@ -3,13 +3,18 @@
 Включает форматирование столбцов и выравнивание
 """
 
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import os
 import csv
 import logging
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from file_naming_utils import get_unique_sheet_name, sanitize_sheet_name
+from lazy_imports import lazy_module, require_modules
+
+# Клиент Google API загружается при первой выгрузке, а не при старте приложения
+require_modules('gspread', 'oauth2client')
+gspread = lazy_module('gspread')
+service_account = lazy_module('oauth2client.service_account')
 
 # Настройка логгера
 logger = logging.getLogger('ifc-exporter')
@@ -22,6 +27,9 @@ try:
 except ImportError:
     logger.info("python-dotenv not installed, using system environment variables")
 
+# Потоки для создания вкладок параллельно с обработкой IFC
+_sheets_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='gsheets')
+
 
 def validate_gs_credentials():
     """Проверка наличия всех необходимых переменных окружения"""
@@ -39,14 +47,15 @@ def validate_gs_credentials():
         raise ValueError("Please replace placeholder values in .env file with actual Google API credentials")
 
 
-def upload_to_google_sheets(csv_path, original_filename):
+def create_worksheet(original_filename):
     """
-    Загрузка CSV в существующую Google Sheets таблицу как новую вкладку
-    с правильным форматированием столбцов
+    Создание новой вкладки в существующей Google Sheets таблице
+
+    Не зависит от данных, поэтому может выполняться параллельно с разбором
+    IFC файлов (см. prepare_worksheet_async).
 
-    :param csv_path: путь к CSV файлу
     :param original_filename: оригинальное имя IFC файла
-    :return: URL таблицы
+    :return: (таблица, созданная вкладка)
     """
 
     try:
@@ -75,7 +84,7 @@ def upload_to_google_sheets(csv_path, original_filename):
             "client_x509_cert_url": os.getenv("GS_CLIENT_X509_CERT_URL")
         }
 
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+        creds = service_account.ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
         client = gspread.authorize(creds)
         logger.info("Authenticated with Google Sheets API")
 
@@ -103,10 +112,55 @@ def upload_to_google_sheets(csv_path, original_filename):
             logger.error(f"Failed to create worksheet: {str(e)}")
             raise
 
-        # Чтение и загрузка данных из CSV
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            csv_reader = csv.reader(f, delimiter=';')
-            data = list(csv_reader)
+        return spreadsheet, worksheet
+
+    except Exception as e:
+        logger.error(f"Google Sheets worksheet creation error: {str(e)}", exc_info=True)
+        raise
+
+
+def prepare_worksheet_async(original_filename):
+    """
+    Запуск создания вкладки в фоновом потоке
+
+    :return: Future с результатом create_worksheet
+    """
+    return _sheets_executor.submit(create_worksheet, original_filename)
+
+
+def discard_worksheet(target):
+    """Удаление заранее созданной вкладки, если экспорт не удался"""
+    spreadsheet, worksheet = target
+    try:
+        spreadsheet.del_worksheet(worksheet)
+        logger.info(f"Removed unused worksheet: {worksheet.title}")
+    except Exception as e:
+        logger.warning(f"Failed to remove unused worksheet: {str(e)}")
+
+
+def upload_to_google_sheets(csv_path, original_filename, data=None, target=None):
+    """
+    Загрузка CSV в существующую Google Sheets таблицу как новую вкладку
+    с правильным форматированием столбцов
+
+    :param csv_path: путь к CSV файлу
+    :param original_filename: оригинальное имя IFC файла
+    :param data: строки CSV вместе с заголовком, если они уже есть в памяти
+    :param target: (таблица, вкладка) из create_worksheet, если вкладка создана заранее
+    :return: URL таблицы
+    """
+
+    try:
+        if target is None:
+            target = create_worksheet(original_filename)
+        spreadsheet, worksheet = target
+        sheet_name = worksheet.title
+
+        # Чтение данных из CSV, если они не переданы из памяти
+        if data is None:
+            with open(csv_path, 'r', encoding='utf-8') as f:
+                csv_reader = csv.reader(f, delimiter=';')
+                data = list(csv_reader)
 
         if data:
             # Определяем размер данных
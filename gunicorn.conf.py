@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Конфигурация gunicorn для продакшена
+
+    gunicorn -c gunicorn.conf.py
+
+Приложение и ifcopenshell загружаются в мастер-процессе до fork (preload_app),
+воркеры получают их страницы памяти через copy-on-write. Фоновые обработчики
+очереди и наблюдение за папками запускаются только в одном воркере узла (по
+файловой блокировке, main.elect_job_workers), остальные воркеры только
+принимают запросы и подхватывают обработку, если этот воркер завершится.
+Воркер с обработчиками не перезапускается по max_requests, а при остановке
+дожидается текущих конвертаций (graceful_timeout не меньше срока задачи).
+
+Процессы узла: мастер + WEB_CONCURRENCY воркеров + EXTRACT_WORKERS процессов
+разбора (пул spawn воркера с обработчиками, создается при первой задаче из
+нескольких файлов и переиспользуется). Процессы разбора загружают ifcopenshell
+сами один раз при старте пула - preload_app им не помогает; предзагрузка
+экономит память воркеров и ускоряет задачи из одного файла, которые
+разбираются в потоке обработчика.
+
+Число воркеров и потоков считается по CPU и памяти контейнера, переопределяется
+переменными WEB_CONCURRENCY и GUNICORN_THREADS.
+"""
+
+import gc
+import os
+import sys
+import multiprocessing
+
+try:
+    # Загружается до fork, чтобы разделяемые библиотеки не загружались в каждом воркере
+    import ifcopenshell  # noqa: F401
+except ImportError:
+    pass
+
+from job_queue import detect_memory_limit, JOB_DEADLINE_SECONDS
+
+# Приложение создается без обработчиков: потоки не переживают fork
+wsgi_app = 'main:create_app(start_workers=False)'
+preload_app = True
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# gthread: SSE потоки статуса задач и медленные загрузки занимают поток, а не процесс
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+# Память под процессы приложения: остальное - бюджет конвертаций (JOB_MEMORY_BUDGET_MB, 70%)
+WORKER_MEMORY_MB = int(os.getenv('GUNICORN_WORKER_MEMORY_MB', '300'))
+
+
+def default_workers():
+    """2 x CPU + 1, но не больше, чем помещается в 30% памяти контейнера"""
+    cpu_count = multiprocessing.cpu_count()
+    memory_mb = detect_memory_limit() // (1024 * 1024)
+    by_memory = int(memory_mb * 0.3 // WORKER_MEMORY_MB)
+    return max(1, min(2 * cpu_count + 1, by_memory))
+
+
+workers = int(os.getenv('WEB_CONCURRENCY', '0')) or default_workers()
+
+# Перезапуск воркеров против роста памяти (фрагментация после больших моделей).
+# Воркер с обработчиками очереди не перезапускается: это прервало бы конвертации
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = max_requests // 10
+
+# Конвертация идет в фоновых потоках, timeout ограничивает только зависание воркера.
+# За graceful_timeout воркер при остановке дожидается текущих конвертаций: по умолчанию
+# срок задачи JOB_DEADLINE_SECONDS с запасом, иначе мастер прервет их по SIGKILL
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', str(int(JOB_DEADLINE_SECONDS) + 60)))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def pre_fork(server, worker):
+    """Объекты, созданные при загрузке, не трогаются сборщиком мусора и остаются общими"""
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    """Обработчики очереди и наблюдение - в воркере, получившем блокировку узла"""
+    import main
+
+    def keep_worker():
+        # Без перезапуска по max_requests: воркер завершается только при остановке сервера
+        worker.max_requests = sys.maxsize
+        worker.log.info(f"Job workers run in worker {worker.pid}, max_requests disabled")
+
+    main.elect_job_workers(on_elected=keep_worker)
+
+
+def worker_exit(server, worker):
+    """Завершение воркера (max_requests, остановка): воркер с обработчиками ждет текущие конвертации"""
+    import main
+
+    main.stop_job_workers(timeout=max(graceful_timeout - 5, 0))
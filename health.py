@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Проверки живости и готовности узла
+
+/health/live отвечает без обращения к БД, диску и внешним сервисам - это
+проба живости для Docker. /health/ready возвращает результат проверок
+готовности из кеша: устаревший результат отдается сразу, а пересчитывается
+в фоновом потоке, поэтому проба не ждет БД и не занимает поток надолго.
+"""
+
+import os
+import time
+import shutil
+import sqlite3
+import logging
+import threading
+from urllib.parse import quote
+
+from flask import jsonify
+
+logger = logging.getLogger('ifc-exporter')
+
+# Время жизни результата проверок готовности (секунды)
+HEALTH_CACHE_TTL = float(os.getenv('HEALTH_CACHE_TTL', '15'))
+
+# Минимум свободного места в папках загрузок и результатов (МБ)
+HEALTH_MIN_FREE_MB = int(os.getenv('HEALTH_MIN_FREE_MB', '500'))
+
+# Ожидание блокировки БД при проверке (секунды): занятая конвертацией БД не должна задерживать пробу
+HEALTH_DB_TIMEOUT = 2.0
+
+
+class ReadinessChecker:
+    """Проверки готовности с кешированием и фоновым обновлением результата"""
+
+    def __init__(self, checks, optional=(), ttl=None):
+        """
+        :param checks: словарь {имя: функция проверки}, функция возвращает словарь с ключом ok
+        :param optional: имена проверок, не влияющих на готовность (только отчет)
+        :param ttl: время жизни результата (секунды, по умолчанию HEALTH_CACHE_TTL)
+        """
+        self.checks = checks
+        self.optional = set(optional)
+        self.ttl = HEALTH_CACHE_TTL if ttl is None else ttl
+        self._result = None
+        self._checked_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def result(self):
+        """
+        Результат проверок
+
+        Первый вызов выполняет проверки сразу. Дальше возвращается кешированный
+        результат, а по истечении ttl проверки перезапускаются в фоновом потоке.
+        """
+        with self._lock:
+            result = self._result
+            stale = result is not None and time.monotonic() - self._checked_at >= self.ttl
+            start_refresh = stale and not self._refreshing
+            if start_refresh:
+                self._refreshing = True
+
+        if result is None:
+            return self.refresh()
+        if start_refresh:
+            threading.Thread(target=self.refresh, name='health-refresh', daemon=True).start()
+        return result
+
+    @property
+    def computed(self):
+        """Есть ли результат проверок (result() не будет ждать проверок)"""
+        return self._result is not None
+
+    def refresh(self):
+        """Выполнение всех проверок и обновление кеша"""
+        checks = {}
+        for name, check in self.checks.items():
+            started = time.perf_counter()
+            try:
+                outcome = check()
+            except Exception as e:
+                logger.warning(f"Readiness check {name} failed: {e}")
+                outcome = {'ok': False, 'error': str(e)}
+            outcome['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            checks[name] = outcome
+
+        result = {
+            'ready': all(outcome['ok'] for name, outcome in checks.items() if name not in self.optional),
+            'checked_at': time.time(),
+            'checks': checks
+        }
+        with self._lock:
+            self._result = result
+            self._checked_at = time.monotonic()
+            self._refreshing = False
+        return result
+
+
+def sqlite_check(db_path):
+    """Проверка доступности SQLite БД (только чтение, без создания файла)"""
+    def check():
+        conn = sqlite3.connect(f"file:{quote(os.path.abspath(db_path))}?mode=ro", uri=True, timeout=HEALTH_DB_TIMEOUT)
+        try:
+            conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+        finally:
+            conn.close()
+        return {'ok': True, 'path': db_path}
+    return check
+
+
+def disk_check(directories, min_free_mb=None):
+    """Проверка свободного места в папках"""
+    min_free_mb = HEALTH_MIN_FREE_MB if min_free_mb is None else min_free_mb
+
+    def check():
+        free = {}
+        for directory in directories:
+            free[directory] = shutil.disk_usage(directory).free // (1024 * 1024)
+        return {'ok': all(value >= min_free_mb for value in free.values()), 'free_mb': free,
+                'min_free_mb': min_free_mb}
+    return check
+
+
+def worker_pool_check(get_pool, job_queue, standby=None):
+    """
+    Проверка обработчиков очереди и их загрузки
+
+    Занятость всех обработчиков (saturated) и заполненность очереди
+    (queue_full) готовность не снимают: очередь общая для узлов, а переполнение
+    уже обрабатывает контроль допуска (ответ 429).
+
+    :param standby: функция, возвращающая True, если обработчики узла работают
+        в другом процессе (этот процесс только принимает запросы)
+    """
+    def check():
+        pool = get_pool()
+        if pool is None and standby and standby():
+            queue = job_queue.stats()
+            return {'ok': True, 'standby': True, 'queued': queue['queued'], 'running': queue['running']}
+        if pool is None:
+            return {'ok': False, 'error': "Job workers are not running"}
+
+        stats = pool.stats()
+        queue = job_queue.stats()
+        return {
+            'ok': stats['alive'] == stats['workers'],
+            'workers': stats['workers'],
+            'alive': stats['alive'],
+            'busy': stats['busy'],
+            'saturated': stats['busy'] >= stats['workers'],
+            'queued': queue['queued'],
+            'running': queue['running'],
+            'queue_full': queue['queued'] >= queue['max_queued']
+        }
+    return check
+
+
+def setup_health_routes(app, readiness):
+    """Маршруты проб живости и готовности"""
+
+    @app.route('/health/live')
+    def health_live():
+        """Проба живости: процесс отвечает на запросы"""
+        return jsonify({'status': 'alive'})
+
+    @app.route('/health/ready')
+    def health_ready():
+        """Проба готовности: кешированный результат проверок, 503 если узел не готов"""
+        result = readiness.result()
+        response = jsonify(result)
+        response.status_code = 200 if result['ready'] else 503
+        response.headers['Cache-Control'] = 'no-store'
+        return response
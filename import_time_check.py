@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Проверка времени запуска приложения и CLI
+
+Каждый модуль импортируется в отдельном процессе с -X importtime (во временной
+папке: asgi.py при импорте создает приложение, а с ним БД и папки). Проверяется, что тяжелые
+библиотеки не загружаются при импорте и что общее время не превышает бюджет.
+Выводятся самые медленные модули, код возврата 1 при регрессии.
+
+    python import_time_check.py
+    python import_time_check.py --budget-ms 400 --top 20
+"""
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Точки входа: веб-приложение, ASGI вход и CLI пакетной конвертации
+ENTRY_MODULES = ['main', 'asgi', 'export_flats']
+
+# Библиотеки, загружаемые только при первом использовании (lazy_imports.py)
+LAZY_MODULES = ['ifcopenshell', 'numpy', 'gspread', 'oauth2client', 'authlib', 'pyarrow', 'xlsxwriter']
+
+# Бюджет времени импорта одной точки входа (мс)
+IMPORT_TIME_BUDGET_MS = int(os.getenv('IMPORT_TIME_BUDGET_MS', '600'))
+
+
+def measure_import(module, workdir):
+    """
+    Импорт модуля в новом процессе с -X importtime
+
+    :return: список (модуль, собственное время мкс, накопленное время мкс) из дерева импорта модуля
+    """
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=workdir, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Вложенность импорта - отступ имени; модули верхнего уровня с отступом в один пробел
+        nested = name.startswith('  ')
+        if not nested:
+            # Дерево импорта выводится снизу вверх: импорты интерпретатора (site) до модуля отбрасываем
+            if name.strip() != module:
+                entries = []
+                continue
+            entries.append((module, int(self_us), int(cumulative_us)))
+            break
+        entries.append((name.strip(), int(self_us), int(cumulative_us)))
+    return entries
+
+
+def check_module(module, workdir, budget_ms, top):
+    """Отчет по одной точке входа: True, если проверки пройдены"""
+    entries = measure_import(module, workdir)
+    imported = {name for name, _, _ in entries}
+    total_ms = entries[-1][2] / 1000
+
+    eager = sorted(name for name in imported if name.split('.')[0] in LAZY_MODULES)
+    ok = not eager and total_ms <= budget_ms
+
+    print(f"{'✅' if ok else '❌'} import {module}: {total_ms:.0f} ms (бюджет {budget_ms} ms), "
+          f"модулей: {len(imported)}")
+    for name, _, cumulative in sorted(entries, key=lambda entry: entry[2], reverse=True)[1:top + 1]:
+        print(f"    {cumulative / 1000:8.1f} ms  {name}")
+    if eager:
+        print(f"    ❌ загружены при импорте: {', '.join(eager[:10])}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка времени импорта точек входа")
+    parser.add_argument('modules', nargs='*', default=ENTRY_MODULES, help="модули для проверки")
+    parser.add_argument('--budget-ms', type=int, default=IMPORT_TIME_BUDGET_MS,
+                        help="бюджет времени импорта одного модуля (мс)")
+    parser.add_argument('--top', type=int, default=10, help="число самых медленных модулей в отчете")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix='import-check-')
+    try:
+        results = [check_module(module, workdir, args.budget_ms, args.top) for module in args.modules]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
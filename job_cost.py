@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Оценка длительности задач конвертации для планировщика очереди
+
+IFC файлы просматриваются побайтово (без разбора ifcopenshell): считаются
+строки сущностей (#N=...) и зоны IFCSPATIALZONE. Файлы из multipart формы
+считаются при приеме вместе с SHA-256, остальные (загруженные по частям,
+элементы архивов, файлы по пути) - по первым PREFLIGHT_SAMPLE_BYTES байтам
+с экстраполяцией по размеру.
+Длительность задачи оценивается линейной моделью по этим счетчикам.
+Предсказанная и фактическая длительности сохраняются в истории конвертаций,
+по ним коэффициенты модели можно пересчитать.
+"""
+
+import os
+import zipfile
+import logging
+
+logger = logging.getLogger('ifc-exporter')
+
+# Коэффициенты модели длительности (секунды)
+JOB_COST_BASE_SECONDS = float(os.getenv('JOB_COST_BASE_SECONDS', '2.0'))
+JOB_COST_FILE_SECONDS = float(os.getenv('JOB_COST_FILE_SECONDS', '0.5'))
+JOB_COST_PER_ENTITY = float(os.getenv('JOB_COST_PER_ENTITY', '0.00002'))
+JOB_COST_PER_ZONE = float(os.getenv('JOB_COST_PER_ZONE', '0.0004'))
+
+# Средний размер строки сущности - для оценки без просмотра файла
+BYTES_PER_ENTITY = 80
+
+# Размер блока при просмотре файла
+PREFLIGHT_BUFFER_SIZE = 1024 * 1024
+
+# Сколько байт файла просматривается при оценке (остальное - экстраполяция по размеру)
+PREFLIGHT_SAMPLE_BYTES = int(os.getenv('PREFLIGHT_SAMPLE_BYTES', str(4 * 1024 * 1024)))
+
+ENTITY_MARKER = b'\n#'
+ZONE_MARKER = b'IFCSPATIALZONE('
+
+
+class MarkerCounter:
+    """
+    Подсчет сущностей и зон в потоке байт IFC файла, подаваемом блоками
+
+    Используется при приеме загрузки (upload_storage.HashingUploadFile),
+    чтобы не просматривать сохраненный файл повторно.
+    """
+
+    # Хвост предыдущего блока: маркер может оказаться на границе блоков
+    OVERLAP = max(len(ENTITY_MARKER), len(ZONE_MARKER)) - 1
+
+    def __init__(self):
+        self.entities = 0
+        self.zones = 0
+        self.size = 0
+        self._tail = b''
+
+    def update(self, block):
+        """Учет очередного блока данных"""
+        if not block:
+            return
+        self.size += len(block)
+        data = self._tail + block
+        self.entities += data.count(ENTITY_MARKER)
+        self.zones += data.count(ZONE_MARKER)
+        # Маркеры, целиком лежащие в хвосте, уже посчитаны в этом блоке
+        self._tail = data[-self.OVERLAP:]
+        self.entities -= self._tail.count(ENTITY_MARKER)
+        self.zones -= self._tail.count(ZONE_MARKER)
+
+    @property
+    def counts(self):
+        """(число сущностей, число зон) с учетом хвоста последнего блока"""
+        return (self.entities + self._tail.count(ENTITY_MARKER),
+                self.zones + self._tail.count(ZONE_MARKER))
+
+
+def _count_markers(stream, limit=None):
+    """
+    Подсчет сущностей и зон в начале потока байт IFC файла
+
+    :param stream: файловый объект
+    :param limit: сколько байт просмотреть (None - весь поток)
+    :return: (число сущностей, число зон, просмотрено байт)
+    """
+    counter = MarkerCounter()
+    while limit is None or counter.size < limit:
+        size = PREFLIGHT_BUFFER_SIZE if limit is None else min(PREFLIGHT_BUFFER_SIZE, limit - counter.size)
+        block = stream.read(size)
+        if not block:
+            break
+        counter.update(block)
+    entities, zones = counter.counts
+    return entities, zones, counter.size
+
+
+def preflight_ifc(file_info):
+    """
+    Счетчики сущностей и зон IFC файла задачи
+
+    Файл просматривается не дальше PREFLIGHT_SAMPLE_BYTES, для больших файлов
+    счетчики экстраполируются по размеру: время ответа на загрузку не зависит
+    от размера модели.
+
+    :param file_info: описание файла из payload задачи (path, size, для архивов - member)
+    :return: (число сущностей, число зон) или None, если файл не прочитан
+    """
+    try:
+        if file_info.get('member'):
+            with zipfile.ZipFile(file_info['path']) as archive:
+                with archive.open(file_info['member']) as stream:
+                    entities, zones, sampled = _count_markers(stream, PREFLIGHT_SAMPLE_BYTES)
+        else:
+            with open(file_info['path'], 'rb') as stream:
+                entities, zones, sampled = _count_markers(stream, PREFLIGHT_SAMPLE_BYTES)
+    except (OSError, zipfile.BadZipFile, KeyError) as e:
+        logger.warning(f"Preflight failed for {file_info.get('original_name')}: {e}")
+        return None
+
+    size = file_info.get('size') or 0
+    if sampled and size > sampled:
+        scale = size / sampled
+        entities, zones = int(entities * scale), int(zones * scale)
+    return entities, zones
+
+
+def estimate_job_seconds(files):
+    """
+    Оценка длительности задачи конвертации
+
+    :param files: список файлов задачи (path, size, для архивов - member;
+        preflight - счетчики, посчитанные при приеме загрузки)
+    :return: (оценка в секундах, счетчики по файлам [{entities, zones}])
+    """
+    seconds = JOB_COST_BASE_SECONDS
+    counters = []
+
+    for file_info in files:
+        counted = file_info.get('preflight')
+        if counted:
+            counts = counted['entities'], counted['zones']
+        else:
+            counts = preflight_ifc(file_info)
+        if counts is None:
+            # Файл недоступен - оценка только по размеру
+            entities, zones = (file_info.get('size') or 0) // BYTES_PER_ENTITY, 0
+        else:
+            entities, zones = counts
+
+        seconds += JOB_COST_FILE_SECONDS + JOB_COST_PER_ENTITY * entities + JOB_COST_PER_ZONE * zones
+        counters.append({'entities': entities, 'zones': zones})
+
+    return round(seconds, 2), counters
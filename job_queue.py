@@ -0,0 +1,984 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Персистентная очередь задач конвертации на SQLite и пул фоновых обработчиков
+"""
+
+import os
+import json
+import math
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+import logging
+from collections import Counter
+from datetime import datetime
+
+from flask import Response, jsonify, request, session, stream_with_context, url_for
+
+from cancellation import CancellationToken, ConversionCancelled, DeadlineExceeded
+
+logger = logging.getLogger('ifc-exporter')
+
+# Состояния задачи
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCESS = 'success'
+JOB_ERROR = 'error'
+JOB_CANCELLED = 'cancelled'
+
+FINISHED_STATES = {JOB_SUCCESS, JOB_ERROR, JOB_CANCELLED}
+
+# События, после которых лента прогресса задачи закрывается
+TERMINAL_EVENTS = {'finished', 'failed', 'cancelled'}
+
+# Срок выполнения задачи по умолчанию и максимальный срок, который может запросить клиент (секунды)
+JOB_DEADLINE_SECONDS = float(os.getenv('JOB_DEADLINE_SECONDS', '900'))
+
+# Интервал опроса ленты событий для SSE и keep-alive комментариев (секунды)
+EVENTS_POLL_INTERVAL = 0.5
+EVENTS_KEEPALIVE_INTERVAL = 15
+
+# Оценка памяти на разбор модели: ifcopenshell занимает в памяти в несколько раз больше размера файла
+JOB_MEMORY_FACTOR = float(os.getenv('JOB_MEMORY_FACTOR', '10'))
+JOB_MEMORY_BASE_MB = float(os.getenv('JOB_MEMORY_BASE_MB', '150'))
+
+# Ожидание перед повтором, если длительность задач еще неизвестна (секунды)
+DEFAULT_RETRY_AFTER = 30
+
+# Старение в планировщике: на сколько секунд уменьшается оценка задачи за секунду ожидания
+JOB_AGING_RATE = float(os.getenv('JOB_AGING_RATE', '1.0'))
+
+# Число последних задач для поправки оценок длительности
+CALIBRATION_WINDOW = 50
+
+# Аренда выполняемой задачи (секунды): обработчик продлевает ее, пока жив. Задачу с истекшей
+# арендой (узел упал или завис) возвращает в очередь любой узел, работающий с той же БД
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '60'))
+
+# Максимум попыток выполнения: задача, роняющая обработчики, не перезапускается бесконечно
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '3'))
+
+# Сколько последних задач анонимного клиента запоминается в его сессии
+SESSION_JOBS_LIMIT = 20
+
+
+class QueueFullError(Exception):
+    """Очередь конвертации заполнена, запрос нужно повторить позже"""
+
+    def __init__(self, message, retry_after=DEFAULT_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _format_timestamp(value):
+    """Перевод unix-времени из БД в ISO строку для API"""
+    if value is None:
+        return None
+    return datetime.fromtimestamp(value).isoformat()
+
+
+def _insert_event(conn, job_id, event, data=None):
+    """Добавление события в ленту прогресса задачи"""
+    conn.execute('''
+        INSERT INTO job_events (job_id, event, data, created_at) VALUES (?, ?, ?, ?)
+    ''', (job_id, event, json.dumps(data or {}, ensure_ascii=False), time.time()))
+
+
+def detect_memory_limit():
+    """
+    Доступная процессу память в байтах
+
+    Учитывается лимит cgroup (контейнер Docker), иначе - физическая память.
+    """
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # "max" и огромные значения cgroup v1 означают отсутствие лимита
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 4 * 1024 ** 3
+
+
+def estimate_job_memory(files, parallel_files=1):
+    """
+    Оценка памяти, занимаемой задачей конвертации (МБ)
+
+    Одновременно разбирается не больше parallel_files файлов задачи,
+    поэтому учитываются только самые большие из них.
+
+    :param files: список файлов задачи (size - размер IFC файла в байтах)
+    :param parallel_files: число файлов, разбираемых одновременно
+    """
+    sizes = sorted((f.get('size') or 0 for f in files), reverse=True)[:max(parallel_files, 1)]
+    return round(JOB_MEMORY_BASE_MB + JOB_MEMORY_FACTOR * sum(sizes) / (1024 * 1024), 1)
+
+
+def format_sse_event(event):
+    """Сообщение Server-Sent Events для события из ленты задачи"""
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {event['data']}\n\n"
+
+
+def parse_last_event_id(value):
+    """Идентификатор последнего полученного клиентом события (заголовок Last-Event-ID)"""
+    return int(value) if value and value.isdigit() else 0
+
+
+def _process_alive(pid):
+    """Проверка, что процесс с указанным PID еще существует"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """Очередь задач конвертации, хранящаяся в SQLite"""
+
+    def __init__(self, db_path=None, memory_budget_mb=None, max_running_per_client=None,
+                 max_queued_per_client=None, max_queued_jobs=None):
+        """
+        :param db_path: путь к БД очереди
+        :param memory_budget_mb: общий бюджет памяти выполняемых задач (по умолчанию 70% доступной)
+        :param max_running_per_client: максимум одновременно выполняемых задач одного клиента
+        :param max_queued_per_client: максимум ожидающих задач одного клиента
+        :param max_queued_jobs: максимальная длина очереди ожидания
+        """
+        self.db_path = db_path or os.getenv('JOBS_DB_PATH', 'jobs.db')
+        self.hostname = socket.gethostname()
+
+        if memory_budget_mb is None:
+            memory_budget_mb = float(os.getenv('JOB_MEMORY_BUDGET_MB', '0')) or \
+                round(detect_memory_limit() * 0.7 / (1024 * 1024))
+        self.memory_budget_mb = memory_budget_mb
+        self.max_running_per_client = max_running_per_client or int(os.getenv('MAX_RUNNING_JOBS_PER_USER', '1'))
+        self.max_queued_per_client = max_queued_per_client or int(os.getenv('MAX_QUEUED_JOBS_PER_USER', '3'))
+        self.max_queued_jobs = max_queued_jobs or int(os.getenv('MAX_QUEUED_JOBS', '20'))
+
+        self._new_job = threading.Condition()
+        self.setup_database()
+
+    def _connect(self):
+        """Открытие соединения с БД очереди"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def setup_database(self):
+        """Создание таблицы задач"""
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        # WAL позволяет читать статус задач, пока обработчик пишет результат
+        cursor.execute('PRAGMA journal_mode=WAL')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                user_id TEXT,
+                state TEXT NOT NULL DEFAULT 'queued',
+                payload TEXT NOT NULL,
+                result TEXT,
+                error_message TEXT,
+                owner TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, created_at)')
+
+        # Миграция существующих БД: клиент и оценка памяти для контроля допуска
+        columns = [row['name'] for row in cursor.execute('PRAGMA table_info(jobs)')]
+        if 'client' not in columns:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN client TEXT')
+        if 'memory_mb' not in columns:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN memory_mb REAL NOT NULL DEFAULT 0')
+        # Предсказанная длительность для планировщика (кратчайшая задача первой)
+        if 'predicted_seconds' not in columns:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN predicted_seconds REAL NOT NULL DEFAULT 0')
+        # Кооперативная отмена и срок выполнения
+        if 'cancel_requested' not in columns:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0')
+        if 'deadline_seconds' not in columns:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN deadline_seconds REAL')
+        if 'deadline_at' not in columns:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN deadline_at REAL')
+        # Аренда и номер попытки для нескольких узлов с общей очередью
+        if 'lease_expires_at' not in columns:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN lease_expires_at REAL')
+        if 'attempts' not in columns:
+            cursor.execute('ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0')
+
+        # Лента событий прогресса (читается SSE потоком /jobs/<id>/events)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS job_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                event TEXT NOT NULL,
+                data TEXT,
+                created_at REAL NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, id)')
+
+        conn.commit()
+        conn.close()
+        logger.info(f"Job queue initialized: {self.db_path}")
+
+    @property
+    def owner(self):
+        """Идентификатор текущего процесса-обработчика"""
+        return f"{self.hostname}:{os.getpid()}"
+
+    def _on_this_node(self, owner):
+        """Выполняется ли задача обработчиком этого узла"""
+        return bool(owner) and owner.rpartition(':')[0] == self.hostname
+
+    def enqueue(self, payload, user_id=None, client=None, memory_mb=0, predicted_seconds=0, deadline_seconds=None,
+                admission=False):
+        """
+        Постановка задачи в очередь
+
+        :param payload: параметры конвертации (сериализуются в JSON)
+        :param user_id: идентификатор пользователя для истории
+        :param client: идентификатор клиента для ограничений на пользователя
+        :param memory_mb: оценка памяти задачи (estimate_job_memory)
+        :param predicted_seconds: оценка длительности задачи (job_cost.estimate_job_seconds)
+        :param deadline_seconds: срок выполнения с момента запуска (не больше JOB_DEADLINE_SECONDS)
+        :param admission: проверить ограничения очереди (QueueFullError при превышении)
+        :return: идентификатор задачи
+        """
+        job_id = uuid.uuid4().hex
+        deadline_seconds = min(deadline_seconds or JOB_DEADLINE_SECONDS, JOB_DEADLINE_SECONDS)
+
+        conn = self._connect()
+        try:
+            # Проверка и вставка в одной транзакции, чтобы параллельные запросы не превысили лимиты
+            conn.execute('BEGIN IMMEDIATE')
+            if admission:
+                self._check_admission(conn, client)
+
+            conn.execute('''
+                INSERT INTO jobs (id, user_id, client, memory_mb, predicted_seconds, deadline_seconds,
+                                  state, payload, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (job_id, user_id, client, memory_mb, predicted_seconds, deadline_seconds, JOB_QUEUED,
+                  json.dumps(payload, ensure_ascii=False), time.time()))
+            _insert_event(conn, job_id, 'queued', {'files': len(payload.get('files', []))})
+            conn.commit()
+        finally:
+            conn.close()
+
+        # Будим обработчики этого процесса, не дожидаясь следующего опроса
+        with self._new_job:
+            self._new_job.notify()
+
+        logger.info(f"Job queued: {job_id} ({memory_mb} MB, ~{predicted_seconds}s)")
+        return job_id
+
+    def check_admission(self, client=None):
+        """
+        Быстрая проверка допуска до приема файлов запроса
+
+        :raises QueueFullError: очередь или лимит клиента заполнены
+        """
+        conn = self._connect()
+        try:
+            self._check_admission(conn, client)
+        finally:
+            conn.close()
+
+    def _check_admission(self, conn, client):
+        """Проверка длины очереди и числа задач клиента"""
+        queued = conn.execute('SELECT COUNT(*) FROM jobs WHERE state = ?', (JOB_QUEUED,)).fetchone()[0]
+        if queued >= self.max_queued_jobs:
+            raise QueueFullError(f"Conversion queue is full ({queued} jobs waiting)",
+                                 self._retry_after(conn, queued - self.max_queued_jobs + 1))
+
+        if client:
+            active = conn.execute('''
+                SELECT COUNT(*) FROM jobs WHERE state IN (?, ?) AND client = ?
+            ''', (JOB_QUEUED, JOB_RUNNING, client)).fetchone()[0]
+            if active >= self.max_running_per_client + self.max_queued_per_client:
+                raise QueueFullError(f"Too many conversions in progress ({active}), wait for them to finish",
+                                     self._retry_after(conn, 1))
+
+    def _retry_after(self, conn, jobs_ahead):
+        """Оценка ожидания (секунды) до освобождения места по длительности недавних задач"""
+        row = conn.execute('''
+            SELECT AVG(finished_at - started_at), COUNT(*) FROM (
+                SELECT finished_at, started_at FROM jobs WHERE state = ? AND started_at IS NOT NULL
+                ORDER BY finished_at DESC LIMIT 20
+            )
+        ''', (JOB_SUCCESS,)).fetchone()
+        if not row[1]:
+            return DEFAULT_RETRY_AFTER
+
+        running = conn.execute('SELECT COUNT(*) FROM jobs WHERE state = ?', (JOB_RUNNING,)).fetchone()[0]
+        return min(max(math.ceil(row[0] * jobs_ahead / max(running, 1)), 1), 600)
+
+    def _calibration(self, conn):
+        """
+        Поправочный множитель оценок длительности
+
+        Отношение фактической длительности последних задач к предсказанной.
+        """
+        row = conn.execute('''
+            SELECT SUM(finished_at - started_at), SUM(predicted_seconds) FROM (
+                SELECT finished_at, started_at, predicted_seconds FROM jobs
+                WHERE state = ? AND started_at IS NOT NULL AND predicted_seconds > 0
+                ORDER BY finished_at DESC LIMIT ?
+            )
+        ''', (JOB_SUCCESS, CALIBRATION_WINDOW)).fetchone()
+        if not row[1]:
+            return 1.0
+        return row[0] / row[1]
+
+    def _scheduled(self, conn):
+        """
+        Ожидающие задачи в порядке выполнения
+
+        Кратчайшая ожидаемая задача первой: приоритет - предсказанная длительность
+        с поправкой по истории минус JOB_AGING_RATE x время ожидания, поэтому
+        большие задачи со временем обгоняют новые маленькие и не голодают.
+        """
+        now = time.time()
+        calibration = self._calibration(conn)
+        rows = conn.execute('SELECT * FROM jobs WHERE state = ?', (JOB_QUEUED,)).fetchall()
+        return sorted(rows, key=lambda job: (
+            job['predicted_seconds'] * calibration - JOB_AGING_RATE * (now - job['created_at']),
+            job['created_at']
+        ))
+
+    def claim(self):
+        """
+        Атомарный захват следующей задачи из очереди
+
+        Задачи перебираются в порядке планировщика (_scheduled). Задача
+        захватывается, только если ее оценка памяти помещается в остаток
+        бюджета этого узла (задача больше всего бюджета выполняется одна), а у
+        ее клиента меньше max_running_per_client выполняемых задач на всех
+        узлах. Задачи других клиентов обходят упершиеся в лимит клиента, но не
+        задачу, ждущую памяти. Перед выбором задачи с истекшей арендой
+        возвращаются в очередь.
+
+        :return: словарь задачи или None, если подходящих задач нет
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            started_at = time.time()
+            self._expire_leases(conn, started_at)
+
+            running = conn.execute('SELECT client, memory_mb, owner FROM jobs WHERE state = ?',
+                                   (JOB_RUNNING,)).fetchall()
+            node_running = [job for job in running if self._on_this_node(job['owner'])]
+            node_memory = sum(job['memory_mb'] for job in node_running)
+            running_by_client = Counter(job['client'] for job in running if job['client'])
+
+            row = None
+            for candidate in self._scheduled(conn):
+                if candidate['client'] and running_by_client[candidate['client']] >= self.max_running_per_client:
+                    continue
+                if node_running and node_memory + candidate['memory_mb'] > self.memory_budget_mb:
+                    break
+                row = candidate
+                break
+
+            if row is None:
+                conn.commit()
+                return None
+
+            deadline_at = started_at + (row['deadline_seconds'] or JOB_DEADLINE_SECONDS)
+            lease_expires_at = started_at + JOB_LEASE_SECONDS
+            attempts = row['attempts'] + 1
+            conn.execute('''
+                UPDATE jobs SET state = ?, owner = ?, started_at = ?, deadline_at = ?, lease_expires_at = ?,
+                                attempts = ?
+                WHERE id = ?
+            ''', (JOB_RUNNING, self.owner, started_at, deadline_at, lease_expires_at, attempts, row['id']))
+            _insert_event(conn, row['id'], 'started')
+            conn.commit()
+        finally:
+            conn.close()
+
+        job = dict(row)
+        job['state'] = JOB_RUNNING
+        job['owner'] = self.owner
+        job['started_at'] = started_at
+        job['deadline_at'] = deadline_at
+        job['lease_expires_at'] = lease_expires_at
+        job['attempts'] = attempts
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    def _expire_leases(self, conn, now):
+        """Возврат в очередь задач с истекшей арендой (вызывается внутри транзакции)"""
+        rows = conn.execute('''
+            SELECT id, owner, attempts, cancel_requested, deadline_at FROM jobs
+            WHERE state = ? AND lease_expires_at < ?
+        ''', (JOB_RUNNING, now)).fetchall()
+        for row in rows:
+            self._recover(conn, row, f"lease of {row['owner']} expired", now)
+        return len(rows)
+
+    def _recover(self, conn, row, reason, now):
+        """
+        Задача потерянного обработчика: повтор или завершение (вызывается внутри транзакции)
+
+        Отмененная задача не перезапускается, задача с истекшим сроком или
+        исчерпанными попытками завершается с ошибкой.
+
+        :return: True, если задача возвращена в очередь
+        """
+        if row['cancel_requested']:
+            state, event, message = JOB_CANCELLED, 'cancelled', None
+        elif row['deadline_at'] and row['deadline_at'] < now:
+            state, event, message = JOB_ERROR, 'failed', "Conversion deadline exceeded"
+        elif row['attempts'] >= JOB_MAX_ATTEMPTS:
+            state, event, message = JOB_ERROR, 'failed', f"Conversion worker lost {row['attempts']} times"
+        else:
+            conn.execute('''
+                UPDATE jobs SET state = ?, owner = NULL, started_at = NULL, lease_expires_at = NULL WHERE id = ?
+            ''', (JOB_QUEUED, row['id']))
+            _insert_event(conn, row['id'], 'requeued', {'reason': reason})
+            logger.warning(f"Job {row['id']} requeued: {reason}")
+            return True
+
+        conn.execute('''
+            UPDATE jobs SET state = ?, error_message = ?, finished_at = ?, lease_expires_at = NULL WHERE id = ?
+        ''', (state, message, now, row['id']))
+        _insert_event(conn, row['id'], event, {'error': message} if message else None)
+        logger.warning(f"Job {row['id']} {state}: {reason}")
+        return False
+
+    def renew_leases(self):
+        """
+        Продление аренды задач, выполняемых этим процессом
+
+        Аренда задачи с истекшим сроком не продлевается: зависшая задача
+        завершается с ошибкой после истечения аренды.
+
+        :return: количество продленных задач
+        """
+        now = time.time()
+        conn = self._connect()
+        cursor = conn.execute('''
+            UPDATE jobs SET lease_expires_at = ?
+            WHERE state = ? AND owner = ? AND (deadline_at IS NULL OR deadline_at > ?)
+        ''', (now + JOB_LEASE_SECONDS, JOB_RUNNING, self.owner, now))
+        conn.commit()
+        conn.close()
+        return cursor.rowcount
+
+    def cancellation_token(self, job):
+        """Токен отмены выполняемой задачи (передается в функции обработки)"""
+        return CancellationToken(self.db_path, job['id'], job.get('deadline_at'), attempt=job.get('attempts'))
+
+    def request_cancel(self, job_id):
+        """
+        Запрос отмены задачи
+
+        Ожидающая задача отменяется сразу, выполняемая - при ближайшей проверке
+        токена отмены (в течение нескольких секунд).
+
+        :return: состояние задачи после запроса или None, если задачи нет
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT state FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+
+            state = row['state']
+            if state == JOB_QUEUED:
+                conn.execute('''
+                    UPDATE jobs SET state = ?, cancel_requested = 1, finished_at = ? WHERE id = ?
+                ''', (JOB_CANCELLED, time.time(), job_id))
+                _insert_event(conn, job_id, 'cancelled')
+                state = JOB_CANCELLED
+            elif state == JOB_RUNNING:
+                conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+                _insert_event(conn, job_id, 'cancel_requested')
+            conn.commit()
+        finally:
+            conn.close()
+
+        logger.info(f"Cancellation requested: {job_id} ({state})")
+        return state
+
+    def cancelled(self, job_id, message, attempt=None):
+        """Отметка о прерывании выполняемой задачи по запросу отмены"""
+        return self._finish(job_id, attempt, JOB_CANCELLED, 'cancelled', error_message=message)
+
+    def complete(self, job_id, result, attempt=None):
+        """Отметка об успешном завершении задачи"""
+        return self._finish(job_id, attempt, JOB_SUCCESS, 'finished', {'processed_flats': result.get('processed_flats')},
+                            result=json.dumps(result, ensure_ascii=False))
+
+    def fail(self, job_id, error_message, attempt=None):
+        """Отметка о завершении задачи с ошибкой"""
+        return self._finish(job_id, attempt, JOB_ERROR, 'failed', {'error': error_message},
+                            error_message=error_message)
+
+    def _finish(self, job_id, attempt, state, event, data=None, result=None, error_message=None):
+        """
+        Запись итогового состояния задачи
+
+        :param attempt: номер попытки обработчика; итог попытки, чья задача после
+                        истечения аренды возвращена в очередь, не записывается
+        :return: True, если состояние записано
+        """
+        query = '''
+            UPDATE jobs SET state = ?, result = ?, error_message = ?, finished_at = ?, lease_expires_at = NULL
+            WHERE id = ?
+        '''
+        params = [state, result, error_message, time.time(), job_id]
+        if attempt is not None:
+            query += ' AND state = ? AND attempts = ?'
+            params += [JOB_RUNNING, attempt]
+
+        conn = self._connect()
+        updated = conn.execute(query, params).rowcount
+        if updated:
+            _insert_event(conn, job_id, event, data)
+        conn.commit()
+        conn.close()
+        self._release()
+
+        if not updated:
+            logger.warning(f"Job {job_id} lease lost, attempt {attempt} result discarded")
+        return bool(updated)
+
+    def _release(self):
+        """Освободились память и место клиента: будим ожидающие обработчики этого процесса"""
+        with self._new_job:
+            self._new_job.notify_all()
+
+    def get_job(self, job_id):
+        """Получение задачи по идентификатору"""
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+        if row is None:
+            conn.close()
+            return None
+
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] else None
+
+        # Позиция в очереди для ожидающих задач (в порядке планировщика на текущий момент)
+        if job['state'] == JOB_QUEUED:
+            scheduled = [queued['id'] for queued in self._scheduled(conn)]
+            job['position'] = scheduled.index(job_id) + 1 if job_id in scheduled else None
+
+        conn.close()
+        return job
+
+    def count_unfinished(self, user_id=None):
+        """
+        Количество ожидающих и выполняемых задач
+
+        :param user_id: учитывать только задачи этого пользователя
+        """
+        conn = self._connect()
+        if user_id is None:
+            count = conn.execute('SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)',
+                                 (JOB_QUEUED, JOB_RUNNING)).fetchone()[0]
+        else:
+            count = conn.execute('SELECT COUNT(*) FROM jobs WHERE state IN (?, ?) AND user_id = ?',
+                                 (JOB_QUEUED, JOB_RUNNING, user_id)).fetchone()[0]
+        conn.close()
+        return count
+
+    def stats(self):
+        """Количество ожидающих и выполняемых задач всех узлов (для проверки готовности)"""
+        conn = self._connect()
+        rows = conn.execute('''
+            SELECT state, COUNT(*) FROM jobs WHERE state IN (?, ?) GROUP BY state
+        ''', (JOB_QUEUED, JOB_RUNNING)).fetchall()
+        conn.close()
+        counts = {state: count for state, count in rows}
+        return {
+            'queued': counts.get(JOB_QUEUED, 0),
+            'running': counts.get(JOB_RUNNING, 0),
+            'max_queued': self.max_queued_jobs
+        }
+
+    def add_event(self, job_id, event, data=None):
+        """Публикация события прогресса задачи"""
+        conn = self._connect()
+        _insert_event(conn, job_id, event, data)
+        conn.commit()
+        conn.close()
+
+    def get_events(self, job_id, after_id=0):
+        """
+        Получение событий задачи, опубликованных после указанного
+
+        :param job_id: идентификатор задачи
+        :param after_id: идентификатор последнего полученного события
+        :return: список событий по возрастанию id
+        """
+        conn = self._connect()
+        rows = conn.execute('''
+            SELECT id, event, data FROM job_events WHERE job_id = ? AND id > ? ORDER BY id
+        ''', (job_id, after_id)).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def progress(self, job_id):
+        """Создание публикатора прогресса для выполняемой задачи"""
+        return JobProgress(self.db_path, job_id)
+
+    def recover_interrupted(self):
+        """
+        Возврат в очередь задач, чей процесс-обработчик на этом хосте завершился
+
+        Задачи живых процессов (например, соседних воркеров gunicorn) не трогаем.
+        Задачи других узлов возвращаются в очередь по истечении аренды (claim).
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('''
+                SELECT id, owner, attempts, cancel_requested, deadline_at FROM jobs WHERE state = ?
+            ''', (JOB_RUNNING,)).fetchall()
+
+            now = time.time()
+            recovered = 0
+            for row in rows:
+                host, _, pid = (row['owner'] or '').rpartition(':')
+                if host != self.hostname or not pid.isdigit() or _process_alive(int(pid)):
+                    continue
+                recovered += self._recover(conn, row, f"worker {row['owner']} exited", now)
+
+            conn.commit()
+        finally:
+            conn.close()
+
+        if recovered:
+            logger.warning(f"Requeued {recovered} interrupted jobs")
+        return recovered
+
+    def wait_for_jobs(self, timeout):
+        """Ожидание новой задачи от этого процесса или истечения интервала опроса"""
+        with self._new_job:
+            self._new_job.wait(timeout)
+
+
+class JobProgress:
+    """
+    Публикация прогресса выполняемой задачи в ленту событий
+
+    Хранит только путь к БД и идентификатор задачи, поэтому может передаваться
+    в функции обработки как обычный аргумент. Счетчик зон ограничен по частоте:
+    запись в БД происходит не чаще одного раза в min_interval секунд на файл.
+    """
+
+    def __init__(self, db_path, job_id, min_interval=1.0):
+        self.db_path = db_path
+        self.job_id = job_id
+        self.min_interval = min_interval
+        self._last_flush = {}
+
+    def publish(self, event, **data):
+        """Публикация перехода между этапами обработки"""
+        try:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            _insert_event(conn, self.job_id, event, data)
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            # Прогресс не должен прерывать конвертацию
+            logger.warning(f"Failed to publish job event {event}: {e}")
+
+    def zones(self, file_name, count, force=False):
+        """
+        Обновление счетчика обработанных зон для файла
+
+        :param file_name: имя обрабатываемого файла
+        :param count: количество зон, обработанных в файле
+        :param force: опубликовать независимо от ограничения частоты
+        """
+        now = time.monotonic()
+        if not force and now - self._last_flush.get(file_name, 0.0) < self.min_interval:
+            return
+
+        self._last_flush[file_name] = now
+        self.publish('zones', file=file_name, zones=count)
+
+
+class JobWorkerPool:
+    """Пул фоновых потоков, выполняющих задачи из очереди"""
+
+    def __init__(self, job_queue, handler, workers=2, poll_interval=2.0):
+        """
+        :param job_queue: очередь задач
+        :param handler: функция обработки, принимает задачу и возвращает результат
+        :param workers: количество потоков-обработчиков
+        :param poll_interval: интервал опроса очереди в секундах
+        """
+        self.job_queue = job_queue
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._threads = []
+        self._heartbeat = None
+        self._stop = threading.Event()
+        self._busy = 0
+        self._busy_lock = threading.Lock()
+
+    def start(self):
+        """Запуск потоков-обработчиков"""
+        if self._threads:
+            return
+
+        self.job_queue.recover_interrupted()
+
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{index + 1}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        self._heartbeat = threading.Thread(target=self._renew_leases, name="job-lease-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+        logger.info(f"Started {self.workers} job workers")
+
+    def stop(self, timeout=None):
+        """
+        Остановка потоков после завершения текущих задач
+
+        :param timeout: сколько секунд ждать завершения текущих задач (None - не ждать)
+        """
+        self._stop.set()
+        with self.job_queue._new_job:
+            self.job_queue._new_job.notify_all()
+
+        if timeout is None:
+            return
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+
+    def stats(self):
+        """Число потоков-обработчиков, живых и занятых задачами"""
+        return {
+            'workers': self.workers,
+            'alive': sum(1 for thread in self._threads if thread.is_alive()),
+            'busy': self._busy
+        }
+
+    def _run(self):
+        """Основной цикл потока-обработчика"""
+        while not self._stop.is_set():
+            try:
+                job = self.job_queue.claim()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to claim job: {e}")
+                job = None
+
+            if job is None:
+                self.job_queue.wait_for_jobs(self.poll_interval)
+                continue
+
+            with self._busy_lock:
+                self._busy += 1
+            try:
+                self._execute(job)
+            finally:
+                with self._busy_lock:
+                    self._busy -= 1
+
+    def _renew_leases(self):
+        """Продление аренды выполняемых задач, пока работают потоки-обработчики (и после stop)"""
+        interval = JOB_LEASE_SECONDS / 3
+        while True:
+            if self._stop.is_set():
+                # После stop аренда продлевается, пока обработчики завершают текущие задачи
+                if not any(thread.is_alive() for thread in self._threads):
+                    return
+                time.sleep(interval)
+            else:
+                self._stop.wait(interval)
+
+            try:
+                self.job_queue.renew_leases()
+            except sqlite3.Error as e:
+                logger.error(f"Failed to renew job leases: {e}")
+
+    def _execute(self, job):
+        """Выполнение одной задачи с сохранением результата или ошибки"""
+        logger.info(f"Job started: {job['id']} (attempt {job['attempts']})")
+        attempt = job['attempts']
+        try:
+            result = self.handler(job)
+            if self.job_queue.complete(job['id'], result, attempt):
+                logger.info(f"Job finished: {job['id']}")
+        except DeadlineExceeded as e:
+            logger.warning(f"Job deadline exceeded: {job['id']}")
+            self.job_queue.fail(job['id'], str(e), attempt)
+        except ConversionCancelled as e:
+            logger.info(f"Job cancelled: {job['id']}: {e}")
+            self.job_queue.cancelled(job['id'], str(e), attempt)
+        except Exception as e:
+            logger.error(f"Job failed: {job['id']}: {str(e)}", exc_info=True)
+            self.job_queue.fail(job['id'], str(e), attempt)
+
+
+def remember_job(job_id):
+    """Запоминание задачи в подписанной сессии клиента, поставившего ее в очередь"""
+    jobs = [known for known in session.get('jobs', []) if known != job_id]
+    session['jobs'] = (jobs + [job_id])[-SESSION_JOBS_LIMIT:]
+
+
+def owns_job(job):
+    """
+    Принадлежит ли задача текущему клиенту
+
+    Задача пользователя доступна ему под его учетной записью, задача без
+    пользователя - только сессии, которая ее создала (remember_job).
+    """
+    user = session.get('user')
+    if user and job['user_id'] is not None and str(job['user_id']) == str(user['id']):
+        return True
+    return job['id'] in session.get('jobs', [])
+
+
+def get_owned_job(job_queue, job_id):
+    """Задача текущего клиента или None, если ее нет или она чужая"""
+    job = job_queue.get_job(job_id)
+    if job is None or not owns_job(job):
+        return None
+    return job
+
+
+def job_to_response(job):
+    """Формирование публичного представления задачи для API"""
+    response = {
+        'job_id': job['id'],
+        'state': job['state'],
+        'created_at': _format_timestamp(job['created_at']),
+        'started_at': _format_timestamp(job['started_at']),
+        'finished_at': _format_timestamp(job['finished_at']),
+        'original_filenames': [f['original_name'] for f in job['payload'].get('files', [])],
+    }
+
+    if job['state'] == JOB_QUEUED:
+        response['position'] = job.get('position')
+        response['predicted_seconds'] = job.get('predicted_seconds')
+
+    if job['state'] == JOB_SUCCESS and job['result']:
+        response['result'] = job['result']
+        if job['result'].get('csv_path'):
+            response['result']['download_url'] = url_for('download_file', filename=job['result']['csv_path'])
+        for file_output in job['result'].get('file_csv_paths', []):
+            file_output['download_url'] = url_for('download_file', filename=file_output['csv_path'])
+        for export in job['result'].get('exports', []):
+            export['download_url'] = url_for('download_file', filename=export['path'])
+        if job['result'].get('file_csv_paths') or job['result'].get('exports'):
+            response['result']['bundle_url'] = url_for('download_bundle', job_id=job['id'])
+
+    if job['state'] == JOB_ERROR:
+        response['error'] = job['error_message']
+
+    if job['state'] == JOB_RUNNING:
+        response['cancel_requested'] = bool(job.get('cancel_requested'))
+        # Узел, выполняющий задачу, и номер попытки (больше 1 после потери обработчика)
+        response['node'] = (job.get('owner') or '').rpartition(':')[0] or None
+        response['attempt'] = job.get('attempts')
+
+    return response
+
+
+def setup_job_routes(app, job_queue):
+    """Настройка маршрутов статуса задач"""
+
+    @app.route('/jobs/<job_id>')
+    def job_status(job_id):
+        """Статус задачи конвертации"""
+        # Чужая задача неотличима от несуществующей
+        job = get_owned_job(job_queue, job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+
+        return jsonify(job_to_response(job))
+
+    @app.route('/jobs/<job_id>/cancel', methods=['POST'])
+    def cancel_job(job_id):
+        """Отмена задачи (в том числе navigator.sendBeacon при закрытии страницы)"""
+        if get_owned_job(job_queue, job_id) is None:
+            return jsonify({'error': 'Job not found'}), 404
+
+        state = job_queue.request_cancel(job_id)
+        if state is None:
+            return jsonify({'error': 'Job not found'}), 404
+        if state in (JOB_SUCCESS, JOB_ERROR):
+            return jsonify({'error': 'Job already finished', 'state': state}), 409
+
+        return jsonify({'job_id': job_id, 'state': state, 'cancel_requested': True}), 202
+
+    @app.route('/jobs/<job_id>/events')
+    def job_events(job_id):
+        """Поток Server-Sent Events с этапами и прогрессом конвертации"""
+        if get_owned_job(job_queue, job_id) is None:
+            return jsonify({'error': 'Job not found'}), 404
+
+        # При переподключении EventSource присылает id последнего полученного события
+        after_id = parse_last_event_id(request.headers.get('Last-Event-ID', request.args.get('last_event_id')))
+
+        return Response(
+            stream_with_context(stream_job_events(job_queue, job_id, after_id)),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'  # Отключаем буферизацию ответа в nginx
+            }
+        )
+
+
+def stream_job_events(job_queue, job_id, after_id=0):
+    """
+    Генератор SSE сообщений из ленты событий задачи
+
+    Завершается после события finished/failed. Лента читается из БД, поэтому
+    поток работает на любом воркере, а не только на выполняющем задачу.
+    """
+    last_sent = time.monotonic()
+
+    while True:
+        events = job_queue.get_events(job_id, after_id)
+
+        for event in events:
+            after_id = event['id']
+            yield format_sse_event(event)
+
+            if event['event'] in TERMINAL_EVENTS:
+                return
+
+        now = time.monotonic()
+        if events:
+            last_sent = now
+        elif now - last_sent >= EVENTS_KEEPALIVE_INTERVAL:
+            # Комментарий не дает прокси закрыть неактивное соединение
+            last_sent = now
+            yield ": keep-alive\n\n"
+
+        time.sleep(EVENTS_POLL_INTERVAL)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Отложенная загрузка тяжелых библиотек
+
+ifcopenshell, gspread, oauth2client и authlib загружаются за сотни миллисекунд,
+а страницам, health check и скачиванию результатов они не нужны. Модули
+приложения обращаются к ним через фасад LazyModule: библиотека импортируется
+при первом обращении к ее атрибуту (первая конвертация, выгрузка в Google
+Sheets, вход через Google).
+
+Наличие библиотеки проверяется при импорте модуля приложения через
+require_modules() (без загрузки), поэтому обработка ImportError в main.py
+работает как раньше.
+
+Время загрузки контролирует import_time_check.py.
+"""
+
+import importlib
+import importlib.util
+import threading
+
+
+def require_modules(*names):
+    """
+    Проверка установленных библиотек без их загрузки
+
+    :raises ImportError: библиотека не установлена
+    """
+    for name in names:
+        if importlib.util.find_spec(name) is None:
+            raise ImportError(f"No module named '{name}'", name=name)
+
+
+class LazyModule:
+    """Фасад модуля, загружающий его при первом обращении к атрибуту"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """Загрузка модуля (один раз, потокобезопасно)"""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    @property
+    def loaded(self):
+        """Загружен ли модуль"""
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.loaded else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_module(name):
+    """Фасад модуля name; сам модуль загружается при первом обращении"""
+    return LazyModule(name)
@@ -6,10 +6,16 @@ Flask приложение для обработки IFC-файлов с под
 """
 
 import os
+import fcntl
+import socket
 import logging
+import mimetypes
+import threading
 import time
 from datetime import datetime
+from urllib.parse import quote
 from flask import Flask, request, jsonify, render_template, send_file, session, redirect, url_for
+from werkzeug.exceptions import HTTPException
 
 # Инициализация приложения
 app = Flask(__name__)
@@ -18,6 +24,19 @@ app.config['DOWNLOAD_FOLDER'] = 'downloads'
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB на файл
 app.config['ALLOWED_EXTENSIONS'] = {'ifc', 'ifczip'}
 app.config['MAX_FILES'] = 10  # Максимум файлов за раз
+app.config['MAX_BATCH_FILES'] = int(os.getenv('MAX_BATCH_FILES', '100'))  # Максимум IFC файлов в пакете /uploads/batch
+app.config['CHUNK_SIZE'] = 8 * 1024 * 1024  # Размер части при загрузке по частям
+app.config['MAX_CHUNKED_FILE_SIZE'] = 2 * 1024 * 1024 * 1024  # 2GB на файл при загрузке по частям
+app.config['MAX_DECOMPRESSED_SIZE'] = 2 * 1024 * 1024 * 1024  # 2GB после распаковки сжатой в браузере загрузки
+# Ограничения ZIP архивов пакетной загрузки: записей в оглавлении, байт IFC файла и всего архива после распаковки
+app.config['MAX_ARCHIVE_ENTRIES'] = int(os.getenv('MAX_ARCHIVE_ENTRIES', '1000'))
+app.config['MAX_ARCHIVE_MEMBER_SIZE'] = int(os.getenv('MAX_ARCHIVE_MEMBER_SIZE', str(2 * 1024 * 1024 * 1024)))
+app.config['MAX_ARCHIVE_TOTAL_SIZE'] = int(os.getenv('MAX_ARCHIVE_TOTAL_SIZE', str(10 * 1024 * 1024 * 1024)))
+# Сжатые варианты результатов, записываемые вместе с CSV, и хранение CSV без сжатия
+app.config['DOWNLOAD_ENCODINGS'] = os.getenv('DOWNLOAD_ENCODINGS', 'gzip')
+app.config['DOWNLOAD_KEEP_PLAIN'] = os.getenv('DOWNLOAD_KEEP_PLAIN', 'true').lower() == 'true'
+# Внутренний location nginx для отдачи результатов (X-Accel-Redirect); пусто - файл отдает приложение
+app.config['X_ACCEL_REDIRECT'] = os.getenv('X_ACCEL_REDIRECT', '')
 
 # Секретный ключ для сессий
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-in-production')
@@ -35,43 +54,118 @@ logging.basicConfig(
 )
 logger = logging.getLogger('ifc-exporter')
 
-# Импорт модулей с обработкой ошибок
+# Очередь задач, хранилище загрузок, кеш извлечения и пробы - модули самого приложения
+# без внешних зависимостей: без них сервис не работает, поэтому ошибка их импорта
+# останавливает запуск, а не откладывает NameError до первого запроса
+from job_queue import (JobQueue, JobWorkerPool, QueueFullError, estimate_job_memory, setup_job_routes, remember_job,
+                       get_owned_job, JOB_DEADLINE_SECONDS)
+from job_cost import estimate_job_seconds
+from cancellation import ConversionCancelled, DeadlineExceeded
+from upload_storage import BlobStore, HashingUploadFile, init_upload_storage, store_upload, is_archive, list_archive_members
+from chunked_upload import ChunkedUploadManager, setup_chunked_upload_routes, owns_upload
+from extraction_cache import ExtractionCache, cache_key_for
+from path_ingest import PathIngestor, setup_ingest_routes
+from download_variants import (parse_encodings, existing_variants, select_variant, iter_decoded,
+                               cached_etag, variant_etag, iter_zip_bundle)
+from health import ReadinessChecker, setup_health_routes, sqlite_check, disk_check, worker_pool_check
+
+# Импорт необязательных модулей (ifcopenshell, Google API, OAuth2) с обработкой ошибок
 try:
-    from export_flats import export_flats, export_flats_multiple, DEFAULT_AREA_COEFFICIENT
+    from export_flats import (export_flats, export_flats_multiple, export_flats_table,
+                              ArchiveMember, CSV_HEADER, DEFAULT_AREA_COEFFICIENT, EXTRACT_WORKERS)
 
     logger.info("✅ export_flats module loaded")
 except ImportError as e:
     logger.error(f"❌ Failed to import export_flats: {e}")
     export_flats = None
     export_flats_multiple = None
+    export_flats_table = None
+    ArchiveMember = None
+    CSV_HEADER = None
     DEFAULT_AREA_COEFFICIENT = 0.9
+    EXTRACT_WORKERS = 1
 
 try:
-    from gsheets import upload_to_google_sheets
+    from gsheets import upload_to_google_sheets, prepare_worksheet_async, discard_worksheet
 
     logger.info("✅ gsheets module loaded")
 except ImportError as e:
     logger.error(f"❌ Failed to import gsheets: {e}")
     upload_to_google_sheets = None
+    prepare_worksheet_async = None
+    discard_worksheet = None
 
 try:
-    from file_naming_utils import get_next_indexed_filename
+    from file_naming_utils import make_unique_names
 
     logger.info("✅ file_naming_utils module loaded")
 except ImportError as e:
     logger.error(f"❌ Failed to import file_naming_utils: {e}")
-    get_next_indexed_filename = None
+    make_unique_names = None
+
+app.config['DOWNLOAD_ENCODINGS'] = parse_encodings(app.config['DOWNLOAD_ENCODINGS'])
+logger.info(f"Download encodings: {', '.join(app.config['DOWNLOAD_ENCODINGS']) or 'none'}")
+
+try:
+    from export_writers import parse_formats, available_formats, write_export
+
+    logger.info(f"✅ export_writers module loaded (formats: {', '.join(available_formats()) or 'csv only'})")
+except ImportError as e:
+    logger.error(f"❌ Failed to import export_writers: {e}")
+    parse_formats = None
+    available_formats = None
+    write_export = None
 
 try:
     from auth_system import AuthManager, setup_auth_routes
 
-    # Инициализация менеджера авторизации
-    auth_manager = AuthManager(app)
-    setup_auth_routes(app, auth_manager)
     logger.info("✅ OAuth2 system loaded")
 except ImportError as e:
     logger.error(f"❌ Failed to import auth_system: {e}")
-    auth_manager = None
+    AuthManager = None
+
+try:
+    from watch_folder import WatchFolderDaemon, watch_directories_from_env
+
+    logger.info("✅ watch_folder module loaded")
+except ImportError as e:
+    logger.error(f"❌ Failed to import watch_folder: {e}")
+    WatchFolderDaemon = None
+    watch_directories_from_env = None
+
+# Менеджер авторизации, очередь, хранилище загрузок, кеш и пробы создаются в create_app(),
+# а не при импорте: процессы разбора (spawn) импортируют запущенный скриптом main.py заново
+# под именем __mp_main__, и повторять в каждом из них создание БД, папок и маршрутов незачем
+auth_manager = None
+job_queue = None
+blob_store = None
+upload_manager = None
+extraction_cache = None
+path_ingestor = None
+readiness = None
+
+# Пул обработчиков и наблюдатель за папками создаются при запуске приложения
+job_workers = None
+_watch_lock = None
+_workers_lock = None
+watch_daemon = None
+
+# Ожидание блокировки обработчиков процессами-воркерами, не получившими ее
+_workers_election = None
+_workers_election_stop = threading.Event()
+
+# Интервал повторной попытки получить блокировку обработчиков узла (секунды)
+WORKERS_ELECTION_INTERVAL = 5
+
+# Ожидание текущих конвертаций при остановке процесса с обработчиками (секунды): задача
+# идет не дольше JOB_DEADLINE_SECONDS, запас - на проверку токена отмены после срока
+JOB_DRAIN_TIMEOUT = float(os.getenv('JOB_DRAIN_TIMEOUT', str(JOB_DEADLINE_SECONDS + 30)))
+
+
+def sheets_readiness():
+    """Проверка учетных данных Google Sheets для /health/ready"""
+    status = check_google_sheets_status()
+    return {'ok': status == 'configured', 'status': status}
 
 
 def allowed_file(filename):
@@ -80,6 +174,11 @@ def allowed_file(filename):
         filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
 
+def allowed_upload(filename):
+    """Проверка файлов, загружаемых по частям: IFC или ZIP архив для пакетной загрузки"""
+    return allowed_file(filename) or is_archive(filename)
+
+
 def format_uptime(start_time):
     """Форматирует время работы приложения в читаемый формат"""
     uptime = datetime.now() - start_time
@@ -148,11 +247,19 @@ def index():
             "endpoints": {
                 "health": "/health",
                 "upload": "/uploads",
+                "chunked_upload": "/uploads/chunked",
+                "batch_upload": "/uploads/batch",
+                "ingest": "/ingest",
+                "jobs": "/jobs/<job_id>",
+                "job_events": "/jobs/<job_id>/events",
                 "download": "/downloads/<filename>"
             },
             "features": {
                 "multiple_files": True,
+                "zip_batch": True,
+                "path_ingest": path_ingestor.enabled,
                 "area_coefficient": True,
+                "async_jobs": True,
                 "oauth2": auth_manager is not None
             },
             "documentation": "See /health for system status"
@@ -171,8 +278,11 @@ def health_check():
         current_time = datetime.now()
         timestamp_formatted = current_time.strftime('%d.%m.%Y %H:%M:%S')
 
-        # Проверяем Google Sheets API
-        gs_status = check_google_sheets_status()
+        # Статус Google Sheets API берем из кешированной проверки готовности
+        if readiness:
+            gs_status = readiness.result()['checks']['google_sheets'].get('status', 'error')
+        else:
+            gs_status = check_google_sheets_status()
 
         # Если запрос с заголовком Accept: application/json, возвращаем JSON
         if request.headers.get('Accept') == 'application/json' or request.args.get('format') == 'json':
@@ -250,12 +360,18 @@ def health_check():
 
 @app.route('/uploads', methods=['POST'])
 def upload_files():
-    """API для загрузки и обработки нескольких IFC-файлов (обратная совместимость с одиночной загрузкой)"""
-    start_time = time.time()
-
+    """API для загрузки IFC-файлов и постановки конвертации в очередь (обратная совместимость с одиночной загрузкой)"""
     try:
+        # Отказ при заполненной очереди до приема файлов запроса
+        rejected = check_admission()
+        if rejected:
+            return rejected
+
+        # Файлы, ранее загруженные по частям через /uploads/chunked
+        upload_ids = request.form.getlist('upload_ids')
+
         # Проверка наличия файлов в запросе
-        if 'files' not in request.files and 'file' not in request.files:
+        if 'files' not in request.files and 'file' not in request.files and not upload_ids:
             return jsonify({"error": "No file part"}), 400
 
         # Поддержка как одиночной загрузки (для обратной совместимости), так и множественной
@@ -267,28 +383,36 @@ def upload_files():
             if single_file.filename:
                 files = [single_file]
 
-        if not files or all(f.filename == '' for f in files):
+        files = [f for f in files if f.filename]
+
+        if not files and not upload_ids:
             return jsonify({"error": "No selected files"}), 400
 
         # Проверка количества файлов
-        if len(files) > app.config['MAX_FILES']:
+        if len(files) + len(upload_ids) > app.config['MAX_FILES']:
             return jsonify({"error": f"Too many files. Maximum is {app.config['MAX_FILES']}"}), 400
 
         # Получение коэффициента площади из запроса
-        area_coefficient = DEFAULT_AREA_COEFFICIENT
-        try:
-            area_coefficient = float(request.form.get('area_coefficient', DEFAULT_AREA_COEFFICIENT))
-            # Валидация коэффициента
-            if not 0.5 <= area_coefficient <= 1.0:
-                area_coefficient = DEFAULT_AREA_COEFFICIENT
-                logger.warning(f"Invalid area coefficient, using default: {DEFAULT_AREA_COEFFICIENT}")
-        except (ValueError, TypeError):
-            area_coefficient = DEFAULT_AREA_COEFFICIENT
+        area_coefficient = get_area_coefficient()
+
+        # Список сохраненных файлов для задачи
+        saved_files = []
+
+        # Подключаем собранные загрузки по частям
+        for upload_id in upload_ids:
+            upload = upload_manager.get_completed(upload_id)
+            if upload is None or not owns_upload(upload):
+                return jsonify({"error": f"Chunked upload not found or incomplete: {upload_id}"}), 400
 
-        # Список для хранения путей загруженных файлов
-        uploaded_paths = []
-        original_names = []
-        total_size = 0
+            if not allowed_file(upload['filename']):
+                return jsonify({"error": f"ZIP archives must be submitted to /uploads/batch: {upload['filename']}"}), 400
+
+            saved_files.append({
+                'path': upload['path'],
+                'original_name': upload['filename'],
+                'size': upload['total_size'],
+                'sha256': upload['sha256']
+            })
 
         # Сохраняем все файлы
         for file in files:
@@ -297,80 +421,438 @@ def upload_files():
                 continue
 
             original_name = file.filename
-            if get_next_indexed_filename:
-                safe_filename = get_next_indexed_filename(app.config['UPLOAD_FOLDER'], original_name)
-            else:
-                safe_filename = original_name
 
-            ifc_path = os.path.join(app.config['UPLOAD_FOLDER'], safe_filename)
-            file.save(ifc_path)
-            file_size = os.path.getsize(ifc_path)
-            total_size += file_size
+            # Переименование уже записанного файла в хранилище по хешу; копия
+            # повторно загруженной модели удаляется (место, но не запись, экономится)
+            ifc_path, file_size, file_sha256, _ = store_upload(file, blob_store)
 
-            uploaded_paths.append(ifc_path)
-            original_names.append(original_name)
+            saved_file = {
+                'path': ifc_path,
+                'original_name': original_name,
+                'size': file_size,
+                'sha256': file_sha256
+            }
+            # Счетчики для оценки длительности посчитаны при приеме вместе с хешем
+            if isinstance(file.stream, HashingUploadFile):
+                saved_file['preflight'] = file.stream.preflight
+            saved_files.append(saved_file)
 
-            logger.info(f"File uploaded: {original_name} -> {safe_filename} ({file_size} bytes)")
+            logger.info(f"File uploaded: {original_name} -> {ifc_path} ({file_size} bytes)")
 
-        if not uploaded_paths:
+        if not saved_files:
             return jsonify({"error": "No valid IFC files were uploaded"}), 400
 
+        return enqueue_conversion(saved_files, area_coefficient)
+
+    except HTTPException as e:
+        # Превышение размера и поврежденные сжатые данные при разборе формы
+        return jsonify({"error": e.description}), e.code
+    except Exception as e:
+        logger.error(f"Upload error: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Upload failed: {str(e)}"}), 500
+
+
+@app.route('/uploads/batch', methods=['POST'])
+def upload_batch():
+    """
+    API пакетной загрузки: ZIP архивы с IFC файлами и/или файлы, загруженные по частям
+
+    Архив сохраняется в хранилище целиком, IFC файлы читаются из него
+    обработчиком по одному, без распаковки всего архива. Ограничение MAX_FILES не действует,
+    вместо него - MAX_BATCH_FILES на общее число IFC файлов.
+    """
+    try:
+        rejected = check_admission()
+        if rejected:
+            return rejected
+
+        upload_ids = request.form.getlist('upload_ids')
+        archives = [f for f in request.files.getlist('archive') if f.filename]
+
+        if not archives and not upload_ids:
+            return jsonify({"error": "No archive or upload_ids"}), 400
+
+        area_coefficient = get_area_coefficient()
+
+        # Сохраненные архивы и файлы в порядке передачи
+        stored_files = []
+
+        for archive in archives:
+            if not is_archive(archive.filename):
+                return jsonify({"error": f"Only ZIP archives are accepted: {archive.filename}"}), 400
+
+            archive_path, archive_size, archive_sha256, _ = store_upload(archive, blob_store)
+            stored_files.append({
+                'path': archive_path,
+                'original_name': archive.filename,
+                'size': archive_size,
+                'sha256': archive_sha256
+            })
+            logger.info(f"Batch archive uploaded: {archive.filename} -> {archive_path} ({archive_size} bytes)")
+
+        for upload_id in upload_ids:
+            upload = upload_manager.get_completed(upload_id)
+            if upload is None or not owns_upload(upload):
+                return jsonify({"error": f"Chunked upload not found or incomplete: {upload_id}"}), 400
+
+            stored_files.append({
+                'path': upload['path'],
+                'original_name': upload['filename'],
+                'size': upload['total_size'],
+                'sha256': upload['sha256']
+            })
+
+        # Архивы раскрываются в список IFC файлов по оглавлению
+        saved_files = []
+        for stored_file in stored_files:
+            if not is_archive(stored_file['original_name']):
+                if not allowed_file(stored_file['original_name']):
+                    return jsonify({"error": f"Unsupported file type: {stored_file['original_name']}"}), 400
+                saved_files.append(stored_file)
+                continue
+
+            try:
+                members = list_archive_members(
+                    stored_file['path'],
+                    max_entries=app.config['MAX_ARCHIVE_ENTRIES'],
+                    max_member_size=app.config['MAX_ARCHIVE_MEMBER_SIZE'],
+                    max_total_size=app.config['MAX_ARCHIVE_TOTAL_SIZE']
+                )
+            except ValueError as e:
+                return jsonify({"error": f"{stored_file['original_name']}: {str(e)}"}), 400
+            except HTTPException as e:
+                return jsonify({"error": f"{stored_file['original_name']}: {e.description}"}), e.code
+
+            if not members:
+                return jsonify({"error": f"No IFC files in archive: {stored_file['original_name']}"}), 400
+
+            for member, member_size in members:
+                saved_files.append({
+                    'path': stored_file['path'],
+                    'member': member,
+                    'archive_name': stored_file['original_name'],
+                    'original_name': os.path.basename(member),
+                    'size': member_size,
+                    'sha256': stored_file['sha256']
+                })
+
+        if len(saved_files) > app.config['MAX_BATCH_FILES']:
+            return jsonify({"error": f"Too many files in batch. Maximum is {app.config['MAX_BATCH_FILES']}"}), 400
+
+        # Один архив - итоговый CSV называется по архиву
+        combined_name = None
+        if len(stored_files) == 1 and is_archive(stored_files[0]['original_name']):
+            combined_name = os.path.splitext(stored_files[0]['original_name'])[0]
+
+        return enqueue_conversion(saved_files, area_coefficient, combined_name)
+
+    except HTTPException as e:
+        return jsonify({"error": e.description}), e.code
+    except Exception as e:
+        logger.error(f"Batch upload error: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Batch upload failed: {str(e)}"}), 500
+
+
+def get_area_coefficient():
+    """Коэффициент площади из формы (или JSON) запроса с проверкой допустимого диапазона"""
+    area_coefficient = DEFAULT_AREA_COEFFICIENT
+    data = request.get_json(silent=True) or request.form
+    try:
+        area_coefficient = float(data.get('area_coefficient', DEFAULT_AREA_COEFFICIENT))
+        # Валидация коэффициента
+        if not 0.5 <= area_coefficient <= 1.0:
+            area_coefficient = DEFAULT_AREA_COEFFICIENT
+            logger.warning(f"Invalid area coefficient, using default: {DEFAULT_AREA_COEFFICIENT}")
+    except (ValueError, TypeError):
+        area_coefficient = DEFAULT_AREA_COEFFICIENT
+    return area_coefficient
+
+
+def get_deadline_seconds():
+    """Срок выполнения задачи из запроса (None - срок по умолчанию JOB_DEADLINE_SECONDS)"""
+    data = request.get_json(silent=True) or request.form
+    try:
+        deadline_seconds = float(data.get('deadline_seconds') or 0)
+    except (ValueError, TypeError):
+        return None
+    return deadline_seconds if deadline_seconds > 0 else None
+
+
+def get_per_file_export():
+    """Запрошены ли CSV отдельных файлов вместе с общим (поле per_file формы или JSON)"""
+    data = request.get_json(silent=True) or request.form
+    value = data.get('per_file', False)
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def get_export_formats():
+    """
+    Дополнительные форматы результата из запроса (поле formats: "parquet,xlsx")
+
+    :raises ValueError: неизвестный или недоступный на сервере формат
+    """
+    data = request.get_json(silent=True) or request.form
+    formats = data.getlist('formats') if hasattr(data, 'getlist') else data.get('formats')
+    if formats and not parse_formats:
+        raise ValueError("Export formats are not available on this server")
+    return parse_formats(formats) if formats else []
+
+
+def get_client_id():
+    """Идентификатор клиента для ограничений очереди: пользователь или IP адрес"""
+    user = session.get('user')
+    if user:
+        return f"user:{user['id']}"
+    # За nginx адрес клиента передается в X-Real-IP
+    return f"ip:{request.headers.get('X-Real-IP', request.remote_addr)}"
+
+
+def queue_full_response(error):
+    """Ответ 429 с рекомендуемым временем повтора"""
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
+
+def check_admission():
+    """Проверка допуска в очередь: ответ 429 при превышении лимитов, иначе None"""
+    try:
+        job_queue.check_admission(get_client_id())
+    except QueueFullError as e:
+        logger.warning(f"Conversion rejected for {get_client_id()}: {e}")
+        return queue_full_response(e)
+    return None
+
+
+def enqueue_conversion(saved_files, area_coefficient, combined_name=None):
+    """
+    Постановка конвертации сохраненных файлов в очередь
+
+    :param saved_files: список файлов (path, original_name, size, sha256, для архивов - member)
+    :param area_coefficient: коэффициент площади
+    :param combined_name: имя итогового CSV (по умолчанию определяется по числу файлов)
+    :return: ответ 202 со ссылкой на статус задачи или 429, если очередь заполнена
+    """
+    try:
+        export_formats = get_export_formats()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Оценка длительности по числу сущностей и зон для планировщика очереди:
+    # файл не перечитывается целиком, время ответа ограничено временем загрузки
+    predicted_seconds, counters = estimate_job_seconds(saved_files)
+
+    # Параметры конвертации для фонового обработчика
+    user = session.get('user')
+    payload = {
+        'files': saved_files,
+        'area_coefficient': area_coefficient,
+        'combined_name': combined_name,
+        'per_file': get_per_file_export() and len(saved_files) > 1,
+        'formats': export_formats,
+        'preflight': {
+            'entities': sum(c['entities'] for c in counters),
+            'zones': sum(c['zones'] for c in counters)
+        },
+        'user': {'id': user['id'], 'email': user['email']} if user else None
+    }
+
+    try:
+        job_id = job_queue.enqueue(
+            payload,
+            user_id=user['id'] if user else None,
+            client=get_client_id(),
+            memory_mb=estimate_job_memory(saved_files, EXTRACT_WORKERS),
+            predicted_seconds=predicted_seconds,
+            deadline_seconds=get_deadline_seconds(),
+            admission=True
+        )
+    except QueueFullError as e:
+        # Сохраненные файлы остаются в хранилище и берутся по хешу при повторе
+        logger.warning(f"Conversion rejected for {get_client_id()}: {e}")
+        return queue_full_response(e)
+
+    # Статус, события, отмена и архив результатов доступны только этому клиенту
+    remember_job(job_id)
+
+    # Ссылки исходных имен и задачи на файлы хранилища (архив - одна ссылка на все элементы)
+    referenced = set()
+    for saved_file in saved_files:
+        # Файлы, прочитанные по пути, в хранилище не попадают
+        if saved_file.get('ingested'):
+            continue
+        reference = (saved_file['sha256'], saved_file.get('archive_name', saved_file['original_name']))
+        if reference in referenced:
+            continue
+        referenced.add(reference)
+        blob_store.add_reference(
+            reference[0],
+            reference[1],
+            job_id=job_id,
+            user_id=user['id'] if user else None
+        )
+
+    return jsonify({
+        "status": "queued",
+        "job_id": job_id,
+        "position": job_queue.get_job(job_id).get('position'),
+        "predicted_seconds": predicted_seconds,
+        "status_url": url_for('job_status', job_id=job_id),
+        "cancel_url": url_for('cancel_job', job_id=job_id),
+        "original_filenames": [f['original_name'] for f in saved_files],
+        "files_received": len(saved_files),
+        "area_coefficient": area_coefficient
+    }), 202
+
+
+def process_conversion_job(job):
+    """
+    Обработка задачи конвертации в фоновом потоке
+
+    :param job: задача из очереди с сохраненными файлами и параметрами
+    :return: результат для API статуса задачи
+    """
+    start_time = time.time()
+    payload = job['payload']
+    user = payload.get('user')
+    preflight = payload.get('preflight') or {}
+    original_names = [f['original_name'] for f in payload['files']]
+
+    # Файлы хранятся под хешем, в столбец File попадают исходные имена
+    file_names = make_unique_names(original_names) if make_unique_names else None
+    total_size = sum(f['size'] for f in payload['files'])
+    area_coefficient = payload.get('area_coefficient', DEFAULT_AREA_COEFFICIENT)
+
+    # Публикация этапов для потока /jobs/<id>/events
+    progress = job_queue.progress(job['id'])
+
+    # Отмена пользователем и срок выполнения задачи
+    cancel = job_queue.cancellation_token(job)
+
+    # Хеш файлов на общем хранилище считается здесь, а не в запросе /ingest
+    # (и учитывает изменения после постановки в очередь)
+    for file_info in payload['files']:
+        if file_info.get('ingested'):
+            try:
+                _, file_info['sha256'], _ = path_ingestor.fingerprint(file_info['path'])
+            except OSError:
+                file_info['sha256'] = None
+
+    cache_keys = [cache_key_for(f) for f in payload['files']]
+
+    # Вкладка Google Sheets создается параллельно с разбором IFC
+    worksheet_future = None
+
+    try:
         # Проверка наличия модуля обработки
-        if not export_flats_multiple and not export_flats:
-            return jsonify({"error": "IFC processing module not available"}), 500
+        if not export_flats_table:
+            raise RuntimeError("IFC processing module not available")
+
+        # Элементы ZIP архивов читаются обработчиком прямо из архива
+        uploaded_paths = [
+            ArchiveMember(f['path'], f['member']) if f.get('member') else f['path']
+            for f in payload['files']
+        ]
 
         # Определяем имя для объединенного файла
-        if len(uploaded_paths) == 1:
+        if payload.get('combined_name'):
+            combined_name = payload['combined_name']
+        elif len(uploaded_paths) == 1:
             combined_name = os.path.splitext(original_names[0])[0]
         else:
             combined_name = f"combined_{len(uploaded_paths)}_files"
 
-        # Обработка IFC файлов
-        if export_flats_multiple and len(uploaded_paths) > 1:
-            # Используем новую функцию для множественной обработки
-            csv_path = export_flats_multiple(
+        # Задачи наблюдателя за папками загружают результат в Sheets только по настройке
+        upload_to_sheets = upload_to_google_sheets and payload.get('upload_to_sheets', True)
+
+        if prepare_worksheet_async and upload_to_sheets:
+            worksheet_future = prepare_worksheet_async(combined_name)
+
+        # Ошибки отдельных файлов пакета не прерывают конвертацию
+        failed_files = []
+
+        # CSV отдельных файлов пишутся из тех же строк, что и общий (архив /jobs/<id>/bundle)
+        file_outputs = [] if payload.get('per_file') else None
+
+        # Обработка IFC файлов: разбор идет параллельно, строки остаются в памяти
+        if len(uploaded_paths) > 1 or payload.get('combined_name'):
+            csv_path, rows = export_flats_table(
                 uploaded_paths,
                 app.config['DOWNLOAD_FOLDER'],
                 area_coefficient,
-                combined_name
+                combined_name,
+                progress=progress,
+                file_names=file_names,
+                errors=failed_files,
+                cache=extraction_cache,
+                cache_keys=cache_keys,
+                cancel=cancel,
+                encodings=app.config['DOWNLOAD_ENCODINGS'],
+                keep_plain=app.config['DOWNLOAD_KEEP_PLAIN'],
+                file_outputs=file_outputs
             )
-        elif export_flats:
-            # Fallback к старой функции для одного файла
-            csv_path = export_flats(
-                uploaded_paths[0],
+        else:
+            # Один файл - параметры как у export_flats (обратная совместимость)
+            csv_path, rows = export_flats_table(
+                uploaded_paths,
                 app.config['DOWNLOAD_FOLDER'],
-                original_names[0]
+                DEFAULT_AREA_COEFFICIENT,
+                original_names[0],
+                progress=progress,
+                file_names=[os.path.splitext(original_names[0])[0]],
+                cache=extraction_cache,
+                cache_keys=cache_keys,
+                cancel=cancel,
+                encodings=app.config['DOWNLOAD_ENCODINGS'],
+                keep_plain=app.config['DOWNLOAD_KEEP_PLAIN']
             )
-        else:
-            return jsonify({"error": "IFC processing module not available"}), 500
 
         csv_filename = os.path.basename(csv_path)
         logger.info(f"CSV generated: {csv_path}")
 
-        # Подсчет количества обработанных квартир
-        processed_flats = 0
-        try:
-            with open(csv_path, 'r', encoding='utf-8') as f:
-                processed_flats = sum(1 for line in f) - 1  # Исключаем заголовок
-        except Exception:
-            pass
+        # Дополнительные форматы - из тех же строк, без повторного разбора и чтения CSV
+        # Ошибка формата не отменяет готовый CSV, как и ошибка Google Sheets
+        exports = []
+        failed_exports = []
+        for export_format in payload.get('formats') or []:
+            cancel.check()
+            progress.publish('writing_export', format=export_format, rows=len(rows))
+            try:
+                export_path = write_export(export_format, app.config['DOWNLOAD_FOLDER'],
+                                           os.path.splitext(csv_filename)[0], rows)
+                exports.append({"format": export_format, "path": os.path.basename(export_path)})
+            except Exception as export_error:
+                logger.error(f"Export to {export_format} failed: {export_error}", exc_info=True)
+                failed_exports.append({"format": export_format, "error": str(export_error)})
+
+        # Количество квартир известно без повторного чтения CSV
+        processed_flats = len(rows)
 
         # Попытка загрузки в Google Sheets
         sheet_url = None
         gs_error_message = None
 
-        if upload_to_google_sheets:
+        if upload_to_sheets:
+            # Отмененной задаче вкладка не нужна (удаляется в обработчике ошибки)
+            cancel.check()
+            progress.publish('uploading_sheets')
             try:
-                sheet_url = upload_to_google_sheets(csv_path, combined_name)
+                target = worksheet_future.result() if worksheet_future else None
+                worksheet_future = None
+                sheet_data = [CSV_HEADER] + [[str(value) for value in row] for row in rows]
+                sheet_url = upload_to_google_sheets(csv_path, combined_name, data=sheet_data, target=target)
                 logger.info(f"Uploaded to Google Sheets: {sheet_url}")
             except Exception as gs_error:
                 gs_error_message = str(gs_error)
                 logger.warning(f"Google Sheets upload failed: {gs_error_message}")
 
         processing_time = time.time() - start_time
+        logger.info(f"Job {job['id']} took {processing_time:.1f}s (predicted {job.get('predicted_seconds')}s)")
 
         # Сохранение в историю (если пользователь авторизован)
-        if 'user' in session and auth_manager:
+        if user and auth_manager:
             conversion_data = {
                 'original_filename': ', '.join(original_names),
                 'csv_filename': csv_filename,
@@ -378,18 +860,21 @@ def upload_files():
                 'file_size': total_size,
                 'processed_flats': processed_flats,
                 'processing_time': processing_time,
+                'predicted_time': job.get('predicted_seconds'),
+                'entity_count': preflight.get('entities'),
+                'zone_count': preflight.get('zones'),
                 'status': 'success',
                 'error_message': gs_error_message
             }
 
             try:
-                auth_manager.save_conversion(session['user']['id'], conversion_data)
-                logger.info(f"Conversion saved to history for user: {session['user']['email']}")
+                auth_manager.save_conversion(user['id'], conversion_data)
+                logger.info(f"Conversion saved to history for user: {user['email']}")
             except Exception as e:
                 logger.error(f"Failed to save conversion to history: {str(e)}")
 
-        # Формируем ответ
-        response_data = {
+        # Формируем результат
+        result = {
             "status": "success",
             "csv_path": csv_filename,
             "original_filename": original_names[0] if len(original_names) == 1 else None,  # Для обратной совместимости
@@ -397,65 +882,219 @@ def upload_files():
             "files_processed": len(uploaded_paths),
             "processed_flats": processed_flats,
             "processing_time": round(processing_time, 2),
+            "predicted_time": job.get('predicted_seconds'),
             "area_coefficient": area_coefficient,
-            "combined": len(uploaded_paths) > 1
+            "combined": len(uploaded_paths) > 1,
+            "failed_files": failed_files
         }
+        if exports:
+            result["exports"] = exports
+        if failed_exports:
+            result["failed_exports"] = failed_exports
+        if file_outputs:
+            result["file_csv_paths"] = [
+                {"file": file_name, "csv_path": os.path.basename(file_path)} for file_name, file_path in file_outputs
+            ]
 
         # Добавляем информацию о Google Sheets
         if sheet_url:
-            response_data["sheet_url"] = sheet_url
-            response_data["google_sheets_status"] = "success"
+            result["sheet_url"] = sheet_url
+            result["google_sheets_status"] = "success"
+        elif upload_to_google_sheets and not upload_to_sheets:
+            result["sheet_url"] = None
+            result["google_sheets_status"] = "skipped"
         else:
-            response_data["sheet_url"] = None
-            response_data["google_sheets_status"] = "failed"
+            result["sheet_url"] = None
+            result["google_sheets_status"] = "failed"
             if gs_error_message:
-                response_data["google_sheets_error"] = gs_error_message
+                result["google_sheets_error"] = gs_error_message
 
-        return jsonify(response_data)
+        return result
 
     except Exception as e:
         processing_time = time.time() - start_time
-        logger.error(f"Processing error: {str(e)}", exc_info=True)
+        if isinstance(e, ConversionCancelled):
+            logger.info(f"Processing stopped: {str(e)}")
+        else:
+            logger.error(f"Processing error: {str(e)}", exc_info=True)
+
+        # Заранее созданная вкладка не понадобится - удаляем ее, когда она будет готова
+        if worksheet_future is not None and discard_worksheet:
+            worksheet_future.add_done_callback(
+                lambda future: future.exception() is None and discard_worksheet(future.result())
+            )
 
         # Сохранение ошибки в историю
-        if 'user' in session and auth_manager:
+        if user and auth_manager:
             error_conversion_data = {
-                'original_filename': 'multiple files' if 'files' in request.files else 'unknown',
+                'original_filename': ', '.join(original_names),
                 'csv_filename': None,
                 'sheet_url': None,
-                'file_size': 0,
+                'file_size': total_size,
                 'processed_flats': 0,
                 'processing_time': processing_time,
-                'status': 'error',
+                'predicted_time': job.get('predicted_seconds'),
+                'entity_count': preflight.get('entities'),
+                'zone_count': preflight.get('zones'),
+                'status': 'cancelled' if isinstance(e, ConversionCancelled) and not isinstance(e, DeadlineExceeded)
+                else 'error',
                 'error_message': str(e)
             }
 
             try:
-                auth_manager.save_conversion(session['user']['id'], error_conversion_data)
+                auth_manager.save_conversion(user['id'], error_conversion_data)
             except Exception:
                 pass
 
-        return jsonify({"error": f"Processing failed: {str(e)}"}), 500
+        raise
 
 
 @app.route('/downloads/<path:filename>', methods=['GET'])
 def download_file(filename):
     """Скачивание CSV-файла"""
     try:
-        safe_path = os.path.join(app.config['DOWNLOAD_FOLDER'], os.path.basename(filename))
-
-        if not os.path.exists(safe_path):
-            logger.warning(f"File not found: {safe_path}")
+        # Повторное скачивание: ETag из индекса хешей, файл не открывается
+        etag = download_not_modified(filename, request.if_none_match, request.headers.get('Accept-Encoding'))
+        if etag:
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.vary.add('Accept-Encoding')
+            return response
+
+        safe_path = resolve_download_path(filename)
+        if safe_path is None:
             return jsonify({"error": "File not found"}), 404
 
-        return send_file(safe_path, as_attachment=True)
+        if app.config['X_ACCEL_REDIRECT']:
+            return accel_redirect_response(safe_path)
+
+        # Сжатый вариант по Accept-Encoding; без поддержки сжатия - распаковка на лету
+        name = os.path.basename(safe_path)
+        variant = select_variant(safe_path, request.headers.get('Accept-Encoding'))
+        etag = variant_etag(safe_path, variant)
+        if variant.decode:
+            response = app.response_class(iter_decoded(variant), mimetype=download_mimetype(name))
+            response.headers['Content-Disposition'] = download_disposition(name)
+            response.set_etag(etag)
+        else:
+            # Range и If-Range по ETag содержимого обрабатывает send_file
+            response = send_file(variant.path, as_attachment=True, download_name=name,
+                                 mimetype=download_mimetype(name), etag=etag)
+            if variant.encoding:
+                response.headers['Content-Encoding'] = variant.encoding
+        response.vary.add('Accept-Encoding')
+        return response
     except Exception as e:
         logger.error(f"Download error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 
-# Простые fallback маршруты если OAuth2 не загружен
-@app.route('/login')
+@app.route('/jobs/<job_id>/bundle', methods=['GET'])
+def download_bundle(job_id):
+    """Общий CSV, дополнительные форматы и CSV отдельных файлов задачи одним ZIP, формируемым на лету"""
+    try:
+        bundle = resolve_bundle(job_id)
+        if bundle is None:
+            return jsonify({"error": "Bundle not found"}), 404
+
+        zip_name, entries = bundle
+        response = app.response_class(iter_zip_bundle(entries), mimetype='application/zip')
+        response.headers['Content-Disposition'] = download_disposition(zip_name)
+        return response
+    except Exception as e:
+        logger.error(f"Bundle download error: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+
+def resolve_bundle(job_id):
+    """
+    Состав архива результатов задачи текущего клиента (используется и ASGI входом
+    в контексте запроса)
+
+    :return: (имя архива, [(имя в архиве, путь к результату)]) или None
+    """
+    job = get_owned_job(job_queue, job_id)
+    if job is None or not job['result'] or not (job['result'].get('file_csv_paths') or job['result'].get('exports')):
+        return None
+
+    result = job['result']
+    entries = [(result['csv_path'], resolve_download_path(result['csv_path']))]
+    for export in result.get('exports', []):
+        entries.append((export['path'], resolve_download_path(export['path'])))
+    for file_output in result.get('file_csv_paths', []):
+        entries.append((f"files/{file_output['file']}.csv", resolve_download_path(file_output['csv_path'])))
+    # Удаленные результаты в архив не попадают
+    entries = [(arcname, path) for arcname, path in entries if path]
+    if not entries:
+        return None
+    return f"{os.path.splitext(result['csv_path'])[0]}.zip", entries
+
+
+def download_path(filename):
+    """Путь к файлу результата в папке скачивания (без проверки существования)"""
+    # Абсолютный путь: send_file разрешает относительные пути от папки приложения, а не от рабочей
+    return os.path.abspath(os.path.join(app.config['DOWNLOAD_FOLDER'], os.path.basename(filename)))
+
+
+def download_not_modified(filename, if_none_match, accept_encoding):
+    """
+    Проверка If-None-Match по индексу хешей результатов (используется и ASGI входом)
+
+    :param if_none_match: werkzeug ETags из заголовка If-None-Match
+    :return: ETag, если у клиента актуальная копия, иначе None
+    """
+    if not if_none_match:
+        return None
+    etag = cached_etag(download_path(filename), accept_encoding)
+    if etag and if_none_match.contains_weak(etag):
+        return etag
+    return None
+
+
+def resolve_download_path(filename):
+    """Путь к файлу результата в папке скачивания или None (используется и ASGI входом)"""
+    safe_path = download_path(filename)
+
+    # Скрытые служебные файлы (индекс имен и т.п.) не отдаем; CSV может храниться только сжатым
+    if os.path.basename(filename).startswith('.') or not existing_variants(safe_path):
+        logger.warning(f"File not found: {safe_path}")
+        return None
+    return safe_path
+
+
+def download_disposition(name):
+    """Заголовок Content-Disposition для скачивания (имена не в ASCII - в виде filename*)"""
+    try:
+        return f'attachment; filename="{name.encode("ascii").decode()}"'
+    except UnicodeEncodeError:
+        return f"attachment; filename*=UTF-8''{quote(name)}"
+
+
+def download_mimetype(name):
+    """Тип содержимого файла результата по имени (сжатый файл, запрошенный по имени, - как есть)"""
+    mimetype, encoding = mimetypes.guess_type(name)
+    if encoding:
+        return 'application/octet-stream'
+    return mimetype or 'application/octet-stream'
+
+
+def accel_redirect_response(path):
+    """
+    Ответ без тела с X-Accel-Redirect: файл отдает nginx из внутреннего location
+
+    Приложение только проверяет путь, передачу (sendfile, Range) выполняет nginx;
+    Content-Type и Content-Disposition nginx берет из этого ответа, сжатый вариант
+    (name.csv.gz) выбирает сам (gzip_static в nginx.conf).
+    """
+    name = os.path.basename(path)
+    response = app.response_class(status=200)
+    response.headers['X-Accel-Redirect'] = app.config['X_ACCEL_REDIRECT'].rstrip('/') + '/' + quote(name)
+    response.headers['Content-Type'] = download_mimetype(name)
+    response.headers['Content-Disposition'] = download_disposition(name)
+    return response
+
+
+# Простые fallback маршруты если OAuth2 не загружен (регистрируются в init_services)
 def login_fallback():
     """Fallback для входа"""
     if auth_manager:
@@ -464,7 +1103,6 @@ def login_fallback():
     return jsonify({"error": "OAuth2 system not available"}), 503
 
 
-@app.route('/dashboard')
 def dashboard_fallback():
     """Fallback для dashboard"""
     if auth_manager and 'user' in session:
@@ -497,29 +1135,238 @@ def internal_error(e):
     return jsonify({"error": "Internal server error"}), 500
 
 
-def create_app():
-    """Фабрика приложений для Gunicorn"""
+def start_job_workers(watch=True):
+    """
+    Запуск фоновых обработчиков очереди конвертаций
+
+    :param watch: запустить и наблюдение за папками (при нескольких процессах - только в одном)
+    """
+    global job_workers
+
+    if job_workers:
+        return
+
+    job_workers = JobWorkerPool(
+        job_queue,
+        process_conversion_job,
+        workers=int(os.getenv('JOB_WORKERS', '2'))
+    )
+    job_workers.start()
+
+    if watch:
+        start_watch_daemon()
+
+
+def _try_lock(suffix):
+    """Неблокирующая файловая блокировка рядом с БД очереди: открытый файл или None"""
+    lock = open(os.getenv('JOBS_DB_PATH', 'jobs.db') + suffix, 'a')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+
+def acquire_watch_lock():
+    """
+    Файловая блокировка наблюдения за папками
+
+    При нескольких процессах приложения (воркеры gunicorn/uvicorn) наблюдение
+    запускает только процесс, получивший блокировку. Она держится до завершения
+    процесса, после чего ее получает следующий запущенный воркер.
+
+    :return: True, если блокировка получена этим процессом
+    """
+    global _watch_lock
+
+    if _watch_lock is None:
+        _watch_lock = _try_lock('.watch.lock')
+    return _watch_lock is not None
+
+
+def acquire_workers_lock():
+    """
+    Файловая блокировка обработчиков очереди узла
+
+    В имени файла - имя хоста: БД очереди общая для узлов, а обработчики
+    нужны на каждом узле, но только в одном его процессе.
+
+    :return: True, если блокировка получена этим процессом
+    """
+    global _workers_lock
+
+    if _workers_lock is None:
+        _workers_lock = _try_lock(f".{socket.gethostname()}.workers.lock")
+    return _workers_lock is not None
+
+
+def elect_job_workers(on_elected=None):
+    """
+    Запуск обработчиков очереди в одном процессе узла (воркеры gunicorn/uvicorn)
+
+    Обработчики в каждом воркере дали бы на узле (число воркеров) x JOB_WORKERS
+    потоков и столько же пулов по EXTRACT_WORKERS процессов разбора. Поэтому
+    обработчики (и наблюдение за папками) запускает только процесс, получивший
+    блокировку узла. Остальные процессы раз в WORKERS_ELECTION_INTERVAL секунд
+    пробуют получить ее и подхватывают обработку, когда держатель завершается
+    (остановка, падение).
+
+    :param on_elected: вызывается, когда этот процесс получил блокировку
+        (gunicorn отключает для него перезапуск по max_requests)
+    """
+    global _workers_election
+
+    def start():
+        if on_elected:
+            on_elected()
+        start_job_workers(watch=acquire_watch_lock())
+
+    if acquire_workers_lock():
+        start()
+        return
+
+    def wait_for_lock():
+        while not _workers_election_stop.wait(WORKERS_ELECTION_INTERVAL):
+            if acquire_workers_lock():
+                logger.info(f"Job workers lock acquired by process {os.getpid()}")
+                start()
+                return
+
+    _workers_election = threading.Thread(target=wait_for_lock, name='job-workers-election', daemon=True)
+    _workers_election.start()
+    logger.info(f"Job workers run in another process of this node, process {os.getpid()} is on standby")
+
+
+def job_workers_standby():
+    """Обработчики работают в другом процессе узла, этот процесс ждет блокировку"""
+    return job_workers is None and _workers_election is not None and _workers_election.is_alive()
+
+
+def stop_job_workers(timeout=None):
+    """Остановка обработчиков с ожиданием текущих задач (не дольше timeout секунд)"""
+    # Завершающийся процесс не должен подхватить обработку у соседей
+    _workers_election_stop.set()
+    if job_workers:
+        job_workers.stop(timeout)
+    if watch_daemon:
+        watch_daemon.stop()
+
+
+def start_watch_daemon():
+    """Запуск наблюдения за папками из WATCH_DIRS (если заданы)"""
+    global watch_daemon
+
+    if not WatchFolderDaemon or watch_daemon:
+        return
+
+    directories = watch_directories_from_env()
+    if not directories:
+        return
+
+    watch_daemon = WatchFolderDaemon(job_queue, directories, area_coefficient=DEFAULT_AREA_COEFFICIENT)
+    watch_daemon.start()
+
+
+def init_services():
+    """
+    Создание служб приложения и регистрация их маршрутов (один раз на процесс)
+
+    Менеджер авторизации, очередь задач, хранилище загрузок, загрузка по частям,
+    кеш извлечения, конвертация по пути и пробы готовности.
+    """
+    global auth_manager, job_queue, blob_store, upload_manager, extraction_cache, path_ingestor, readiness
+
+    if job_queue is not None:
+        return
+
     # Создание необходимых директорий
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     os.makedirs(app.config['DOWNLOAD_FOLDER'], exist_ok=True)
     os.makedirs('logs', exist_ok=True)
 
+    if AuthManager:
+        # Инициализация менеджера авторизации
+        auth_manager = AuthManager(app)
+        setup_auth_routes(app, auth_manager)
+
+    # При совпадении правил работает маршрут, зарегистрированный первым, поэтому fallback - после OAuth2
+    app.add_url_rule('/login', view_func=login_fallback)
+    app.add_url_rule('/dashboard', view_func=dashboard_fallback)
+
+    # Очередь задач конвертации и фоновые обработчики
+    job_queue = JobQueue()
+    setup_job_routes(app, job_queue)
+
+    # Загружаемые файлы пишутся сразу в папку загрузок с подсчетом SHA-256
+    # и хранятся один раз по хешу содержимого
+    init_upload_storage(app)
+    blob_store = BlobStore(os.path.join(app.config['UPLOAD_FOLDER'], 'blobs'))
+
+    # Возобновляемая загрузка больших файлов частями
+    upload_manager = ChunkedUploadManager(
+        app.config['UPLOAD_FOLDER'],
+        blob_store,
+        chunk_size=app.config['CHUNK_SIZE'],
+        max_file_size=app.config['MAX_CHUNKED_FILE_SIZE'],
+        max_decompressed_size=app.config['MAX_DECOMPRESSED_SIZE']
+    )
+    setup_chunked_upload_routes(app, upload_manager, allowed_upload)
+
+    # Повторная конвертация неизмененных файлов берет строки из кеша
+    extraction_cache = ExtractionCache()
+
+    # Конвертация файлов с общего хранилища по пути (корни из INGEST_ROOTS)
+    path_ingestor = PathIngestor()
+    setup_ingest_routes(app, path_ingestor, enqueue_conversion, get_area_coefficient,
+                        login_required=auth_manager.login_required if auth_manager else None)
+    logger.info(f"Path ingestion roots: {path_ingestor.roots or 'disabled'}")
+
+    # Пробы /health/live и /health/ready; результат готовности кешируется и обновляется в фоне
+    readiness_checks = {
+        'disk': disk_check([app.config['UPLOAD_FOLDER'], app.config['DOWNLOAD_FOLDER']]),
+        'google_sheets': sheets_readiness,
+        'jobs_db': sqlite_check(job_queue.db_path),
+        'job_workers': worker_pool_check(lambda: job_workers, job_queue, standby=job_workers_standby)
+    }
+    if auth_manager:
+        readiness_checks['users_db'] = sqlite_check(auth_manager.db_path)
+
+    # Выгрузка в Google Sheets необязательна: без нее конвертация работает
+    readiness = ReadinessChecker(readiness_checks, optional={'google_sheets'})
+    setup_health_routes(app, readiness)
+
+
+def create_app(start_workers=True):
+    """
+    Фабрика приложений для Gunicorn
+
+    :param start_workers: запустить фоновые обработчики. При preload_app приложение
+        создается в мастер-процессе до fork, потоки туда не переносятся - обработчики
+        запускаются в каждом воркере (post_worker_init в gunicorn.conf.py)
+    """
+    init_services()
+
+    if start_workers:
+        start_job_workers()
+
     logger.info("IFC Converter v3.0 with multiple file support initialized")
     return app
 
 
 if __name__ == '__main__':
-    # Создание необходимых директорий
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    os.makedirs(app.config['DOWNLOAD_FOLDER'], exist_ok=True)
-    os.makedirs('logs', exist_ok=True)
+    init_services()
+
+    # В режиме отладки обработчики запускаем только в дочернем процессе перезагрузчика
+    if not os.getenv('NGROK_URL') or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_job_workers()
 
     # Проверяем development режим с ngrok
     ngrok_url = os.getenv('NGROK_URL')
     if ngrok_url:
         logger.info(f"Starting IFC Converter v3.0 in development mode")
         logger.info(f"Ngrok URL: {ngrok_url}")
-        app.run(host='0.0.0.0', port=5000, debug=True)
+        app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5000')), debug=True)
     else:
-        logger.info("Starting IFC Converter v3.0 on port 5000...")
-        app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+        logger.info(f"Starting IFC Converter v3.0 on port {os.getenv('PORT', '5000')}...")
+        app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5000')), debug=False)
\ No newline at end of file
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Конвертация IFC файлов, уже лежащих на сервере (общее хранилище, NAS)
+
+Файлы указываются путем и читаются на месте, без копирования в UPLOAD_FOLDER.
+Допускаются только пути внутри корней из INGEST_ROOTS (через os.pathsep).
+
+Для обнаружения изменений ведется индекс (путь, размер, mtime) -> sha256:
+если размер и время изменения совпадают, файл не перечитывается для хеширования,
+а по хешу неизмененные файлы берутся из кеша извлечения (ExtractionCache).
+Хеш считается обработчиком задачи; запрос только проверяет пути и размеры.
+
+Маршруты доступны только вошедшим пользователям.
+"""
+
+import os
+import time
+import hashlib
+import sqlite3
+import logging
+from functools import wraps
+
+from flask import jsonify, request
+
+logger = logging.getLogger('ifc-exporter')
+
+# Размер блока при хешировании файлов
+HASH_BUFFER_SIZE = 1024 * 1024
+
+# Расширения файлов, принимаемых по пути
+INGEST_EXTENSIONS = {'ifc'}
+
+
+class IngestError(Exception):
+    """Недопустимый путь для конвертации"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class PathIngestor:
+    """Проверка путей и индекс хешей файлов на общем хранилище"""
+
+    def __init__(self, roots=None, db_path=None):
+        """
+        :param roots: разрешенные корневые папки (по умолчанию из INGEST_ROOTS)
+        :param db_path: путь к БД индекса
+        """
+        if roots is None:
+            roots = [root for root in os.getenv('INGEST_ROOTS', '').split(os.pathsep) if root]
+        self.roots = [os.path.realpath(root) for root in roots]
+        self.db_path = db_path or os.getenv('JOBS_DB_PATH', 'jobs.db')
+        self.setup_database()
+
+    @property
+    def enabled(self):
+        """Конвертация по пути включена (задан хотя бы один корень)"""
+        return bool(self.roots)
+
+    def _connect(self):
+        """Открытие соединения с БД индекса"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def setup_database(self):
+        """Создание таблицы индекса файлов"""
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS ingest_files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                hashed_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def resolve(self, path):
+        """
+        Проверка пути по списку разрешенных корней
+
+        Симлинки и '..' раскрываются до проверки, поэтому выйти за пределы
+        корня через них нельзя.
+
+        :return: канонический путь к файлу или папке
+        """
+        if not self.enabled:
+            raise IngestError("Path ingestion is not configured", 404)
+        if not path or not os.path.isabs(path):
+            raise IngestError(f"Absolute path required: {path}")
+
+        real_path = os.path.realpath(path)
+        if not any(os.path.commonpath([root, real_path]) == root for root in self.roots):
+            raise IngestError(f"Path is outside of allowed roots: {path}", 403)
+        if not os.path.exists(real_path):
+            raise IngestError(f"Path not found: {path}", 404)
+
+        return real_path
+
+    def expand(self, path):
+        """
+        Список IFC файлов по пути: сам файл или IFC файлы папки (без вложенных)
+
+        :return: список канонических путей
+        """
+        real_path = self.resolve(path)
+
+        if os.path.isdir(real_path):
+            files = []
+            for name in sorted(os.listdir(real_path)):
+                if name.startswith('.') or not self.is_ifc(name):
+                    continue
+                # Симлинки внутри папки тоже проверяются по корням
+                try:
+                    file_path = self.resolve(os.path.join(real_path, name))
+                except IngestError:
+                    logger.warning(f"Skipping file outside of allowed roots: {os.path.join(real_path, name)}")
+                    continue
+                if os.path.isfile(file_path):
+                    files.append(file_path)
+            return files
+
+        if not self.is_ifc(real_path):
+            raise IngestError(f"Not an IFC file: {path}")
+        return [real_path]
+
+    @staticmethod
+    def is_ifc(filename):
+        """Проверка расширения файла"""
+        return '.' in filename and filename.rsplit('.', 1)[1].lower() in INGEST_EXTENSIONS
+
+    def fingerprint(self, path):
+        """
+        Размер и SHA-256 файла с учетом индекса
+
+        Хеш пересчитывается, только если размер или mtime изменились.
+
+        :return: (размер, sha256, изменился ли файл с прошлой проверки)
+        """
+        stat = os.stat(path)
+
+        conn = self._connect()
+        row = conn.execute('SELECT * FROM ingest_files WHERE path = ?', (path,)).fetchone()
+        conn.close()
+
+        if row and row['size'] == stat.st_size and row['mtime_ns'] == stat.st_mtime_ns:
+            return stat.st_size, row['sha256'], False
+
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(HASH_BUFFER_SIZE)
+                if not block:
+                    break
+                hasher.update(block)
+        sha256 = hasher.hexdigest()
+
+        conn = self._connect()
+        conn.execute('''
+            INSERT OR REPLACE INTO ingest_files (path, size, mtime_ns, sha256, hashed_at) VALUES (?, ?, ?, ?, ?)
+        ''', (path, stat.st_size, stat.st_mtime_ns, sha256, time.time()))
+        conn.commit()
+        conn.close()
+
+        changed = row is None or row['sha256'] != sha256
+        logger.info(f"Ingest file hashed: {path} -> {sha256} ({'changed' if changed else 'touched'})")
+        return stat.st_size, sha256, changed
+
+    def collect(self, paths):
+        """
+        Описание файлов задачи по списку путей
+
+        Файлы не читаются: SHA-256 считает обработчик задачи (fingerprint).
+
+        :param paths: пути к файлам или папкам
+        :return: список файлов в формате payload задачи
+        """
+        files = []
+        seen = set()
+
+        for path in paths:
+            for file_path in self.expand(path):
+                if file_path in seen:
+                    continue
+                seen.add(file_path)
+
+                files.append({
+                    'path': file_path,
+                    'original_name': os.path.basename(file_path),
+                    'size': os.path.getsize(file_path),
+                    'ingested': True
+                })
+
+        return files
+
+
+def _auth_unavailable(f):
+    """Замена login_required без системы авторизации: маршрут недоступен"""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        return jsonify({'error': 'Authentication system not available'}), 503
+
+    return decorated_function
+
+
+def setup_ingest_routes(app, ingestor, enqueue_conversion, get_area_coefficient, login_required=None):
+    """
+    Регистрация маршрутов конвертации по пути
+
+    :param enqueue_conversion: функция постановки задачи (файлы, коэффициент, имя) -> ответ
+    :param get_area_coefficient: функция получения коэффициента площади из запроса
+    :param login_required: декоратор авторизации (AuthManager.login_required); без него
+        маршруты отвечают 503 - файлы сервера открываются только вошедшим пользователям
+    """
+    if login_required is None:
+        login_required = _auth_unavailable
+
+    @app.route('/ingest/roots', methods=['GET'])
+    @login_required
+    def ingest_roots():
+        """Разрешенные корневые папки (пустой список - функция выключена)"""
+        return jsonify({'enabled': ingestor.enabled, 'roots': ingestor.roots})
+
+    @app.route('/ingest', methods=['POST'])
+    @login_required
+    def ingest_paths():
+        """Постановка в очередь конвертации файлов по путям на сервере"""
+        data = request.get_json(silent=True)
+        if data is not None:
+            paths = data.get('paths') or []
+            if isinstance(paths, str):
+                paths = [paths]
+        else:
+            paths = request.form.getlist('paths')
+
+        paths = [path.strip() for path in paths if path and path.strip()]
+        if not paths:
+            return jsonify({'error': 'No paths provided'}), 400
+
+        try:
+            files = ingestor.collect(paths)
+        except IngestError as e:
+            return jsonify({'error': str(e)}), e.status_code
+        except OSError as e:
+            logger.error(f"Ingest error: {str(e)}")
+            return jsonify({'error': f"Failed to read file: {str(e)}"}), 400
+
+        if not files:
+            return jsonify({'error': 'No IFC files found at the given paths'}), 400
+
+        if len(files) > app.config['MAX_BATCH_FILES']:
+            return jsonify({'error': f"Too many files. Maximum is {app.config['MAX_BATCH_FILES']}"}), 400
+
+        logger.info(f"Ingesting {len(files)} files by path")
+        return enqueue_conversion(files, get_area_coefficient())
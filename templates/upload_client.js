@@ -0,0 +1,228 @@
+            // Общий код страниц загрузки (uploads.html, dashboard.html): хеширование и сжатие
+            // файлов в браузере, загрузка по частям, ожидание задачи. Подключается через include
+            // внутрь обработчика DOMContentLoaded и использует его переменную statusText
+
+            // Файлы крупнее порога загружаются по частям с возможностью возобновления
+            const CHUNKED_UPLOAD_THRESHOLD = 16 * 1024 * 1024;
+            const MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024;
+
+            // Больше файлов за раз и ZIP архивы отправляются пакетом через /uploads/batch
+            const MAX_FILES = 10;
+            const isArchive = file => file.name.split('.').pop().toLowerCase() === 'zip';
+
+            // Файлы до этого размера хешируются в браузере, чтобы не отправлять уже загруженные модели
+            const MAX_HASHED_FILE_SIZE = 512 * 1024 * 1024;
+
+            // SHA-256 файла (null, если Web Crypto недоступен или файл слишком большой)
+            async function hashFile(file) {
+                if (!window.crypto || !crypto.subtle || file.size > MAX_HASHED_FILE_SIZE) {
+                    return null;
+                }
+
+                const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+                return Array.from(new Uint8Array(digest))
+                    .map(byte => byte.toString(16).padStart(2, '0'))
+                    .join('');
+            }
+
+            // Файлы до этого размера сжимаются в браузере перед отправкой (IFC сжимается в 8-10 раз)
+            const MAX_COMPRESSED_FILE_SIZE = 512 * 1024 * 1024;
+
+            // Сжатие IFC файла gzip (сервер распаковывает его при приеме).
+            // Возвращает исходный файл, если сжатие недоступно или не дает выигрыша
+            async function compressFile(file) {
+                const extension = file.name.split('.').pop().toLowerCase();
+                if (!window.CompressionStream || extension !== 'ifc' || file.size > MAX_COMPRESSED_FILE_SIZE) {
+                    return file;
+                }
+
+                try {
+                    const stream = file.stream().pipeThrough(new CompressionStream('gzip'));
+                    const compressed = await new Response(stream).blob();
+                    if (compressed.size >= file.size) {
+                        return file;
+                    }
+                    return new File([compressed], file.name, {type: 'application/gzip', lastModified: file.lastModified});
+                } catch (error) {
+                    return file;
+                }
+            }
+
+            // Загрузка файла частями через /uploads/chunked
+            async function uploadInChunks(file) {
+                const body = await compressFile(file);
+                const contentEncoding = body === file ? null : 'gzip';
+                const storageKey = `chunked-upload:${file.name}:${file.size}:${file.lastModified}`;
+                let upload = null;
+
+                // Продолжаем незавершенную загрузку того же файла (с тем же размером передаваемых данных)
+                const savedId = localStorage.getItem(storageKey);
+                if (savedId) {
+                    const response = await fetch(`/uploads/chunked/${savedId}`);
+                    if (response.ok) {
+                        upload = await response.json();
+                        if (!upload.complete && upload.size !== body.size) {
+                            upload = null;
+                        }
+                    }
+                }
+
+                if (!upload) {
+                    const response = await fetch('/uploads/chunked', {
+                        method: 'POST',
+                        headers: {'Content-Type': 'application/json'},
+                        body: JSON.stringify({
+                            filename: file.name,
+                            size: body.size,
+                            sha256: await hashFile(file),
+                            content_encoding: contentEncoding,
+                            original_size: file.size
+                        })
+                    });
+                    upload = await response.json();
+
+                    if (!response.ok) {
+                        throw new Error(upload.error || 'Не удалось начать загрузку файла');
+                    }
+                    localStorage.setItem(storageKey, upload.upload_id);
+                }
+
+                const statusUrl = `/uploads/chunked/${upload.upload_id}`;
+                let retries = 0;
+
+                while (!upload.complete) {
+                    const offset = upload.offset;
+                    const chunk = body.slice(offset, offset + upload.chunk_size);
+
+                    try {
+                        const response = await fetch(upload.upload_url, {
+                            method: 'PUT',
+                            headers: {'Upload-Offset': String(offset)},
+                            body: chunk
+                        });
+
+                        if (response.status === 409) {
+                            // Сервер принял другой объем - продолжаем с его смещения
+                            upload = await (await fetch(statusUrl)).json();
+                            continue;
+                        }
+
+                        const result = await response.json();
+                        if (!response.ok) {
+                            throw new Error(result.error || 'Ошибка загрузки части файла');
+                        }
+
+                        upload = result;
+                        retries = 0;
+                        statusText.textContent = `⏳ Загрузка ${file.name}: ${Math.floor(upload.offset / body.size * 100)}%`;
+                    } catch (error) {
+                        // После обрыва соединения уточняем смещение и повторяем часть
+                        if (++retries > 5) {
+                            throw error;
+                        }
+                        await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+
+                        const response = await fetch(statusUrl);
+                        if (response.ok) {
+                            upload = await response.json();
+                        }
+                    }
+                }
+
+                localStorage.removeItem(storageKey);
+                return upload.upload_id;
+            }
+
+            // Отображение этапов и прогресса задачи через Server-Sent Events
+            function followJobEvents(eventsUrl) {
+                return new Promise(resolve => {
+                    const source = new EventSource(eventsUrl);
+                    const zonesByFile = {};
+
+                    const finish = () => {
+                        source.close();
+                        resolve();
+                    };
+
+                    source.addEventListener('started', () => {
+                        statusText.textContent = '⏳ Обрабатываем файлы...';
+                    });
+
+                    source.addEventListener('parsing', (e) => {
+                        const data = JSON.parse(e.data);
+                        statusText.textContent = `⏳ Разбор файла ${data.index} из ${data.total}: ${data.file}`;
+                    });
+
+                    source.addEventListener('zones', (e) => {
+                        const data = JSON.parse(e.data);
+                        zonesByFile[data.file] = data.zones;
+                        const totalZones = Object.values(zonesByFile).reduce((sum, count) => sum + count, 0);
+                        statusText.textContent = `⏳ Обработано зон: ${totalZones}`;
+                    });
+
+                    source.addEventListener('file_failed', (e) => {
+                        const data = JSON.parse(e.data);
+                        statusText.textContent = `⚠️ Не удалось обработать ${data.file}, продолжаем...`;
+                    });
+
+                    source.addEventListener('writing_csv', () => {
+                        statusText.textContent = '⏳ Записываем CSV...';
+                    });
+
+                    source.addEventListener('uploading_sheets', () => {
+                        statusText.textContent = '⏳ Загружаем в Google Sheets...';
+                    });
+
+                    source.addEventListener('finished', finish);
+                    source.addEventListener('failed', finish);
+                    source.addEventListener('cancelled', finish);
+
+                    // При обрыве потока переходим к опросу статуса
+                    source.onerror = finish;
+                });
+            }
+
+            // Текущая задача: отменяется при закрытии или перезагрузке страницы
+            let activeCancelUrl = null;
+
+            window.addEventListener('pagehide', () => {
+                if (activeCancelUrl) {
+                    navigator.sendBeacon(activeCancelUrl);
+                }
+            });
+
+            // Ожидание завершения фоновой задачи конвертации
+            async function waitForJob(statusUrl) {
+                if (window.EventSource) {
+                    await followJobEvents(`${statusUrl}/events`);
+                }
+
+                while (true) {
+                    const response = await fetch(statusUrl);
+                    const job = await response.json();
+
+                    if (!response.ok) {
+                        throw new Error(job.error || 'Задача не найдена');
+                    }
+
+                    if (job.state === 'success') {
+                        return job.result;
+                    }
+
+                    if (job.state === 'error') {
+                        throw new Error(job.error || 'Ошибка обработки файлов');
+                    }
+
+                    if (job.state === 'cancelled') {
+                        throw new Error('Конвертация отменена');
+                    }
+
+                    if (job.state === 'queued' && job.position) {
+                        statusText.textContent = `⏳ Задача в очереди, позиция: ${job.position}`;
+                    } else if (job.state === 'running') {
+                        statusText.textContent = '⏳ Обрабатываем файлы...';
+                    }
+
+                    await new Promise(resolve => setTimeout(resolve, 1000));
+                }
+            }
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты ограничений ZIP архивов пакетной загрузки (pytest): оглавление, распаковка элемента, /uploads/batch
+"""
+
+import io
+import os
+import zipfile
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import export_flats
+from export_flats import ArchiveMember, copy_archive_member, open_ifc_model
+from upload_storage import list_archive_members
+
+MODEL = b'ISO-10303-21;\n' + b'#1=IFCSPACE($,$,$);\n' * 500
+
+
+def build_archive(path, members):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return str(path)
+
+
+def test_members_within_limits(tmp_path):
+    path = build_archive(tmp_path / 'batch.zip', [('a.ifc', MODEL), ('docs/readme.txt', b'x'), ('b.ifc', MODEL)])
+
+    members = list_archive_members(path, max_entries=3, max_member_size=len(MODEL),
+                                   max_total_size=2 * len(MODEL))
+    assert members == [('a.ifc', len(MODEL)), ('b.ifc', len(MODEL))]
+
+
+def test_too_many_entries_is_rejected(tmp_path):
+    # Пропускаемые записи тоже считаются: оглавление читается целиком
+    path = build_archive(tmp_path / 'batch.zip', [(f'{i}.txt', b'') for i in range(5)] + [('a.ifc', MODEL)])
+
+    with pytest.raises(ValueError, match='Too many entries'):
+        list_archive_members(path, max_entries=5)
+
+
+def test_decompressed_sizes_are_limited(tmp_path):
+    # Сильно сжимаемый элемент: в архиве он занимает малую долю размера после распаковки
+    bomb = b'\0' * (1024 * 1024)
+    path = build_archive(tmp_path / 'batch.zip', [('a.ifc', MODEL), ('bomb.ifc', bomb)])
+    assert os.path.getsize(path) < len(bomb) // 100
+
+    with pytest.raises(RequestEntityTooLarge, match='bomb.ifc'):
+        list_archive_members(path, max_member_size=len(bomb) - 1)
+    with pytest.raises(RequestEntityTooLarge, match='archive too large'):
+        list_archive_members(path, max_total_size=len(bomb))
+
+
+def test_copy_stops_at_limit():
+    target = io.BytesIO()
+    assert copy_archive_member(io.BytesIO(MODEL), target, len(MODEL)) == len(MODEL)
+
+    with pytest.raises(ValueError, match='exceeds'):
+        copy_archive_member(io.BytesIO(MODEL), io.BytesIO(), len(MODEL) - 1)
+
+
+def test_oversized_member_is_not_extracted(tmp_path, monkeypatch):
+    path = build_archive(tmp_path / 'batch.zip', [('a.ifc', MODEL)])
+    monkeypatch.setattr(export_flats, 'MAX_ARCHIVE_MEMBER_SIZE', 1000)
+
+    with pytest.raises(ValueError, match='exceeds 1000 bytes'):
+        open_ifc_model(ArchiveMember(path, 'a.ifc'))
+    # Недораспакованный временный файл удален
+    assert os.listdir(tmp_path) == ['batch.zip']
+
+
+def post_archive(client, path):
+    with open(path, 'rb') as f:
+        return client.post('/uploads/batch', data={'archive': (f, 'batch.zip')}, content_type='multipart/form-data')
+
+
+def test_batch_route_rejects_archive_over_limits(flask_app, client, tmp_path, monkeypatch):
+    path = build_archive(tmp_path / 'batch.zip', [('a.ifc', MODEL), ('b.ifc', MODEL)])
+
+    monkeypatch.setitem(flask_app.config, 'MAX_ARCHIVE_TOTAL_SIZE', len(MODEL))
+    response = post_archive(client, path)
+    assert response.status_code == 413
+    assert response.get_json()['error'].startswith('batch.zip: ')
+
+    monkeypatch.setitem(flask_app.config, 'MAX_ARCHIVE_ENTRIES', 1)
+    assert post_archive(client, path).status_code == 400
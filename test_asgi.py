@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты ASGI входа (pytest): асинхронный прием загрузок и временные файлы
+"""
+
+import json
+
+from job_queue import QueueFullError
+
+IFC_DATA = b'ISO-10303-21;\nDATA;\n#1=IFCSPACE($,$,$);\nENDSEC;\nEND-ISO-10303-21;\n'
+BOUNDARY = 'test-boundary'
+
+
+def multipart(files, fields=None):
+    """Тело multipart/form-data и его заголовок Content-Type"""
+    parts = []
+    for name, value in (fields or {}).items():
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, data in files:
+        parts.append(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b'\r\n')
+    body = b''.join(parts) + f'--{BOUNDARY}--\r\n'.encode()
+    return body, {'Content-Type': f'multipart/form-data; boundary={BOUNDARY}'}
+
+
+def spool_files(flask_app, app_dir):
+    spool_folder = app_dir / flask_app.config['UPLOAD_SPOOL_FOLDER']
+    return list(spool_folder.glob('*.upload')) if spool_folder.exists() else []
+
+
+def test_upload_is_stored_and_queued(flask_app, app_dir, asgi_request):
+    body, headers = multipart([('files', 'model.ifc', IFC_DATA)])
+
+    status, _, response = asgi_request('POST', '/uploads', body, headers)
+
+    assert status == 202, response
+    job = json.loads(response)
+    assert job['job_id']
+    assert spool_files(flask_app, app_dir) == []
+    assert any(path.read_bytes() == IFC_DATA for path in (app_dir / 'uploads' / 'blobs').rglob('*.ifc'))
+
+
+def test_upload_rejected_by_handler_leaves_no_spools(flask_app, app_dir, asgi_request, main_module, monkeypatch):
+    # Допуск проходит до приема тела, но очередь заполняется раньше, чем обработчик Flask
+    # прочитал форму: временные файлы принятой формы не должны остаться на диске
+    calls = []
+
+    def check_admission(client=None):
+        calls.append(client)
+        if len(calls) > 1:
+            raise QueueFullError("Conversion queue is full", retry_after=7)
+
+    monkeypatch.setattr(main_module.job_queue, 'check_admission', check_admission)
+    body, headers = multipart([('files', 'model.ifc', IFC_DATA)])
+
+    status, response_headers, _ = asgi_request('POST', '/uploads', body, headers)
+
+    assert status == 429
+    assert response_headers['retry-after'] == '7'
+    assert len(calls) == 2
+    assert spool_files(flask_app, app_dir) == []
+
+
+def test_admission_rejects_before_body(asgi_request, main_module, monkeypatch):
+    def check_admission(client=None):
+        raise QueueFullError("Conversion queue is full", retry_after=3)
+
+    monkeypatch.setattr(main_module.job_queue, 'check_admission', check_admission)
+
+    status, response_headers, _ = asgi_request('POST', '/uploads', b'not multipart', {'Content-Type': 'text/plain'})
+
+    assert status == 429
+    assert response_headers['retry-after'] == '3'
+
+
+def test_invalid_form_is_bad_request(flask_app, app_dir, asgi_request):
+    status, _, response = asgi_request('POST', '/uploads', b'x', {'Content-Type': 'text/plain'})
+
+    assert status == 400
+    assert 'multipart' in json.loads(response)['error']
+    assert spool_files(flask_app, app_dir) == []
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты загрузки по частям (pytest): смещения, возобновление, дедупликация, владелец сессии
+"""
+
+import io
+import gzip
+import hashlib
+import os
+import time
+
+import pytest
+
+from chunked_upload import ChunkedUploadManager, ChunkedUploadError, UPLOAD_COMPLETE, UPLOAD_IN_PROGRESS
+from upload_storage import BlobStore
+
+DATA = b'ISO-10303-21;\n' + b'#1=IFCSPACE($,$,$);\n' * 100
+CHUNK = 512
+
+
+@pytest.fixture
+def blob_store(tmp_path):
+    return BlobStore(str(tmp_path / 'uploads' / 'blobs'), db_path=str(tmp_path / 'jobs.db'))
+
+
+@pytest.fixture
+def manager(tmp_path, blob_store):
+    return ChunkedUploadManager(str(tmp_path / 'uploads'), blob_store, db_path=str(tmp_path / 'jobs.db'),
+                                chunk_size=CHUNK)
+
+
+def append(manager, upload_id, offset, data):
+    return manager.append(upload_id, offset, io.BytesIO(data), len(data))
+
+
+def upload_all(manager, upload_id, data, start=0):
+    upload = None
+    for offset in range(start, len(data), CHUNK):
+        upload = append(manager, upload_id, offset, data[offset:offset + CHUNK])
+    return upload
+
+
+def test_chunks_are_assembled_into_blob_store(manager):
+    upload = manager.create('model.ifc', len(DATA))
+    upload = upload_all(manager, upload['id'], DATA)
+
+    assert upload['state'] == UPLOAD_COMPLETE
+    assert upload['sha256'] == hashlib.sha256(DATA).hexdigest()
+    with open(upload['path'], 'rb') as f:
+        assert f.read() == DATA
+    assert manager.get_completed(upload['id'])['path'] == upload['path']
+    assert not os.listdir(manager.parts_folder)
+
+
+def test_offset_mismatch_reports_received_offset(manager):
+    upload = manager.create('model.ifc', len(DATA))
+    append(manager, upload['id'], 0, DATA[:CHUNK])
+
+    for offset in (0, 2 * CHUNK):
+        with pytest.raises(ChunkedUploadError) as error:
+            append(manager, upload['id'], offset, DATA[offset:offset + CHUNK])
+        assert error.value.status_code == 409
+        assert error.value.offset == CHUNK
+
+
+def test_chunk_limits(manager):
+    upload = manager.create('model.ifc', CHUNK + 10)
+
+    with pytest.raises(ChunkedUploadError) as error:
+        append(manager, upload['id'], 0, DATA[:CHUNK + 1])
+    assert error.value.status_code == 400
+
+    append(manager, upload['id'], 0, DATA[:CHUNK])
+    with pytest.raises(ChunkedUploadError, match='exceeds declared file size'):
+        append(manager, upload['id'], CHUNK, DATA[:20])
+
+
+def test_interrupted_chunk_is_rolled_back(manager):
+    upload = manager.create('model.ifc', len(DATA))
+    append(manager, upload['id'], 0, DATA[:CHUNK])
+
+    # Тело оборвалось: пришло меньше, чем объявлено в Content-Length
+    with pytest.raises(ChunkedUploadError) as error:
+        manager.append(upload['id'], CHUNK, io.BytesIO(DATA[CHUNK:CHUNK + 100]), CHUNK)
+    assert error.value.offset == CHUNK
+    assert manager.get(upload['id'])['received'] == CHUNK
+    assert os.path.getsize(manager._part_path(upload['id'])) == CHUNK
+
+
+def test_resume_in_another_process_rebuilds_hash(manager, blob_store):
+    upload = manager.create('model.ifc', len(DATA))
+    append(manager, upload['id'], 0, DATA[:CHUNK])
+
+    # Продолжение загрузки другим процессом: состояния хеша в памяти нет
+    other = ChunkedUploadManager(manager.upload_folder, blob_store, db_path=manager.db_path, chunk_size=CHUNK)
+    assert other.get(upload['id'])['received'] == CHUNK
+    upload = upload_all(other, upload['id'], DATA, start=CHUNK)
+
+    assert upload['sha256'] == hashlib.sha256(DATA).hexdigest()
+
+
+def test_append_after_completion_is_conflict(manager):
+    upload = manager.create('model.ifc', CHUNK)
+    append(manager, upload['id'], 0, DATA[:CHUNK])
+
+    with pytest.raises(ChunkedUploadError) as error:
+        append(manager, upload['id'], CHUNK, b'x')
+    assert error.value.status_code == 409
+
+
+def test_gzip_session_is_decompressed(manager):
+    compressed = gzip.compress(DATA)
+    upload = manager.create('model.ifc', len(compressed), content_encoding='gzip', original_size=len(DATA))
+    upload = upload_all(manager, upload['id'], compressed)
+
+    assert upload['state'] == UPLOAD_COMPLETE
+    assert upload['sha256'] == hashlib.sha256(DATA).hexdigest()
+
+
+def test_dedup_only_against_own_blobs(manager, blob_store):
+    sha256 = hashlib.sha256(DATA).hexdigest()
+    upload = manager.create('model.ifc', len(DATA), user_id='alice')
+    upload_all(manager, upload['id'], DATA)
+    blob_store.add_reference(sha256, 'model.ifc', user_id='alice')
+
+    # Тот же пользователь не передает данные повторно
+    again = manager.create('copy.ifc', len(DATA), user_id='alice', sha256=sha256)
+    assert again['state'] == UPLOAD_COMPLETE
+
+    # Другой пользователь и анонимный клиент с тем же хешем передают файл целиком
+    assert manager.create('model.ifc', len(DATA), user_id='bob', sha256=sha256)['state'] == UPLOAD_IN_PROGRESS
+    assert manager.create('model.ifc', len(DATA), sha256=sha256)['state'] == UPLOAD_IN_PROGRESS
+
+
+def test_stale_sessions_expire(manager):
+    stale = manager.create('model.ifc', len(DATA))
+    append(manager, stale['id'], 0, DATA[:CHUNK])
+    fresh = manager.create('model.ifc', len(DATA))
+
+    conn = manager._connect()
+    conn.execute('UPDATE upload_sessions SET updated_at = ? WHERE id = ?', (time.time() - 2 * manager.session_ttl,
+                                                                            stale['id']))
+    conn.commit()
+    conn.close()
+
+    assert manager.expire_sessions() == 1
+    assert manager.get(stale['id']) is None
+    assert not os.path.exists(manager._part_path(stale['id']))
+    assert manager.get(fresh['id']) is not None
+
+
+def create_via_api(client, size=len(DATA)):
+    response = client.post('/uploads/chunked', json={'filename': 'model.ifc', 'size': size})
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def test_routes_resume_by_offset(client):
+    upload = create_via_api(client)
+
+    response = client.put(upload['upload_url'], data=DATA[:100], headers={'Upload-Offset': '0'})
+    assert response.headers['Upload-Offset'] == '100'
+
+    # Повтор уже принятой части (ответ потерян): 409 с текущим смещением
+    response = client.put(upload['upload_url'], data=DATA[:100], headers={'Upload-Offset': '0'})
+    assert response.status_code == 409
+    assert response.get_json()['offset'] == 100
+
+    assert client.get(upload['upload_url']).headers['Upload-Offset'] == '100'
+    response = client.put(upload['upload_url'], data=DATA[100:], headers={'Upload-Offset': '100'})
+    assert response.get_json()['complete'] is True
+    assert response.get_json()['sha256'] == hashlib.sha256(DATA).hexdigest()
+
+    assert client.put(upload['upload_url'], data=b'x').status_code == 400
+
+
+def test_routes_hide_other_clients_uploads(flask_app, client):
+    upload = create_via_api(client)
+    other = flask_app.test_client()
+
+    assert other.get(upload['upload_url']).status_code == 404
+    assert other.put(upload['upload_url'], data=DATA[:10], headers={'Upload-Offset': '0'}).status_code == 404
+    assert other.delete(upload['upload_url']).status_code == 404
+    assert client.get(upload['upload_url']).get_json()['offset'] == 0
+
+    # Завершенная чужая загрузка не ставится в конвертацию
+    client.put(upload['upload_url'], data=DATA, headers={'Upload-Offset': '0'})
+    response = other.post('/uploads', data={'upload_ids': upload['upload_id']})
+    assert response.status_code == 400
+
+    assert client.delete(upload['upload_url']).status_code == 200
+
+
+def test_routes_follow_user_account(flask_app, client):
+    with client.session_transaction() as session:
+        session['user'] = {'id': 'alice', 'name': 'Alice', 'email': 'alice@example.com'}
+    upload = create_via_api(client)
+
+    # Та же учетная запись в другой сессии (другой браузер)
+    other = flask_app.test_client()
+    with other.session_transaction() as session:
+        session['user'] = {'id': 'alice', 'name': 'Alice', 'email': 'alice@example.com'}
+    assert other.get(upload['upload_url']).status_code == 200
+
+    with other.session_transaction() as session:
+        session['user'] = {'id': 'bob', 'name': 'Bob', 'email': 'bob@example.com'}
+    assert other.get(upload['upload_url']).status_code == 404
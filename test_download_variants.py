@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты вариантов результатов (pytest): потоковый ZIP архив, запись через временные файлы
+"""
+
+import io
+import os
+import gzip
+import zipfile
+
+from download_variants import iter_zip_bundle, open_variants_writer, existing_variants, lookup_digest
+from file_naming_utils import get_next_indexed_filename
+
+PLAIN = b'flat;area\n' + b'1;42.5\n' * 2000
+COMPRESSED = b'flat;area\n' + b'2;17.0\n' * 2000
+
+
+def build_bundle(entries, chunk_size=1024):
+    chunks = list(iter_zip_bundle(entries, chunk_size=chunk_size))
+    return chunks, zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+
+
+def test_bundle_contains_plain_and_gzip_only_results(tmp_path):
+    plain = tmp_path / 'a.csv'
+    plain.write_bytes(PLAIN)
+    # Исходный CSV не сохранен, есть только сжатый вариант
+    (tmp_path / 'b.csv.gz').write_bytes(gzip.compress(COMPRESSED))
+
+    chunks, archive = build_bundle([('a.csv', str(plain)), ('b.csv', str(tmp_path / 'b.csv'))])
+
+    assert archive.testzip() is None
+    assert archive.namelist() == ['a.csv', 'b.csv']
+    assert archive.read('a.csv') == PLAIN
+    assert archive.read('b.csv') == COMPRESSED
+    # Архив отдается блоками по мере чтения, а не одним куском в конце
+    assert len(chunks) > 2
+
+
+def test_missing_entry_is_skipped(tmp_path):
+    plain = tmp_path / 'a.csv'
+    plain.write_bytes(PLAIN)
+
+    _, archive = build_bundle([('missing.csv', str(tmp_path / 'missing.csv')), ('a.csv', str(plain))])
+
+    assert archive.namelist() == ['a.csv']
+    assert archive.read('a.csv') == PLAIN
+
+
+def test_empty_bundle_is_valid_archive(tmp_path):
+    _, archive = build_bundle([])
+
+    assert archive.namelist() == []
+
+
+def test_variants_appear_only_after_publish(tmp_path):
+    name = get_next_indexed_filename(str(tmp_path), 'flats.csv')
+    path = str(tmp_path / name)
+
+    with open_variants_writer(path, ['gzip']) as f:
+        variants = f.variants
+        f.write('flat;area\n1;42.5\n')
+        # Пока файл пишется, под его именем лежит только пустой зарезервированный файл
+        assert os.path.getsize(path) == 0
+        assert not os.path.exists(path + '.gz')
+        assert not existing_variants(path)
+    variants.publish()
+
+    with open(path, encoding='utf-8') as f:
+        assert f.read() == 'flat;area\n1;42.5\n'
+    with gzip.open(path + '.gz', 'rt', encoding='utf-8') as f:
+        assert f.read() == 'flat;area\n1;42.5\n'
+    assert lookup_digest(path)[1] == [None, 'gzip']
+    assert not [entry for entry in os.listdir(tmp_path) if entry.startswith('.') and entry.endswith('.csv')]
+
+
+def test_discarded_write_leaves_only_placeholder(tmp_path):
+    path = str(tmp_path / get_next_indexed_filename(str(tmp_path), 'flats.csv'))
+
+    with open_variants_writer(path, ['gzip']) as f:
+        f.write('flat;area\n')
+    f.variants.discard()
+
+    assert os.path.getsize(path) == 0
+    assert sorted(entry for entry in os.listdir(tmp_path) if 'flats' in entry) == ['flats.csv']
+
+
+def test_placeholder_is_not_downloaded(main_module, client):
+    folder = main_module.app.config['DOWNLOAD_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    name = get_next_indexed_filename(folder, 'reserved.csv')
+
+    try:
+        assert main_module.resolve_download_path(name) is None
+        assert client.get(f'/downloads/{name}').status_code == 404
+    finally:
+        os.remove(os.path.join(folder, name))
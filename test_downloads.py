@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты скачивания результатов (pytest): отдача через nginx (X-Accel-Redirect), выбор сжатия по Accept-Encoding,
+ETag и условные запросы (304) для результатов и истории конвертаций
+"""
+
+import os
+import gzip
+import uuid
+
+import pytest
+from flask import Flask
+
+from download_variants import open_variants_writer, parse_accept_encoding, choose_encoding
+
+CONTENT = 'Flat;Area\n' + '1;42,5\n' * 500
+
+
+@pytest.fixture
+def write_result(flask_app):
+    """Запись результата в папку скачивания приложения; файлы удаляются после теста"""
+    folder = flask_app.config['DOWNLOAD_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    written = []
+
+    def write(name=None, encodings=('gzip',), keep_plain=True, content=CONTENT):
+        name = name or f"{uuid.uuid4().hex}.csv"
+        path = os.path.join(folder, name)
+        with open_variants_writer(path, list(encodings), keep_plain) as f:
+            f.write(content)
+        f.variants.publish()
+        written.extend(f.variants.paths)
+        return name
+
+    yield write
+    for path in set(written):
+        os.remove(path)
+
+
+@pytest.fixture
+def accel(flask_app, monkeypatch):
+    monkeypatch.setitem(flask_app.config, 'X_ACCEL_REDIRECT', '/internal-downloads/')
+
+
+def test_accel_redirect_leaves_body_to_nginx(client, accel, write_result):
+    name = write_result()
+
+    response = client.get(f'/downloads/{name}', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == f'/internal-downloads/{name}'
+    assert response.headers['Content-Type'].startswith('text/csv')
+    assert response.headers['Content-Disposition'] == f'attachment; filename="{name}"'
+    # Сжатый вариант выбирает nginx (gzip_static), приложение тело не отдает
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == b''
+
+
+def test_accel_redirect_quotes_non_ascii_names(client, accel, write_result):
+    write_result('Корпус 1.csv')
+
+    response = client.get('/downloads/Корпус 1.csv')
+
+    assert response.headers['X-Accel-Redirect'] == '/internal-downloads/%D0%9A%D0%BE%D1%80%D0%BF%D1%83%D1%81%201.csv'
+    assert response.headers['Content-Disposition'] == "attachment; filename*=UTF-8''%D0%9A%D0%BE%D1%80%D0%BF%D1%83%D1%81%201.csv"
+
+
+def test_accel_redirect_only_for_existing_results(client, accel, write_result):
+    write_result()
+
+    for path in ('/downloads/missing.csv', '/downloads/.download_index.db', '/downloads/../main.py'):
+        response = client.get(path)
+        assert response.status_code == 404
+        assert 'X-Accel-Redirect' not in response.headers
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding('gzip;q=0.5, zstd, x-gzip;q=0.8, br;q=bad') == {'gzip': 0.8, 'zstd': 1.0, 'br': 0.0}
+    assert parse_accept_encoding(None) == {}
+
+
+@pytest.mark.parametrize('accept_encoding, available, expected', [
+    ('gzip, zstd', [None, 'gzip', 'zstd'], ('zstd', False)),
+    ('gzip;q=1, zstd;q=0.5', [None, 'gzip', 'zstd'], ('gzip', False)),
+    ('*', [None, 'gzip'], ('gzip', False)),
+    ('gzip;q=0', [None, 'gzip'], (None, False)),
+    ('', [None, 'gzip'], (None, False)),
+    # Исходный файл не хранится: сжатый вариант распаковывается для клиента без сжатия
+    ('identity', ['gzip'], ('gzip', True)),
+])
+def test_choose_encoding(accept_encoding, available, expected):
+    assert choose_encoding(available, accept_encoding) == expected
+
+
+def test_gzip_variant_for_client_accepting_gzip(client, write_result):
+    name = write_result()
+
+    response = client.get(f'/downloads/{name}', headers={'Accept-Encoding': 'gzip, deflate'})
+
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data).decode('utf-8') == CONTENT
+    assert len(response.data) < len(CONTENT)
+
+
+def test_plain_file_for_client_without_gzip(client, write_result):
+    name = write_result()
+
+    response = client.get(f'/downloads/{name}', headers={'Accept-Encoding': 'identity'})
+
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data(as_text=True) == CONTENT
+
+
+def test_gzip_only_result_is_decoded_on_the_fly(client, write_result):
+    name = write_result(keep_plain=False)
+    assert not os.path.exists(os.path.join(client.application.config['DOWNLOAD_FOLDER'], name))
+
+    response = client.get(f'/downloads/{name}')
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_data(as_text=True) == CONTENT
+
+    response = client.get(f'/downloads/{name}', headers={'Accept-Encoding': 'gzip'})
+    assert gzip.decompress(response.data).decode('utf-8') == CONTENT
+
+
+def test_download_etag_differs_per_encoding(client, write_result):
+    name = write_result()
+
+    plain = client.get(f'/downloads/{name}')
+    compressed = client.get(f'/downloads/{name}', headers={'Accept-Encoding': 'gzip'})
+
+    assert plain.headers['ETag'] and compressed.headers['ETag']
+    assert plain.headers['ETag'] != compressed.headers['ETag']
+
+
+def test_repeated_download_is_not_modified(client, write_result, monkeypatch):
+    name = write_result()
+    etag = client.get(f'/downloads/{name}', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+
+    # 304 по индексу хешей: файл результата не открывается
+    monkeypatch.setattr('main.select_variant', lambda *args: pytest.fail("file opened"))
+    response = client.get(f'/downloads/{name}', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.data == b''
+
+    # Клиент без сжатия получит другой вариант - ETag сжатого ему не подходит
+    monkeypatch.undo()
+    response = client.get(f'/downloads/{name}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == CONTENT
+
+
+def test_rewritten_result_gets_new_etag(client, write_result):
+    name = write_result()
+    etag = client.get(f'/downloads/{name}').headers['ETag']
+
+    write_result(name, content=CONTENT + '2;17,0\n')
+
+    response = client.get(f'/downloads/{name}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_data(as_text=True).endswith('2;17,0\n')
+
+
+def test_range_request_with_etag(client, write_result):
+    name = write_result()
+    etag = client.get(f'/downloads/{name}').headers['ETag']
+
+    response = client.get(f'/downloads/{name}', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert response.status_code == 206
+    assert response.data == CONTENT[:10].encode()
+
+
+@pytest.fixture
+def history_client(tmp_path, monkeypatch):
+    """Приложение с историей конвертаций в отдельной БД и вошедшим пользователем"""
+    from auth_system import AuthManager, setup_auth_routes
+
+    monkeypatch.setenv('DB_PATH', str(tmp_path / 'users_history.db'))
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    auth_manager = AuthManager(app)
+    setup_auth_routes(app, auth_manager)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user'] = {'id': 'alice', 'name': 'Alice', 'email': 'alice@example.com'}
+    return client, auth_manager
+
+
+def test_history_is_not_modified_until_new_conversion(history_client, monkeypatch):
+    client, auth_manager = history_client
+    auth_manager.save_conversion('alice', {'original_filename': 'a.ifc', 'processed_flats': 3})
+
+    response = client.get('/api/history')
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+    assert len(response.get_json()['history']) == 1
+
+    # 304 без запроса истории
+    monkeypatch.setattr(auth_manager, 'get_user_history', lambda *args: pytest.fail("history loaded"))
+    response = client.get('/api/history', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    monkeypatch.undo()
+
+    # ETag зависит от параметров ответа
+    assert client.get('/api/history?limit=5', headers={'If-None-Match': etag}).status_code == 200
+
+    # Запись другого пользователя не меняет ETag, своя - меняет
+    auth_manager.save_conversion('bob', {'original_filename': 'b.ifc'})
+    assert client.get('/api/history', headers={'If-None-Match': etag}).status_code == 304
+    auth_manager.save_conversion('alice', {'original_filename': 'c.ifc'})
+    response = client.get('/api/history', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert len(response.get_json()['history']) == 2
+
+
+def test_stats_etag(history_client):
+    client, auth_manager = history_client
+
+    response = client.get('/api/stats')
+    assert response.get_json()['stats']['total_conversions'] == 0
+    assert client.get('/api/stats', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert client.get('/api/history', headers={'If-None-Match': response.headers['ETag']}).status_code == 200
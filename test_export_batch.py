@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты пакетной конвертации из командной строки (pytest): манифест и объединенный CSV
+
+Разбор IFC подменяется: строка результата берется из содержимого файла, файл
+с содержимым "bad" разбирается с ошибкой.
+"""
+
+import json
+
+import pytest
+
+import export_flats
+from export_flats import MANIFEST_FILENAME, read_rows_csv
+
+
+@pytest.fixture
+def extracted(monkeypatch):
+    """Подмена разбора IFC: список путей, переданных на разбор, по запускам"""
+    calls = []
+
+    def iter_extracted_rows(ifc_paths, area_coefficient, progress, file_names, workers):
+        calls.append(list(ifc_paths))
+        for index, ifc_path in enumerate(ifc_paths):
+            with open(ifc_path, encoding='utf-8') as f:
+                content = f.read()
+            if content == 'bad':
+                yield index, None, ValueError("broken model")
+            else:
+                yield index, [['2K', '50,0', '45,0', 'A', '', 3, 'Секция 1 этаж 3', content, file_names[index]]], None
+
+    monkeypatch.setattr(export_flats, 'iter_extracted_rows', iter_extracted_rows)
+    return calls
+
+
+@pytest.fixture
+def models(tmp_path):
+    directory = tmp_path / 'models'
+    directory.mkdir()
+    for name, content in (('a.ifc', '1'), ('b.ifc', '2'), ('c.ifc', '3')):
+        (directory / name).write_text(content)
+    return directory
+
+
+def run(models, output_dir, *args):
+    return export_flats.main([str(models), '-o', str(output_dir), '--combined', 'all', '-j', '1', *args])
+
+
+def combined_flats(output_dir):
+    return sorted(row[7] for row in read_rows_csv(str(output_dir / 'all.csv')))
+
+
+def test_second_run_skips_unchanged_files(models, tmp_path, extracted):
+    output_dir = tmp_path / 'out'
+
+    assert run(models, output_dir) == 0
+    assert run(models, output_dir) == 0
+
+    assert len(extracted[0]) == 3
+    assert extracted[1] == []
+    assert combined_flats(output_dir) == ['1', '2', '3']
+
+
+def test_changed_file_is_reconverted(models, tmp_path, extracted):
+    output_dir = tmp_path / 'out'
+    run(models, output_dir)
+
+    (models / 'b.ifc').write_text('22')
+    run(models, output_dir)
+
+    assert extracted[1] == [str(models / 'b.ifc')]
+    assert combined_flats(output_dir) == ['1', '22', '3']
+
+
+def test_restart_and_coefficient_reconvert_all(models, tmp_path, extracted):
+    output_dir = tmp_path / 'out'
+    run(models, output_dir)
+
+    run(models, output_dir, '--restart')
+    run(models, output_dir, '--restart', '-c', '0.8')
+    run(models, output_dir, '-c', '0.8')
+
+    assert [len(paths) for paths in extracted] == [3, 3, 3, 0]
+
+
+def test_failed_file_is_excluded_from_combined_and_retried(models, tmp_path, extracted):
+    output_dir = tmp_path / 'out'
+    run(models, output_dir)
+
+    # Файл испорчен после успешного запуска: CSV прошлого запуска устарел
+    (models / 'b.ifc').write_text('bad')
+    assert run(models, output_dir) == 1
+    assert combined_flats(output_dir) == ['1', '3']
+    assert not (output_dir / 'b.csv').exists()
+
+    # Файл с ошибкой обрабатывается в следующем запуске
+    (models / 'b.ifc').write_text('2')
+    assert run(models, output_dir) == 0
+    assert extracted[-1] == [str(models / 'b.ifc')]
+    assert combined_flats(output_dir) == ['1', '2', '3']
+
+
+def test_file_changed_during_run_is_reconverted(models, tmp_path, monkeypatch, extracted):
+    output_dir = tmp_path / 'out'
+    original = export_flats.iter_extracted_rows
+
+    def change_during_extraction(*args):
+        for result in original(*args):
+            # Файл изменен после разбора, но до записи манифеста
+            if result[0] == 0:
+                (models / 'a.ifc').write_text('11')
+            yield result
+
+    monkeypatch.setattr(export_flats, 'iter_extracted_rows', change_during_extraction)
+    run(models, output_dir)
+    run(models, output_dir)
+
+    assert extracted[1] == [str(models / 'a.ifc')]
+    assert combined_flats(output_dir) == ['11', '2', '3']
+
+
+def test_manifest_records_status_per_file(models, tmp_path, extracted):
+    output_dir = tmp_path / 'out'
+    (models / 'c.ifc').write_text('bad')
+    run(models, output_dir)
+
+    with open(output_dir / MANIFEST_FILENAME, encoding='utf-8') as f:
+        entries = {json.loads(line)['csv']: json.loads(line) for line in f}
+
+    assert entries['a.csv']['status'] == 'ok'
+    assert entries['a.csv']['rows'] == 1
+    assert entries['c.csv']['status'] == 'error'
+    assert 'broken model' in entries['c.csv']['error']
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты параллельного разбора файлов задачи (pytest): iter_extracted_rows, export_flats_table
+
+Пул процессов подменяется пулом потоков, разбор файла - функцией, ждущей
+разрешения теста: так порядок готовности файлов задается явно.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import export_flats
+from export_flats import iter_extracted_rows, export_flats_table, read_rows_csv
+
+
+class CountingPool(ThreadPoolExecutor):
+    """Пул потоков, считающий отправленные в него файлы"""
+
+    def __init__(self, workers):
+        super().__init__(max_workers=workers)
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return super().submit(*args, **kwargs)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pools = []
+
+    def get_pool(max_workers=None):
+        pools.append(CountingPool(max_workers))
+        return pools[-1]
+
+    monkeypatch.setattr(export_flats, '_get_extract_pool', get_pool)
+    yield pools
+    for created in pools:
+        created.shutdown()
+
+
+@pytest.fixture
+def release(monkeypatch):
+    """Разбор файла завершается, когда тест установит событие этого файла"""
+    events = {}
+
+    def process_single_ifc(ifc_path, area_coefficient, progress, file_name, cancel):
+        assert events.setdefault(ifc_path, threading.Event()).wait(5)
+        if ifc_path == 'bad.ifc':
+            raise ValueError("broken model")
+        return [['2K', '50,0', '45,0', 'A', '', 3, 'Секция 1 этаж 3', ifc_path, file_name]]
+
+    def release_file(ifc_path):
+        events.setdefault(ifc_path, threading.Event()).set()
+
+    monkeypatch.setattr(export_flats, 'process_single_ifc', process_single_ifc)
+    return release_file
+
+
+def test_results_come_in_completion_order(pool, release):
+    paths = ['a.ifc', 'b.ifc', 'c.ifc']
+    extracted = iter_extracted_rows(paths, workers=3)
+
+    # Последний файл готов первым и выдается, не дожидаясь первого
+    release('c.ifc')
+    index, rows, error = next(extracted)
+    assert (index, rows[0][7], error) == (2, 'c.ifc', None)
+
+    release('a.ifc')
+    release('b.ifc')
+    assert sorted(index for index, _, _ in extracted) == [0, 1]
+
+
+def test_files_in_flight_are_bounded(pool, release):
+    paths = [f'{index}.ifc' for index in range(6)]
+    extracted = iter_extracted_rows(paths, workers=2)
+
+    for consumed, path in enumerate(paths, 1):
+        release(path)
+        next(extracted)
+        # В пуле было не больше workers + 1 файлов, один из них только что выдан
+        assert pool[0].submitted - consumed <= 2
+    assert pool[0].submitted == len(paths)
+
+
+def test_failed_file_does_not_stop_others(pool, release, tmp_path):
+    errors = []
+    for path in ('a.ifc', 'bad.ifc', 'b.ifc'):
+        release(path)
+
+    csv_path, rows = export_flats_table(['a.ifc', 'bad.ifc', 'b.ifc'], str(tmp_path), workers=3, errors=errors,
+                                        combined_filename='all')
+
+    assert errors == [{'file': 'bad', 'error': 'broken model'}]
+    assert sorted(row[7] for row in rows) == ['a.ifc', 'b.ifc']
+    assert sorted(row[7] for row in read_rows_csv(csv_path)) == ['a.ifc', 'b.ifc']
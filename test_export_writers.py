@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты форматов результатов (pytest): Parquet, Arrow IPC, XLSX
+"""
+
+import os
+import hashlib
+import zipfile
+
+import pytest
+
+from export_flats import CSV_HEADER
+from export_writers import EXPORT_WRITERS, ExportWriter, parse_formats, write_export
+from download_variants import lookup_digest
+
+ROWS = [
+    ['2K', '50,5', '45,45', 'A', 1, 3, 'Секция A этаж 3', '12', 'house'],
+    ['1K', '', '', 'A', '', '', 'Секция A этаж 4', '14', 'house'],
+]
+
+pa = pytest.importorskip('pyarrow')
+
+
+def test_writer_without_write_cannot_be_created():
+    class Incomplete(ExportWriter):
+        name = 'incomplete'
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_parse_formats():
+    assert parse_formats('Parquet, csv,xlsx,parquet') == ['parquet', 'xlsx']
+    assert parse_formats(['arrow']) == ['arrow']
+    assert parse_formats('') == []
+    with pytest.raises(ValueError, match='Unknown export format'):
+        parse_formats('dbf')
+
+
+def test_parquet_keeps_value_types(tmp_path):
+    import pyarrow.parquet as pq
+
+    path = str(tmp_path / 'flats.parquet')
+    EXPORT_WRITERS['parquet']().write(path, ROWS)
+    table = pq.read_table(path)
+
+    assert table.column_names == CSV_HEADER
+    assert table.column('Area_m2').to_pylist() == [50.5, None]
+    assert table.column("Area_m2'").to_pylist() == [45.45, None]
+    assert table.column('FloorNum').type == pa.int32()
+    assert table.column('FloorNum').to_pylist() == [3, None]
+    assert table.column('FlatNumber').to_pylist() == ['12', '14']
+    assert pa.types.is_dictionary(table.schema.field('File').type)
+
+
+def test_arrow_ipc_file(tmp_path):
+    path = str(tmp_path / 'flats.arrow')
+    EXPORT_WRITERS['arrow']().write(path, ROWS)
+
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    assert table.num_rows == 2
+    assert table.column('Section№').to_pylist() == [1, None]
+
+
+def test_xlsx_writes_numbers_as_numbers(tmp_path):
+    pytest.importorskip('xlsxwriter')
+    path = str(tmp_path / 'flats.xlsx')
+    EXPORT_WRITERS['xlsx']().write(path, ROWS)
+
+    with zipfile.ZipFile(path) as archive:
+        sheet = archive.read('xl/worksheets/sheet1.xml').decode('utf-8')
+    assert '<v>50.5</v>' in sheet
+    assert '<v>3</v>' in sheet
+    # Пустые площади не записываются нулями
+    assert '<v>0</v>' not in sheet
+
+
+def test_write_export_records_digest(tmp_path):
+    first = write_export('parquet', str(tmp_path), 'flats', ROWS)
+    second = write_export('parquet', str(tmp_path), 'flats', ROWS)
+
+    assert os.path.basename(first) == 'flats.parquet'
+    assert os.path.basename(second) == 'flats_1.parquet'
+    with open(first, 'rb') as f:
+        assert lookup_digest(first) == (hashlib.sha256(f.read()).hexdigest(), [None])
+
+
+def test_failed_write_leaves_no_file(tmp_path, monkeypatch):
+    def broken_write(self, path, rows):
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(EXPORT_WRITERS['parquet'], 'write', broken_write)
+
+    with pytest.raises(RuntimeError):
+        write_export('parquet', str(tmp_path), 'flats', ROWS)
+    assert [name for name in os.listdir(tmp_path) if not name.startswith('.')] == []
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты выдачи имен результатов с числовой индексацией (pytest)
+"""
+
+import os
+import threading
+
+from file_naming_utils import get_next_indexed_filename
+
+
+def test_first_name_is_unindexed_then_counts_up(tmp_path):
+    names = [get_next_indexed_filename(str(tmp_path), 'model.csv') for _ in range(3)]
+
+    assert names == ['model.csv', 'model_1.csv', 'model_2.csv']
+    assert all((tmp_path / name).exists() for name in names)
+
+
+def test_existing_files_are_counted_once(tmp_path):
+    # Файлы, созданные до появления индекса, в том числе сжатые варианты
+    (tmp_path / 'model.csv').touch()
+    (tmp_path / 'model_4.csv.gz').touch()
+
+    assert get_next_indexed_filename(str(tmp_path), 'model.csv') == 'model_5.csv'
+    assert get_next_indexed_filename(str(tmp_path), 'model.csv') == 'model_6.csv'
+
+
+def test_file_created_outside_index_is_skipped(tmp_path):
+    assert get_next_indexed_filename(str(tmp_path), 'model.csv') == 'model.csv'
+    (tmp_path / 'model_1.csv').touch()
+
+    assert get_next_indexed_filename(str(tmp_path), 'model.csv') == 'model_2.csv'
+
+
+def test_unsafe_characters_are_replaced(tmp_path):
+    name = get_next_indexed_filename(str(tmp_path), 'a/b:c?.csv')
+
+    assert name == 'a_b_c_.csv'
+    assert os.path.dirname(name) == ''
+
+
+def test_concurrent_reservations_are_unique(tmp_path):
+    names = []
+    lock = threading.Lock()
+
+    def reserve():
+        for _ in range(10):
+            name = get_next_indexed_filename(str(tmp_path), 'model.csv')
+            with lock:
+                names.append(name)
+
+    threads = [threading.Thread(target=reserve) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(names) == len(set(names)) == 40
+
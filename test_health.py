@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты проб живости и готовности (pytest): кеш результата, фоновое обновление, маршруты
+"""
+
+import time
+import threading
+
+import pytest
+from flask import Flask
+
+from health import ReadinessChecker, setup_health_routes, sqlite_check, worker_pool_check
+
+
+class CountingCheck:
+    """Проверка, считающая вызовы; может ждать разрешения теста"""
+
+    def __init__(self, ok=True):
+        self.ok = ok
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+        self.finished = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        assert self.release.wait(5)
+        self.finished.set()
+        return {'ok': self.ok}
+
+
+def test_result_is_cached_within_ttl():
+    check = CountingCheck()
+    readiness = ReadinessChecker({'db': check}, ttl=60)
+
+    assert not readiness.computed
+    assert readiness.result()['ready'] is True
+    readiness.result()
+    readiness.result()
+    assert check.calls == 1
+
+
+def test_stale_result_is_returned_while_refreshing_in_background():
+    check = CountingCheck()
+    readiness = ReadinessChecker({'db': check}, ttl=0)
+    first = readiness.result()
+
+    # Проверка "зависла": проба не ждет ее и не запускает вторую
+    check.release.clear()
+    check.finished.clear()
+    check.ok = False
+    assert readiness.result() is first
+    assert readiness.result() is first
+    assert check.calls == 2
+
+    check.release.set()
+    assert check.finished.wait(5)
+    for _ in range(100):
+        if readiness.result() is not first:
+            break
+        time.sleep(0.01)
+    assert readiness.result()['ready'] is False
+
+
+def test_failed_and_optional_checks():
+    def broken():
+        raise OSError("database is locked")
+
+    readiness = ReadinessChecker({'db': CountingCheck(), 'sheets': broken}, optional=['sheets'], ttl=60)
+    result = readiness.result()
+
+    assert result['ready'] is True
+    assert result['checks']['sheets']['ok'] is False
+    assert result['checks']['sheets']['error'] == 'database is locked'
+    assert 'duration_ms' in result['checks']['db']
+
+    readiness = ReadinessChecker({'db': broken}, ttl=60)
+    assert readiness.result()['ready'] is False
+
+
+def test_sqlite_check_does_not_create_database(tmp_path):
+    missing = tmp_path / 'missing.db'
+
+    with pytest.raises(Exception):
+        sqlite_check(str(missing))()
+    assert not missing.exists()
+
+
+def test_worker_pool_standby_process_is_ready():
+    class Queue:
+        def stats(self):
+            return {'queued': 2, 'running': 1, 'max_queued': 20}
+
+    assert worker_pool_check(lambda: None, Queue(), standby=lambda: True)()['standby'] is True
+    assert worker_pool_check(lambda: None, Queue(), standby=lambda: False)()['ok'] is False
+
+
+def test_routes():
+    check = CountingCheck(ok=False)
+    app = Flask(__name__)
+    setup_health_routes(app, ReadinessChecker({'db': check}, ttl=60))
+    client = app.test_client()
+
+    # Проба живости не выполняет проверок
+    assert client.get('/health/live').get_json() == {'status': 'alive'}
+    assert check.calls == 0
+
+    response = client.get('/health/ready')
+    assert response.status_code == 503
+    assert response.headers['Cache-Control'] == 'no-store'
+    assert response.get_json()['checks']['db']['ok'] is False
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты времени запуска точек входа (pytest)
+
+Каждая точка входа импортируется в отдельном процессе с -X importtime
+(import_time_check.measure_import): тяжелые библиотеки не должны загружаться
+при импорте, а общее время - превышать IMPORT_TIME_BUDGET_MS.
+"""
+
+import pytest
+
+from import_time_check import ENTRY_MODULES, IMPORT_TIME_BUDGET_MS, measure_import
+
+# Библиотеки, которые точно не должны загружаться при импорте
+FORBIDDEN_MODULES = ['ifcopenshell', 'gspread', 'oauth2client', 'authlib', 'pyarrow']
+
+
+@pytest.mark.parametrize('module', ENTRY_MODULES)
+def test_entry_point_does_not_load_heavy_modules(module, tmp_path):
+    entries = measure_import(module, str(tmp_path))
+    loaded = {name.split('.')[0] for name, _, _ in entries}
+
+    assert not loaded & set(FORBIDDEN_MODULES), f"import {module} loads {sorted(loaded & set(FORBIDDEN_MODULES))}"
+
+
+@pytest.mark.parametrize('module', ENTRY_MODULES)
+def test_entry_point_import_time_within_budget(module, tmp_path):
+    entries = measure_import(module, str(tmp_path))
+    total_ms = entries[-1][2] / 1000
+
+    assert total_ms <= IMPORT_TIME_BUDGET_MS, f"import {module}: {total_ms:.0f} ms > {IMPORT_TIME_BUDGET_MS} ms"
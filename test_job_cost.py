@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты оценки длительности задач (pytest): счетчики сущностей и зон, экстраполяция, модель
+"""
+
+import zipfile
+
+import pytest
+
+import job_cost
+from job_cost import MarkerCounter, preflight_ifc, estimate_job_seconds
+from upload_storage import HashingUploadFile
+
+MODEL = (b'ISO-10303-21;\nDATA;\n'
+         + b'#1=IFCSPATIALZONE($,$,$);\n#2=IFCSPACE($,$,$);\n' * 50
+         + b'ENDSEC;\nEND-ISO-10303-21;\n')
+
+
+@pytest.mark.parametrize('block_size', [1, 3, 7, 64, len(MODEL)])
+def test_markers_split_between_blocks_are_counted_once(block_size):
+    counter = MarkerCounter()
+    for offset in range(0, len(MODEL), block_size):
+        counter.update(MODEL[offset:offset + block_size])
+
+    assert counter.counts == (100, 50)
+
+
+def test_large_file_is_extrapolated_from_sample(tmp_path, monkeypatch):
+    path = tmp_path / 'model.ifc'
+    path.write_bytes(MODEL)
+    monkeypatch.setattr(job_cost, 'PREFLIGHT_SAMPLE_BYTES', len(MODEL) // 4)
+
+    entities, zones = preflight_ifc({'path': str(path), 'size': len(MODEL)})
+    assert 80 <= entities <= 120
+    assert 40 <= zones <= 60
+
+
+def test_archive_member_and_missing_file(tmp_path):
+    archive_path = tmp_path / 'batch.zip'
+    with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('floors/a.ifc', MODEL)
+
+    assert preflight_ifc({'path': str(archive_path), 'member': 'floors/a.ifc', 'size': len(MODEL)}) == (100, 50)
+    assert preflight_ifc({'path': str(tmp_path / 'missing.ifc'), 'original_name': 'missing.ifc'}) is None
+
+
+def test_estimate_uses_counts_from_upload(monkeypatch):
+    monkeypatch.setattr(job_cost, 'JOB_COST_BASE_SECONDS', 1.0)
+    monkeypatch.setattr(job_cost, 'JOB_COST_FILE_SECONDS', 0.5)
+    monkeypatch.setattr(job_cost, 'JOB_COST_PER_ENTITY', 0.01)
+    monkeypatch.setattr(job_cost, 'JOB_COST_PER_ZONE', 0.1)
+
+    # Счетчики, посчитанные при приеме, - файл повторно не читается
+    files = [{'path': '/nonexistent.ifc', 'size': 10, 'preflight': {'entities': 100, 'zones': 20}}]
+    assert estimate_job_seconds(files) == (1.0 + 0.5 + 1.0 + 2.0, [{'entities': 100, 'zones': 20}])
+
+    # Недоступный файл оценивается по размеру
+    files = [{'path': '/nonexistent.ifc', 'size': 80 * 300}]
+    assert estimate_job_seconds(files) == (1.0 + 0.5 + 3.0, [{'entities': 300, 'zones': 0}])
+
+
+def test_upload_counts_markers_while_receiving(tmp_path):
+    upload = HashingUploadFile(str(tmp_path))
+    for offset in range(0, len(MODEL), 5):
+        upload.write(MODEL[offset:offset + 5])
+    upload.discard()
+
+    assert upload.preflight == {'entities': 100, 'zones': 50}
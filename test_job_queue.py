@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты очереди задач конвертации (pytest): захват, аренда, отмена, поток событий SSE, допуск в очередь,
+планировщик (кратчайшая задача первой со старением)
+"""
+
+import io
+import time
+import sqlite3
+import threading
+
+import pytest
+
+import job_queue
+from cancellation import ConversionCancelled, DeadlineExceeded
+from job_queue import (JobQueue, QueueFullError, JOB_RUNNING, JOB_SUCCESS, JOB_ERROR, JOB_CANCELLED, DEFAULT_RETRY_AFTER,
+                       estimate_job_memory, stream_job_events)
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'jobs.db')
+
+
+@pytest.fixture
+def queue(db_path):
+    return JobQueue(db_path, memory_budget_mb=1000)
+
+
+def node_queue(db_path, hostname, **kwargs):
+    """Очередь другого узла, работающего с той же БД"""
+    other = JobQueue(db_path, memory_budget_mb=kwargs.pop('memory_budget_mb', 1000), **kwargs)
+    other.hostname = hostname
+    return other
+
+
+def test_claim_takes_jobs_once_in_order(queue):
+    first = queue.enqueue({'files': []}, predicted_seconds=1)
+    second = queue.enqueue({'files': []}, predicted_seconds=5)
+
+    assert queue.claim()['id'] == first
+    job = queue.claim()
+    assert job['id'] == second
+    assert job['state'] == JOB_RUNNING
+    assert job['attempts'] == 1
+    assert queue.claim() is None
+
+
+def test_concurrent_claims_do_not_share_jobs(db_path):
+    queues = [node_queue(db_path, f'node-{index}') for index in range(4)]
+    job_ids = {queues[0].enqueue({'files': []}) for _ in range(20)}
+    claimed = []
+    lock = threading.Lock()
+
+    def worker(queue):
+        while True:
+            job = queue.claim()
+            if job is None:
+                return
+            with lock:
+                claimed.append(job['id'])
+
+    threads = [threading.Thread(target=worker, args=(queue,)) for queue in queues]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == sorted(job_ids)
+
+
+def test_claim_respects_running_limit_per_client(db_path):
+    queue = JobQueue(db_path, memory_budget_mb=1000, max_running_per_client=1)
+    first = queue.enqueue({'files': []}, client='user:1')
+    queue.enqueue({'files': []}, client='user:1')
+    other = queue.enqueue({'files': []}, client='user:2')
+
+    assert queue.claim()['id'] == first
+    # Вторая задача того же клиента ждет, задача другого клиента ее обходит
+    assert queue.claim()['id'] == other
+    assert queue.claim() is None
+
+
+def test_claim_respects_node_memory_budget(db_path):
+    queue = JobQueue(db_path, memory_budget_mb=100)
+    first = queue.enqueue({'files': []}, memory_mb=80)
+    second = queue.enqueue({'files': []}, memory_mb=80)
+
+    job = queue.claim()
+    assert job['id'] == first
+    assert queue.claim() is None
+
+    queue.complete(first, {'processed_flats': 1}, attempt=job['attempts'])
+    assert queue.claim()['id'] == second
+
+
+def test_expired_lease_is_requeued_and_stale_result_discarded(db_path, monkeypatch):
+    node_a = node_queue(db_path, 'node-a')
+    node_b = node_queue(db_path, 'node-b')
+    job_id = node_a.enqueue({'files': []})
+
+    # Аренда узла A истекает сразу: узел "завис"
+    monkeypatch.setattr(job_queue, 'JOB_LEASE_SECONDS', -1)
+    stale = node_a.claim()
+    monkeypatch.setattr(job_queue, 'JOB_LEASE_SECONDS', 60)
+
+    job = node_b.claim()
+    assert job['id'] == job_id
+    assert job['attempts'] == 2
+    assert job['owner'].startswith('node-b:')
+    assert 'requeued' in [event['event'] for event in node_b.get_events(job_id)]
+
+    # Результат потерявшей аренду попытки не записывается
+    assert node_a.complete(job_id, {'processed_flats': 1}, attempt=stale['attempts']) is False
+    assert node_b.complete(job_id, {'processed_flats': 2}, attempt=job['attempts']) is True
+    assert node_b.get_job(job_id)['state'] == JOB_SUCCESS
+    assert node_b.get_job(job_id)['result'] == {'processed_flats': 2}
+
+
+def test_lease_expiry_fails_job_after_max_attempts(queue, monkeypatch):
+    monkeypatch.setattr(job_queue, 'JOB_MAX_ATTEMPTS', 2)
+    monkeypatch.setattr(job_queue, 'JOB_LEASE_SECONDS', -1)
+    job_id = queue.enqueue({'files': []})
+
+    assert queue.claim()['attempts'] == 1
+    assert queue.claim()['attempts'] == 2
+    assert queue.claim() is None
+
+    job = queue.get_job(job_id)
+    assert job['state'] == JOB_ERROR
+    assert 'lost 2 times' in job['error_message']
+
+
+def test_renew_leases_extends_only_own_jobs(db_path):
+    node_a = node_queue(db_path, 'node-a')
+    node_b = node_queue(db_path, 'node-b')
+    node_a.enqueue({'files': []})
+    node_b.enqueue({'files': []})
+    job_a = node_a.claim()
+    job_b = node_b.claim()
+
+    time.sleep(0.01)
+    assert node_a.renew_leases() == 1
+    assert node_a.get_job(job_a['id'])['lease_expires_at'] > job_a['lease_expires_at']
+    assert node_a.get_job(job_b['id'])['lease_expires_at'] == job_b['lease_expires_at']
+
+
+def test_cancel_queued_job_is_immediate(queue):
+    job_id = queue.enqueue({'files': []})
+
+    assert queue.request_cancel(job_id) == JOB_CANCELLED
+    assert queue.claim() is None
+    assert queue.get_job(job_id)['state'] == JOB_CANCELLED
+
+
+def test_cancel_unknown_job(queue):
+    assert queue.request_cancel('missing') is None
+
+
+def test_cancel_running_job_stops_at_next_check(queue):
+    job_id = queue.enqueue({'files': []})
+    job = queue.claim()
+    token = queue.cancellation_token(job)
+    token.poll_interval = 0
+    token.check()
+
+    assert queue.request_cancel(job_id) == JOB_RUNNING
+    with pytest.raises(ConversionCancelled):
+        token.check()
+    assert not token.lease_lost
+
+    assert queue.cancelled(job_id, "Conversion cancelled", attempt=job['attempts'])
+    assert queue.get_job(job_id)['state'] == JOB_CANCELLED
+
+
+def test_token_stops_attempt_that_lost_its_lease(db_path, monkeypatch):
+    node_a = node_queue(db_path, 'node-a')
+    node_b = node_queue(db_path, 'node-b')
+    node_a.enqueue({'files': []})
+
+    monkeypatch.setattr(job_queue, 'JOB_LEASE_SECONDS', -1)
+    stale = node_a.claim()
+    monkeypatch.setattr(job_queue, 'JOB_LEASE_SECONDS', 60)
+    node_b.claim()
+
+    token = node_a.cancellation_token(stale)
+    token.poll_interval = 0
+    with pytest.raises(ConversionCancelled, match='lease lost'):
+        token.check()
+    assert token.lease_lost
+
+
+def test_deadline_exceeded(queue):
+    job_id = queue.enqueue({'files': []}, deadline_seconds=60)
+    job = queue.claim()
+    job['deadline_at'] = time.time() - 1
+
+    with pytest.raises(DeadlineExceeded):
+        queue.cancellation_token(job).check()
+    assert queue.get_job(job_id)['deadline_at'] > time.time()
+
+
+def test_cancelled_job_with_expired_lease_is_not_requeued(queue, monkeypatch):
+    job_id = queue.enqueue({'files': []})
+    monkeypatch.setattr(job_queue, 'JOB_LEASE_SECONDS', -1)
+    queue.claim()
+    queue.request_cancel(job_id)
+
+    assert queue.claim() is None
+    assert queue.get_job(job_id)['state'] == JOB_CANCELLED
+
+
+def test_event_stream_ends_after_completion(queue, monkeypatch):
+    monkeypatch.setattr(job_queue, 'EVENTS_POLL_INTERVAL', 0.01)
+    job_id = queue.enqueue({'files': []})
+    job = queue.claim()
+
+    def finish():
+        queue.progress(job_id).publish('file_started', file='a.ifc')
+        queue.complete(job_id, {'processed_flats': 7}, attempt=job['attempts'])
+
+    # Задача завершается, пока поток уже ждет новых событий
+    threading.Timer(0.1, finish).start()
+    messages = list(stream_job_events(queue, job_id))
+
+    assert [message.split('\n')[1] for message in messages] == [
+        'event: queued', 'event: started', 'event: file_started', 'event: finished'
+    ]
+    assert 'data: {"processed_flats": 7}' in messages[-1]
+
+
+def test_event_stream_resumes_after_last_event_id(queue):
+    job_id = queue.enqueue({'files': []})
+    queue.fail(job_id, 'broken')
+    events = queue.get_events(job_id)
+
+    messages = list(stream_job_events(queue, job_id, after_id=events[0]['id']))
+    assert len(messages) == 1
+    assert messages[0].startswith(f"id: {events[1]['id']}\nevent: failed\n")
+
+
+def test_events_route_streams_own_jobs_only(main_module, flask_app, client):
+    job_id = main_module.job_queue.enqueue({'files': []})
+    main_module.job_queue.cancelled(job_id, 'stopped')
+
+    assert client.get(f'/jobs/{job_id}/events').status_code == 404
+
+    with client.session_transaction() as session:
+        session['jobs'] = [job_id]
+    response = client.get(f'/jobs/{job_id}/events')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['X-Accel-Buffering'] == 'no'
+    body = response.get_data(as_text=True)
+    assert body.count('\n\n') == 2
+    assert body.rstrip().splitlines()[-2] == 'event: cancelled'
+
+
+def finish_job(queue, seconds, **kwargs):
+    """Выполненная задача заданной длительности (история для оценок очереди)"""
+    job_id = queue.enqueue({'files': []}, **kwargs)
+    job = queue.claim()
+    assert job['id'] == job_id
+    queue.complete(job_id, {'processed_flats': 1}, attempt=job['attempts'])
+
+    conn = sqlite3.connect(queue.db_path)
+    with conn:
+        conn.execute('UPDATE jobs SET finished_at = started_at + ? WHERE id = ?', (seconds, job_id))
+    conn.close()
+    return job_id
+
+
+def test_full_queue_is_rejected_with_retry_after(queue, monkeypatch):
+    monkeypatch.setattr(queue, 'max_queued_jobs', 1)
+    queue.enqueue({'files': []})
+
+    # Длительность задач еще неизвестна
+    with pytest.raises(QueueFullError) as error:
+        queue.enqueue({'files': []}, admission=True)
+    assert error.value.retry_after == DEFAULT_RETRY_AFTER
+
+
+def test_retry_after_follows_recent_durations(queue, monkeypatch):
+    finish_job(queue, 40)
+    monkeypatch.setattr(queue, 'max_queued_jobs', 1)
+    queue.enqueue({'files': []})
+
+    with pytest.raises(QueueFullError) as error:
+        queue.check_admission()
+    assert error.value.retry_after == 40
+
+
+def test_client_limit_counts_running_and_queued_jobs(db_path):
+    queue = JobQueue(db_path, memory_budget_mb=1000, max_running_per_client=1, max_queued_per_client=1)
+    queue.enqueue({'files': []}, client='user:1', admission=True)
+    queue.claim()
+    queue.enqueue({'files': []}, client='user:1', admission=True)
+
+    with pytest.raises(QueueFullError, match='Too many conversions'):
+        queue.enqueue({'files': []}, client='user:1', admission=True)
+    queue.enqueue({'files': []}, client='user:2', admission=True)
+
+
+def test_job_memory_counts_largest_parallel_files():
+    files = [{'size': 10 * 1024 * 1024}, {'size': 30 * 1024 * 1024}, {'size': 20 * 1024 * 1024}]
+
+    assert estimate_job_memory(files) == job_queue.JOB_MEMORY_BASE_MB + job_queue.JOB_MEMORY_FACTOR * 30
+    assert estimate_job_memory(files, parallel_files=2) == job_queue.JOB_MEMORY_BASE_MB + job_queue.JOB_MEMORY_FACTOR * 50
+
+
+def test_job_over_budget_runs_alone(db_path):
+    queue = JobQueue(db_path, memory_budget_mb=100)
+    large = queue.enqueue({'files': []}, memory_mb=500)
+    queue.enqueue({'files': []}, memory_mb=10)
+
+    # Задача больше бюджета не ждет вечно: на свободном узле она выполняется одна
+    assert queue.claim()['id'] == large
+    assert queue.claim() is None
+
+
+def test_upload_over_capacity_gets_429(main_module, client, monkeypatch):
+    monkeypatch.setattr(main_module.job_queue, 'max_queued_jobs', 1)
+    main_module.job_queue.enqueue({'files': []})
+
+    response = client.post('/uploads', data={'files': (io.BytesIO(b'ISO-10303-21;'), 'model.ifc')},
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == str(DEFAULT_RETRY_AFTER)
+    assert response.get_json()['retry_after'] == DEFAULT_RETRY_AFTER
+
+
+def set_created_at(queue, job_id, created_at):
+    conn = sqlite3.connect(queue.db_path)
+    with conn:
+        conn.execute('UPDATE jobs SET created_at = ? WHERE id = ?', (created_at, job_id))
+    conn.close()
+
+
+def test_shortest_job_first_with_position(queue):
+    large = queue.enqueue({'files': []}, predicted_seconds=300)
+    small = queue.enqueue({'files': []}, predicted_seconds=5)
+
+    assert queue.get_job(small)['position'] == 1
+    assert queue.get_job(large)['position'] == 2
+    assert queue.claim()['id'] == small
+
+
+def test_waiting_large_job_overtakes_new_small_jobs(queue):
+    large = queue.enqueue({'files': []}, predicted_seconds=300)
+    # Большая задача ждет дольше, чем разница оценок
+    set_created_at(queue, large, time.time() - 400)
+    queue.enqueue({'files': []}, predicted_seconds=5)
+
+    assert queue.claim()['id'] == large
+
+
+def test_calibration_scales_estimates_against_waiting_time(tmp_path):
+    def first_scheduled(queue):
+        large = queue.enqueue({'files': []}, predicted_seconds=30)
+        queue.enqueue({'files': []}, predicted_seconds=10)
+        set_created_at(queue, large, time.time() - 40)
+        return 'large' if queue.claim()['id'] == large else 'small'
+
+    assert first_scheduled(JobQueue(str(tmp_path / 'new.db'), memory_budget_mb=1000)) == 'large'
+
+    # Задачи выполняются втрое дольше предсказанного: 40 секунд ожидания уже не перевешивают оценку
+    calibrated = JobQueue(str(tmp_path / 'calibrated.db'), memory_budget_mb=1000)
+    finish_job(calibrated, 30, predicted_seconds=10)
+    assert first_scheduled(calibrated) == 'small'
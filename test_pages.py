@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты страниц загрузки (pytest): общий код загрузки подключается на обеих страницах
+"""
+
+import pytest
+
+SHARED_FUNCTIONS = ['async function hashFile', 'async function compressFile', 'async function uploadInChunks',
+                    'function followJobEvents', 'async function waitForJob']
+
+
+def login(client):
+    with client.session_transaction() as session:
+        session['user'] = {'id': 'alice', 'name': 'Alice', 'email': 'alice@example.com', 'picture': ''}
+
+
+@pytest.mark.parametrize('path, logged_in', [('/', False), ('/dashboard', True)])
+def test_page_includes_shared_upload_code_once(client, path, logged_in):
+    if logged_in:
+        login(client)
+
+    response = client.get(path)
+
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    for function in SHARED_FUNCTIONS:
+        assert page.count(function) == 1, function
+    assert "new CompressionStream('gzip')" in page
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты конвертации по пути (pytest): границы INGEST_ROOTS и индекс хешей
+"""
+
+import os
+import hashlib
+
+import pytest
+from flask import Flask
+
+from path_ingest import PathIngestor, IngestError, setup_ingest_routes
+
+
+@pytest.fixture
+def layout(tmp_path):
+    """Корень с моделями и соседняя папка вне корня"""
+    root = tmp_path / 'root'
+    outside = tmp_path / 'outside'
+    (root / 'project').mkdir(parents=True)
+    outside.mkdir()
+    (root / 'project' / 'a.ifc').write_bytes(b'ISO-10303-21;\n#1=A;\n')
+    (root / 'project' / 'notes.txt').write_text('x')
+    (outside / 'secret.ifc').write_bytes(b'secret')
+    return root, outside
+
+
+@pytest.fixture
+def ingestor(layout, tmp_path):
+    root, _ = layout
+    return PathIngestor(roots=[str(root)], db_path=str(tmp_path / 'jobs.db'))
+
+
+def error_status(ingestor, path):
+    with pytest.raises(IngestError) as error:
+        ingestor.expand(path)
+    return error.value.status_code
+
+
+def test_file_inside_root(ingestor, layout):
+    root, _ = layout
+    path = str(root / 'project' / 'a.ifc')
+
+    assert ingestor.expand(path) == [os.path.realpath(path)]
+
+
+def test_directory_lists_only_ifc_files(ingestor, layout):
+    root, _ = layout
+
+    assert ingestor.expand(str(root / 'project')) == [os.path.realpath(root / 'project' / 'a.ifc')]
+
+
+def test_dotdot_escape_is_rejected(ingestor, layout):
+    root, _ = layout
+
+    assert error_status(ingestor, str(root / 'project' / '..' / '..' / 'outside' / 'secret.ifc')) == 403
+
+
+def test_symlink_escape_is_rejected(ingestor, layout):
+    root, outside = layout
+    os.symlink(outside / 'secret.ifc', root / 'project' / 'link.ifc')
+    os.symlink(outside, root / 'linked-dir')
+
+    assert error_status(ingestor, str(root / 'project' / 'link.ifc')) == 403
+    assert error_status(ingestor, str(root / 'linked-dir' / 'secret.ifc')) == 403
+    # Симлинк наружу внутри разрешенной папки пропускается при перечислении
+    assert ingestor.expand(str(root / 'project')) == [os.path.realpath(root / 'project' / 'a.ifc')]
+
+
+def test_sibling_with_common_prefix_is_rejected(ingestor, layout, tmp_path):
+    root, _ = layout
+    sibling = tmp_path / 'root-other'
+    sibling.mkdir()
+    (sibling / 'b.ifc').write_bytes(b'b')
+
+    assert error_status(ingestor, str(sibling / 'b.ifc')) == 403
+
+
+def test_relative_missing_and_non_ifc_paths(ingestor, layout):
+    root, _ = layout
+
+    assert error_status(ingestor, 'project/a.ifc') == 400
+    assert error_status(ingestor, str(root / 'project' / 'missing.ifc')) == 404
+    assert error_status(ingestor, str(root / 'project' / 'notes.txt')) == 400
+
+
+def test_disabled_without_roots(tmp_path):
+    ingestor = PathIngestor(roots=[], db_path=str(tmp_path / 'jobs.db'))
+
+    assert error_status(ingestor, str(tmp_path)) == 404
+
+
+def test_collect_does_not_hash(ingestor, layout):
+    root, _ = layout
+    files = ingestor.collect([str(root / 'project'), str(root / 'project' / 'a.ifc')])
+
+    assert len(files) == 1
+    assert files[0]['size'] == (root / 'project' / 'a.ifc').stat().st_size
+    assert 'sha256' not in files[0]
+
+
+def test_fingerprint_uses_index_until_file_changes(ingestor, layout):
+    root, _ = layout
+    path = os.path.realpath(root / 'project' / 'a.ifc')
+    data = (root / 'project' / 'a.ifc').read_bytes()
+
+    size, sha256, changed = ingestor.fingerprint(path)
+    assert (size, sha256, changed) == (len(data), hashlib.sha256(data).hexdigest(), True)
+    assert ingestor.fingerprint(path) == (size, sha256, False)
+
+    with open(path, 'ab') as f:
+        f.write(b'#2=B;\n')
+    assert ingestor.fingerprint(path)[2] is True
+
+
+def test_routes_unavailable_without_auth(ingestor, layout):
+    root, _ = layout
+    app = Flask(__name__)
+    queued = []
+    setup_ingest_routes(app, ingestor, lambda files, coefficient: queued.append(files), lambda: 0.9)
+    client = app.test_client()
+
+    assert client.get('/ingest/roots').status_code == 503
+    assert client.post('/ingest', json={'paths': [str(root / 'project')]}).status_code == 503
+    assert queued == []
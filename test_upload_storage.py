@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты приема загрузок (pytest): сохранение без копирования, хранилище по хешу, распаковка сжатых в браузере файлов (GzipUploadFile)
+"""
+
+import io
+import os
+import gzip
+import hashlib
+import sqlite3
+
+import pytest
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+from upload_storage import BlobStore, GzipUploadFile, HashingUploadFile
+
+DATA = b'ISO-10303-21;\n' + b'#1=IFCSPACE($,$,$);\n' * 500
+
+
+def write_in_blocks(upload, data, block_size=100):
+    """Запись данных блоками, как это делает парсер multipart"""
+    for offset in range(0, len(data), block_size):
+        upload.write(data[offset:offset + block_size])
+
+
+def test_decompresses_and_hashes_plain_content(tmp_path):
+    upload = GzipUploadFile(str(tmp_path))
+    compressed = gzip.compress(DATA)
+    write_in_blocks(upload, compressed)
+
+    assert upload.complete
+    assert upload.size == len(DATA)
+    assert upload.compressed_size == len(compressed)
+    assert upload.sha256 == hashlib.sha256(DATA).hexdigest()
+
+    upload.persist(str(tmp_path / 'model.ifc'))
+    assert (tmp_path / 'model.ifc').read_bytes() == DATA
+
+
+def test_concatenated_gzip_members(tmp_path):
+    upload = GzipUploadFile(str(tmp_path))
+    write_in_blocks(upload, gzip.compress(DATA[:1000]) + gzip.compress(DATA[1000:]))
+
+    assert upload.complete
+    assert upload.sha256 == hashlib.sha256(DATA).hexdigest()
+    upload.discard()
+
+
+def test_invalid_data_is_bad_request(tmp_path):
+    upload = GzipUploadFile(str(tmp_path))
+
+    with pytest.raises(BadRequest, match='Invalid gzip data'):
+        upload.write(b'not gzip at all')
+    upload.discard()
+
+
+def test_decompressed_size_limit(tmp_path):
+    # Сжатый поток мал, распакованный превышает лимит ("zip-бомба")
+    upload = GzipUploadFile(str(tmp_path), max_size=1000)
+    compressed = gzip.compress(b'\0' * 100000)
+    assert len(compressed) < 1000
+
+    with pytest.raises(RequestEntityTooLarge):
+        write_in_blocks(upload, compressed)
+    assert upload.size <= 1000
+    upload.discard()
+
+
+def test_size_exactly_at_limit_is_accepted(tmp_path):
+    upload = GzipUploadFile(str(tmp_path), max_size=len(DATA))
+    write_in_blocks(upload, gzip.compress(DATA))
+
+    assert upload.size == len(DATA)
+    upload.discard()
+
+
+def test_truncated_stream_is_not_persisted(tmp_path):
+    upload = GzipUploadFile(str(tmp_path))
+    compressed = gzip.compress(DATA)
+    write_in_blocks(upload, compressed[:len(compressed) // 2])
+
+    assert not upload.complete
+    with pytest.raises(BadRequest, match='Truncated gzip data'):
+        upload.persist(str(tmp_path / 'model.ifc'))
+    upload.discard()
+
+    assert not (tmp_path / 'model.ifc').exists()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_spooled_file_is_renamed_not_copied(tmp_path):
+    upload = HashingUploadFile(str(tmp_path / 'spool'))
+    write_in_blocks(upload, DATA)
+    inode = os.stat(upload.path).st_ino
+
+    destination = str(tmp_path / 'model.ifc')
+    upload.persist(destination)
+    upload.discard()
+
+    # Тот же файл на диске под новым именем, временного файла больше нет
+    assert os.stat(destination).st_ino == inode
+    assert upload.sha256 == hashlib.sha256(DATA).hexdigest()
+    assert os.listdir(tmp_path / 'spool') == []
+
+
+def test_upload_route_moves_request_spool_into_store(client, monkeypatch):
+    persisted = []
+    original_persist = HashingUploadFile.persist
+
+    def persist(self, destination):
+        inode = os.stat(self.path).st_ino
+        original_persist(self, destination)
+        persisted.append((inode, os.stat(destination).st_ino, destination))
+
+    monkeypatch.setattr(HashingUploadFile, 'persist', persist)
+    # Содержимое, которого еще нет в хранилище: дубликат не переносится
+    data = DATA + os.urandom(16).hex().encode()
+
+    response = client.post('/uploads', data={'files': (io.BytesIO(data), 'model.ifc')},
+                           content_type='multipart/form-data')
+
+    assert response.status_code == 202
+    [(spool_inode, stored_inode, destination)] = persisted
+    assert spool_inode == stored_inode
+    with open(destination, 'rb') as f:
+        assert f.read() == data
+    assert not any(name.endswith('.upload') for name in os.listdir(client.application.config['UPLOAD_SPOOL_FOLDER']))
+
+
+@pytest.fixture
+def blob_store(tmp_path):
+    return BlobStore(str(tmp_path / 'blobs'), db_path=str(tmp_path / 'jobs.db'))
+
+
+def spooled(tmp_path, data):
+    upload = HashingUploadFile(str(tmp_path / 'spool'))
+    write_in_blocks(upload, data)
+    return upload
+
+
+def test_duplicate_upload_is_stored_once(tmp_path, blob_store):
+    path, size, sha256, deduplicated = blob_store.add_stream(spooled(tmp_path, DATA), 'model.ifc')
+    assert (size, deduplicated) == (len(DATA), False)
+    assert path == blob_store.blob_path(hashlib.sha256(DATA).hexdigest(), 'ifc')
+
+    again = blob_store.add_stream(spooled(tmp_path, DATA), 'copy.IFC')
+    assert again == (path, len(DATA), sha256, True)
+
+    # Повторная загрузка не оставляет ни второго файла, ни временного
+    assert os.listdir(tmp_path / 'spool') == []
+    assert [files for _, _, files in os.walk(blob_store.root) if files] == [[os.path.basename(path)]]
+
+
+def test_duplicate_file_from_other_stream_is_removed(tmp_path, blob_store):
+    sha256 = hashlib.sha256(DATA).hexdigest()
+    for name in ('first.upload', 'second.upload'):
+        (tmp_path / name).write_bytes(DATA)
+
+    path, deduplicated = blob_store.add_file(str(tmp_path / 'first.upload'), sha256, len(DATA), 'model.ifc')
+    assert not deduplicated
+    assert blob_store.add_file(str(tmp_path / 'second.upload'), sha256, len(DATA), 'model.ifc') == (path, True)
+    assert not (tmp_path / 'second.upload').exists()
+
+
+def test_find_by_user_reference(tmp_path, blob_store):
+    path, _, sha256, _ = blob_store.add_stream(spooled(tmp_path, DATA), 'model.ifc')
+
+    assert blob_store.find(sha256)['path'] == path
+    assert blob_store.find(sha256, user_id='alice') is None
+    blob_store.add_reference(sha256, 'model.ifc', job_id='job-1', user_id='alice')
+    assert blob_store.find(sha256, user_id='alice')['size'] == len(DATA)
+
+    # Файл удален с диска вручную - запись в БД не считается найденным файлом
+    os.remove(path)
+    assert blob_store.find(sha256) is None
+
+
+def test_upload_route_references_each_name_and_job(client):
+    data = DATA + os.urandom(16).hex().encode()
+    job_ids = []
+    for name in ('first.ifc', 'second.ifc'):
+        response = client.post('/uploads', data={'files': (io.BytesIO(data), name)},
+                               content_type='multipart/form-data')
+        assert response.status_code == 202
+        job_ids.append(response.get_json()['job_id'])
+
+    sha256 = hashlib.sha256(data).hexdigest()
+    conn = sqlite3.connect(os.environ['JOBS_DB_PATH'])
+    refs = conn.execute('SELECT original_name, job_id FROM upload_refs WHERE sha256 = ? ORDER BY id',
+                        (sha256,)).fetchall()
+    blobs = conn.execute('SELECT COUNT(*) FROM upload_blobs WHERE sha256 = ?', (sha256,)).fetchone()[0]
+    conn.close()
+
+    assert refs == [('first.ifc', job_ids[0]), ('second.ifc', job_ids[1])]
+    assert blobs == 1
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Тесты наблюдения за папками (pytest): ожидание конца записи, пакеты, обратное давление
+
+Цикл наблюдения не запускается: тест вызывает его шаги (_touch, _settle,
+_flush, _check_pending) сам и управляет часами наблюдателя.
+"""
+
+import time
+import types
+
+import pytest
+
+import watch_folder
+from job_queue import JobQueue
+from path_ingest import PathIngestor
+from watch_folder import WatchFolderDaemon, WATCH_USER_ID
+
+MODEL = b'ISO-10303-21;\n#1=IFCSPACE($,$,$);\n'
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Часы наблюдателя, сдвигаемые тестом"""
+    now = [1000.0]
+    monkeypatch.setattr(watch_folder, 'time', types.SimpleNamespace(monotonic=lambda: now[0], time=time.time))
+
+    def advance(seconds):
+        now[0] += seconds
+    return advance
+
+
+@pytest.fixture
+def project(tmp_path):
+    directory = tmp_path / 'watched' / 'project'
+    directory.mkdir(parents=True)
+    return directory
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / 'jobs.db'), memory_budget_mb=1000)
+
+
+@pytest.fixture
+def daemon(tmp_path, queue):
+    watched = str(tmp_path / 'watched')
+    ingestor = PathIngestor(roots=[watched], db_path=str(tmp_path / 'jobs.db'))
+    return WatchFolderDaemon(queue, [watched], ingestor=ingestor, settle_seconds=5, batch_window=10,
+                             max_pending_jobs=1, db_path=str(tmp_path / 'jobs.db'))
+
+
+def step(daemon, *paths):
+    """Один проход цикла наблюдения с событиями об изменении paths"""
+    for path in paths:
+        daemon._touch(str(path))
+    daemon._check_pending()
+    daemon._settle()
+    daemon._flush()
+
+
+def wait_quiet(daemon, clock):
+    """Файлы перестали меняться, а новые файлы в папку больше не приходят"""
+    clock(6)
+    step(daemon)
+    clock(11)
+    step(daemon)
+
+
+def queued_jobs(queue):
+    conn = queue._connect()
+    rows = conn.execute('SELECT id, payload FROM jobs ORDER BY created_at').fetchall()
+    conn.close()
+    return rows
+
+
+def test_file_still_being_written_is_not_queued(daemon, queue, project, clock):
+    model = project / 'a.ifc'
+    model.write_bytes(MODEL[:10])
+    step(daemon, model)
+
+    # Копирование продолжается: каждое изменение откладывает файл заново
+    for _ in range(3):
+        clock(4)
+        with open(model, 'ab') as f:
+            f.write(b'#2=IFCSPACE($,$,$);\n')
+        step(daemon)
+    assert daemon._batches == {}
+
+    clock(6)
+    step(daemon)
+    assert list(daemon._batches[str(project)]) == [str(model)]
+    assert queued_jobs(queue) == []
+
+
+def test_files_of_one_folder_form_one_job(daemon, queue, project, clock):
+    for name in ('a.ifc', 'b.ifc'):
+        (project / name).write_bytes(MODEL + name.encode())
+    step(daemon, project / 'a.ifc')
+    clock(3)
+    step(daemon, project / 'b.ifc')
+
+    clock(5)
+    step(daemon)
+    clock(9)
+    step(daemon)
+    assert queued_jobs(queue) == []
+
+    # Окно пакета отсчитывается от последнего добавленного файла
+    clock(5)
+    step(daemon)
+    [job] = queued_jobs(queue)
+    job = queue.get_job(job['id'])
+    assert [f['original_name'] for f in job['payload']['files']] == ['a.ifc', 'b.ifc']
+    assert job['payload']['combined_name'] == 'project'
+    assert job['user_id'] == WATCH_USER_ID
+
+
+def test_busy_queue_holds_files_until_job_finishes(daemon, queue, project, clock):
+    (project / 'a.ifc').write_bytes(MODEL)
+    step(daemon, project / 'a.ifc')
+    wait_quiet(daemon, clock)
+    assert len(queued_jobs(queue)) == 1
+
+    # Пока задача наблюдателя не завершена, новые файлы копятся в пакете
+    (project / 'b.ifc').write_bytes(MODEL + b'b')
+    step(daemon, project / 'b.ifc')
+    wait_quiet(daemon, clock)
+    assert len(queued_jobs(queue)) == 1
+    assert list(daemon._batches[str(project)]) == [str(project / 'b.ifc')]
+
+    job = queue.claim()
+    queue.complete(job['id'], {'processed_flats': 1}, attempt=job['attempts'])
+    step(daemon)
+    assert len(queued_jobs(queue)) == 2
+    assert daemon._batches == {}
+
+
+def test_only_successful_jobs_mark_files_processed(daemon, queue, project, clock):
+    model = project / 'a.ifc'
+    model.write_bytes(MODEL)
+    step(daemon, model)
+    wait_quiet(daemon, clock)
+
+    job = queue.claim()
+    queue.fail(job['id'], 'broken')
+    step(daemon)
+
+    # Та же запись после ошибки конвертируется снова, после успеха - нет
+    step(daemon, model)
+    wait_quiet(daemon, clock)
+    assert len(queued_jobs(queue)) == 2
+
+    job = queue.claim()
+    queue.complete(job['id'], {'processed_flats': 1}, attempt=job['attempts'])
+    step(daemon)
+    step(daemon, model)
+    wait_quiet(daemon, clock)
+    assert len(queued_jobs(queue)) == 2
+    assert daemon._batches == {}
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сохранение загружаемых файлов без повторного копирования
+
+Werkzeug по умолчанию буферизует части multipart во временный файл, после чего
+file.save() копирует его в папку загрузок еще раз. Здесь части сразу пишутся
+во временный файл внутри UPLOAD_FOLDER, а размер и SHA-256 считаются в том же
+проходе, так что сохранение сводится к переименованию (os.replace).
+
+Файлы хранятся один раз по хешу содержимого (BlobStore), исходные имена и
+задачи конвертации ссылаются на них через таблицу upload_refs. Хеш части
+multipart известен только после ее приема, поэтому дубликат все равно
+записывается во временный файл и затем удаляется: дедупликация экономит место,
+но не передачу. Без передачи данных обходится только загрузка по частям
+с заранее посчитанным хешем (chunked_upload).
+"""
+
+import os
+import time
+import uuid
+import hashlib
+import sqlite3
+import zlib
+import logging
+import zipfile
+
+from flask import Request, current_app, request
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+from job_cost import MarkerCounter
+
+logger = logging.getLogger('ifc-exporter')
+
+# Размер блока при копировании потоков, не прошедших через UploadRequest
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Архивы пакетной загрузки и расширения IFC файлов внутри них
+ARCHIVE_EXTENSIONS = {'zip'}
+ARCHIVE_MEMBER_EXTENSIONS = {'ifc'}
+
+# Типы частей multipart, сжатых в браузере (CompressionStream('gzip'))
+GZIP_CONTENT_TYPES = {'application/gzip', 'application/x-gzip'}
+
+# Ключ environ с формой, уже принятой ASGI входом: (form, files, временные файлы)
+PREFETCHED_FORM_KEY = 'ifc_exporter.prefetched_form'
+
+
+class HashingUploadFile:
+    """
+    Временный файл в папке загрузок, считающий при записи размер, SHA-256
+    и счетчики сущностей и зон для оценки длительности (job_cost)
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{uuid.uuid4().hex}.upload")
+        self.size = 0
+        self.persisted = False
+        self._file = open(self.path, 'w+b')
+        self._hasher = hashlib.sha256()
+        self.markers = MarkerCounter()
+
+    def write(self, data):
+        """Запись очередного блока данных из multipart парсера"""
+        self._hasher.update(data)
+        self.markers.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # read/seek/tell/readline и прочее делегируем настоящему файлу
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    @property
+    def sha256(self):
+        """Хеш записанного содержимого"""
+        return self._hasher.hexdigest()
+
+    @property
+    def preflight(self):
+        """Счетчики сущностей и зон записанного содержимого"""
+        entities, zones = self.markers.counts
+        return {'entities': entities, 'zones': zones}
+
+    def persist(self, destination):
+        """Перенос файла в итоговое место без копирования данных"""
+        self._file.close()
+        os.replace(self.path, destination)
+        self.persisted = True
+
+    def discard(self):
+        """Удаление временного файла, если он не был сохранен"""
+        if not self._file.closed:
+            self._file.close()
+        if not self.persisted:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class GzipUploadFile(HashingUploadFile):
+    """
+    Временный файл, распаковывающий gzip поток при записи
+
+    Размер и SHA-256 считаются по распакованному содержимому, поэтому
+    сжатая и несжатая загрузка одной модели попадают в один файл хранилища.
+    """
+
+    def __init__(self, directory, max_size=None):
+        super().__init__(directory)
+        self.max_size = max_size
+        self.compressed_size = 0
+        self._decompressor = zlib.decompressobj(wbits=31)
+
+    def write(self, data):
+        """Распаковка очередного блока сжатых данных"""
+        self.compressed_size += len(data)
+
+        while data:
+            try:
+                chunk = self._decompressor.decompress(data)
+            except zlib.error as e:
+                # Не ValueError: его парсер форм Werkzeug молча подавляет
+                raise BadRequest(f"Invalid gzip data: {str(e)}")
+
+            data = b''
+            if self._decompressor.eof:
+                # Несколько gzip потоков подряд распаковываются последовательно
+                data = self._decompressor.unused_data
+                if data:
+                    self._decompressor = zlib.decompressobj(wbits=31)
+
+            # Защита от "zip-бомб": ограничение размера после распаковки
+            if self.max_size and self.size + len(chunk) > self.max_size:
+                raise RequestEntityTooLarge(
+                    f"Decompressed file too large. Maximum size is {self.max_size} bytes"
+                )
+            super().write(chunk)
+
+        return self.compressed_size
+
+    @property
+    def complete(self):
+        """Весь gzip поток получен (файл не обрезан)"""
+        return self._decompressor.eof
+
+    def persist(self, destination):
+        """Перенос распакованного файла, если сжатый поток был получен целиком"""
+        if not self.complete:
+            raise BadRequest("Truncated gzip data")
+        super().persist(destination)
+
+
+def open_upload_spool(config, content_type):
+    """
+    Временный файл для части multipart с файлом
+
+    :param config: конфигурация приложения (UPLOAD_SPOOL_FOLDER, MAX_DECOMPRESSED_SIZE)
+    :param content_type: тип части (сжатые в браузере файлы распаковываются по мере приема)
+    """
+    if content_type in GZIP_CONTENT_TYPES:
+        return GzipUploadFile(config['UPLOAD_SPOOL_FOLDER'], config.get('MAX_DECOMPRESSED_SIZE'))
+    return HashingUploadFile(config['UPLOAD_SPOOL_FOLDER'])
+
+
+class UploadRequest(Request):
+    """Запрос Flask, размещающий загружаемые файлы сразу в папке загрузок"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Обычные поля формы и запросы без папки буферизации обрабатываем как раньше
+        if not filename or not current_app.config.get('UPLOAD_SPOOL_FOLDER'):
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+        stream = open_upload_spool(current_app.config, content_type)
+        self.__dict__.setdefault('_upload_spools', []).append(stream)
+        return stream
+
+    def _load_form_data(self):
+        # Форма, принятая асинхронно (asgi.py), не разбирается повторно
+        prefetched = self.environ.get(PREFETCHED_FORM_KEY)
+        if prefetched is None:
+            return super()._load_form_data()
+
+        if 'form' in self.__dict__:
+            return
+
+        form, files, spools = prefetched
+        self.__dict__['form'] = form
+        self.__dict__['files'] = files
+        self.__dict__.setdefault('_upload_spools', []).extend(spools)
+
+
+class BlobStore:
+    """Контентно-адресуемое хранилище загруженных IFC файлов"""
+
+    def __init__(self, root, db_path=None):
+        """
+        :param root: папка хранилища (uploads/blobs)
+        :param db_path: путь к БД со ссылками на файлы
+        """
+        self.root = root
+        self.db_path = db_path or os.getenv('JOBS_DB_PATH', 'jobs.db')
+        os.makedirs(self.root, exist_ok=True)
+        self.setup_database()
+
+    def _connect(self):
+        """Открытие соединения с БД хранилища"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def setup_database(self):
+        """Создание таблиц файлов и ссылок на них"""
+        conn = self._connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_blobs (
+                sha256 TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                extension TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+
+        # Исходные имена и задачи конвертации, ссылающиеся на файл
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS upload_refs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sha256 TEXT NOT NULL,
+                original_name TEXT NOT NULL,
+                job_id TEXT,
+                user_id TEXT,
+                created_at REAL NOT NULL,
+                FOREIGN KEY (sha256) REFERENCES upload_blobs (sha256)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_upload_refs_sha256 ON upload_refs (sha256)')
+
+        conn.commit()
+        conn.close()
+
+    def blob_path(self, sha256, extension):
+        """Путь к файлу в хранилище: blobs/<первые 2 символа>/<sha256>.<ext>"""
+        return os.path.join(self.root, sha256[:2], f"{sha256}.{extension}")
+
+    def find(self, sha256, user_id=None):
+        """
+        Поиск уже сохраненного файла по хешу
+
+        :param user_id: только файлы, на которые уже ссылается этот пользователь
+            (знание хеша не доказывает, что у клиента есть сами данные)
+        :return: словарь файла с путем или None
+        """
+        conn = self._connect()
+        if user_id is None:
+            row = conn.execute('SELECT * FROM upload_blobs WHERE sha256 = ?', (sha256,)).fetchone()
+        else:
+            row = conn.execute('''
+                SELECT * FROM upload_blobs WHERE sha256 = ? AND EXISTS (
+                    SELECT 1 FROM upload_refs WHERE upload_refs.sha256 = upload_blobs.sha256 AND user_id = ?
+                )
+            ''', (sha256, user_id)).fetchone()
+        conn.close()
+
+        if row is None:
+            return None
+
+        blob = dict(row)
+        blob['path'] = self.blob_path(sha256, blob['extension'])
+
+        # Запись есть, а файл удален вручную - считаем, что файла нет
+        if not os.path.exists(blob['path']):
+            return None
+        return blob
+
+    def add_file(self, source_path, sha256, size, filename):
+        """
+        Добавление файла в хранилище переименованием
+
+        Если файл с таким хешем уже есть, исходный (уже записанный) файл удаляется.
+
+        :param source_path: путь к временному файлу в той же файловой системе
+        :param sha256: хеш содержимого
+        :param size: размер в байтах
+        :param filename: исходное имя (для расширения)
+        :return: (путь к файлу в хранилище, был ли файл уже сохранен)
+        """
+        existing = self.find(sha256)
+        if existing:
+            os.remove(source_path)
+            logger.info(f"Duplicate upload skipped: {filename} -> {sha256}")
+            return existing['path'], True
+
+        extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'ifc'
+        path = self.blob_path(sha256, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source_path, path)
+        self._register(sha256, size, extension)
+        return path, False
+
+    def add_stream(self, stream, filename):
+        """
+        Добавление файла из HashingUploadFile без копирования данных
+
+        Дубликат к этому моменту уже принят и записан во временный файл, он удаляется.
+
+        :return: (путь к файлу в хранилище, размер, sha256, был ли файл уже сохранен)
+        """
+        if isinstance(stream, GzipUploadFile) and not stream.complete:
+            raise BadRequest("Truncated gzip data")
+
+        existing = self.find(stream.sha256)
+        if existing:
+            stream.discard()
+            logger.info(f"Duplicate upload skipped: {filename} -> {stream.sha256}")
+            return existing['path'], stream.size, stream.sha256, True
+
+        extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else 'ifc'
+        path = self.blob_path(stream.sha256, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        stream.persist(path)
+        self._register(stream.sha256, stream.size, extension)
+        return path, stream.size, stream.sha256, False
+
+    def _register(self, sha256, size, extension):
+        """Запись о новом файле в хранилище"""
+        conn = self._connect()
+        conn.execute('''
+            INSERT OR IGNORE INTO upload_blobs (sha256, size, extension, created_at) VALUES (?, ?, ?, ?)
+        ''', (sha256, size, extension, time.time()))
+        conn.commit()
+        conn.close()
+
+    def add_reference(self, sha256, original_name, job_id=None, user_id=None):
+        """Привязка исходного имени файла и задачи конвертации к файлу хранилища"""
+        conn = self._connect()
+        conn.execute('''
+            INSERT INTO upload_refs (sha256, original_name, job_id, user_id, created_at) VALUES (?, ?, ?, ?, ?)
+        ''', (sha256, original_name, job_id, user_id, time.time()))
+        conn.commit()
+        conn.close()
+
+
+def store_upload(file_storage, blob_store):
+    """
+    Сохранение загруженного файла в хранилище по хешу
+
+    :param file_storage: объект FileStorage из request.files
+    :param blob_store: хранилище BlobStore
+    :return: (путь к файлу в хранилище, размер, sha256, был ли файл уже сохранен)
+    """
+    stream = file_storage.stream
+
+    if isinstance(stream, HashingUploadFile):
+        return blob_store.add_stream(stream, file_storage.filename)
+
+    # Поток не из UploadRequest: сохраняем во временный файл рядом с хранилищем
+    temp_path = os.path.join(blob_store.root, f"{uuid.uuid4().hex}.upload")
+    size, sha256 = persist_upload(file_storage, temp_path)
+    path, deduplicated = blob_store.add_file(temp_path, sha256, size, file_storage.filename)
+    return path, size, sha256, deduplicated
+
+
+def persist_upload(file_storage, destination):
+    """
+    Сохранение загруженного файла с подсчетом размера и SHA-256
+
+    :param file_storage: объект FileStorage из request.files
+    :param destination: итоговый путь файла
+    :return: (размер в байтах, sha256)
+    """
+    stream = file_storage.stream
+
+    if isinstance(stream, HashingUploadFile):
+        stream.persist(destination)
+        return stream.size, stream.sha256
+
+    # Поток не из UploadRequest: копируем, считая хеш в том же проходе
+    hasher = hashlib.sha256()
+    size = 0
+    with open(destination, 'wb') as f:
+        while True:
+            block = stream.read(COPY_BUFFER_SIZE)
+            if not block:
+                break
+            hasher.update(block)
+            f.write(block)
+            size += len(block)
+
+    return size, hasher.hexdigest()
+
+
+def init_upload_storage(app):
+    """Подключение UploadRequest и очистки несохраненных временных файлов"""
+    app.request_class = UploadRequest
+    app.config.setdefault('MAX_DECOMPRESSED_SIZE', 2 * 1024 * 1024 * 1024)
+    app.config.setdefault('UPLOAD_SPOOL_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], '.incoming'))
+
+    @app.teardown_request
+    def discard_upload_spools(exc=None):
+        """Удаление временных файлов, которые не были сохранены обработчиком"""
+        for stream in getattr(request, '_upload_spools', []):
+            stream.discard()
+
+
+def is_archive(filename):
+    """Проверка, является ли файл архивом пакетной загрузки"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ARCHIVE_EXTENSIONS
+
+
+def list_archive_members(archive_path, max_entries=None, max_member_size=None, max_total_size=None):
+    """
+    Список IFC файлов в ZIP архиве
+
+    Читается только оглавление архива, содержимое не распаковывается.
+    Размеры после распаковки берутся из оглавления (ZipInfo.file_size): больше
+    них обработчик из элемента не распакует (export_flats.open_ifc_model).
+
+    :param archive_path: путь к архиву
+    :param max_entries: максимум записей в оглавлении (вместе с папками и пропускаемыми файлами)
+    :param max_member_size: максимум байт одного IFC файла после распаковки
+    :param max_total_size: максимум байт всех IFC файлов архива после распаковки
+    :return: список (имя элемента, размер в распакованном виде)
+    :raises ValueError: архив поврежден или в нем слишком много записей
+    :raises RequestEntityTooLarge: превышен размер после распаковки
+    """
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            infos = archive.infolist()
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Invalid ZIP archive: {str(e)}")
+
+    if max_entries and len(infos) > max_entries:
+        raise ValueError(f"Too many entries in ZIP archive. Maximum is {max_entries}")
+
+    members = []
+    total_size = 0
+    for info in infos:
+        name = info.filename
+        base_name = os.path.basename(name)
+
+        # Папки, служебные файлы macOS и скрытые файлы пропускаем
+        if info.is_dir() or name.startswith('__MACOSX/') or not base_name or base_name.startswith('.'):
+            continue
+        if base_name.rsplit('.', 1)[-1].lower() not in ARCHIVE_MEMBER_EXTENSIONS:
+            continue
+
+        # Защита от "zip-бомб": ограничение размеров после распаковки
+        if max_member_size and info.file_size > max_member_size:
+            raise RequestEntityTooLarge(
+                f"Decompressed file too large: {name}. Maximum size is {max_member_size} bytes"
+            )
+        total_size += info.file_size
+        if max_total_size and total_size > max_total_size:
+            raise RequestEntityTooLarge(
+                f"Decompressed archive too large. Maximum size is {max_total_size} bytes"
+            )
+
+        members.append((name, info.file_size))
+
+    return members
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Автоматическая конвертация IFC файлов, сохраняемых в папки проектов
+
+Папки из WATCH_DIRS (через os.pathsep) отслеживаются через inotify (пакет
+inotify_simple), а без него - периодическим сканированием. Файл считается
+готовым, когда его размер и mtime не меняются WATCH_SETTLE_SECONDS секунд
+(копирование по сети может идти долго). Готовые файлы одной папки, пришедшие
+вместе, объединяются в одну задачу конвертации.
+
+Задачи ставятся в общую очередь (jobs.db) и выполняются обработчиками
+приложения. Файл (путь и SHA-256) считается обработанным только после
+успешного завершения его задачи (таблица watch_processed): файлы задачи,
+завершившейся ошибкой или отмененной, конвертируются снова при следующей
+записи, даже с тем же содержимым. Пока незавершенных задач от папок не меньше
+WATCH_MAX_PENDING_JOBS, новые задачи не создаются, а файлы копятся в пакетах
+(обратное давление).
+
+Запуск отдельным процессом:
+    python watch_folder.py /mnt/bim/project1 /mnt/bim/project2
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import threading
+import logging
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:
+    INotify = None
+
+from path_ingest import PathIngestor
+from job_queue import estimate_job_memory, FINISHED_STATES, JOB_SUCCESS
+from job_cost import estimate_job_seconds
+from export_flats import EXTRACT_WORKERS
+
+logger = logging.getLogger('ifc-exporter')
+
+# Идентификатор "пользователя" задач, созданных наблюдателем
+WATCH_USER_ID = 'watch-folder'
+
+# Расширения отслеживаемых файлов
+WATCH_EXTENSIONS = {'ifc'}
+
+
+class WatchFolderDaemon:
+    """Наблюдатель за папками, ставящий новые и измененные IFC файлы в очередь"""
+
+    def __init__(self, job_queue, directories, ingestor=None, settle_seconds=None, batch_window=None,
+                 poll_interval=None, max_pending_jobs=None, max_batch_files=None,
+                 area_coefficient=0.9, upload_to_sheets=None, db_path=None):
+        """
+        :param job_queue: очередь задач конвертации
+        :param directories: отслеживаемые папки (с вложенными)
+        :param ingestor: PathIngestor для хешей файлов (по умолчанию с корнями directories)
+        :param settle_seconds: сколько секунд файл не должен меняться, чтобы считаться записанным
+        :param batch_window: сколько секунд ждать следующих файлов папки перед созданием задачи
+        :param poll_interval: интервал сканирования без inotify
+        :param max_pending_jobs: максимум незавершенных задач от наблюдателя
+        :param max_batch_files: максимум файлов в одной задаче
+        :param area_coefficient: коэффициент площади для задач
+        :param upload_to_sheets: загружать результат в Google Sheets
+        :param db_path: БД с отметками об обработанных файлах (по умолчанию JOBS_DB_PATH)
+        """
+        self.job_queue = job_queue
+        self.directories = [os.path.realpath(directory) for directory in directories]
+        self.ingestor = ingestor or PathIngestor(roots=self.directories)
+        self.settle_seconds = settle_seconds if settle_seconds is not None else float(os.getenv('WATCH_SETTLE_SECONDS', '5'))
+        self.batch_window = batch_window if batch_window is not None else float(os.getenv('WATCH_BATCH_WINDOW', '10'))
+        self.poll_interval = poll_interval or float(os.getenv('WATCH_POLL_INTERVAL', '5'))
+        self.max_pending_jobs = max_pending_jobs or int(os.getenv('WATCH_MAX_PENDING_JOBS', '2'))
+        self.max_batch_files = max_batch_files or int(os.getenv('MAX_BATCH_FILES', '100'))
+        self.area_coefficient = area_coefficient
+        if upload_to_sheets is None:
+            upload_to_sheets = os.getenv('WATCH_UPLOAD_SHEETS', 'false').lower() == 'true'
+        self.upload_to_sheets = upload_to_sheets
+        self.db_path = db_path or os.getenv('JOBS_DB_PATH', 'jobs.db')
+
+        # Файлы, которые еще записываются: {путь: (размер, mtime_ns, время последнего изменения)}
+        self._candidates = {}
+        # Готовые файлы по папкам: {папка: {путь: описание файла}} и время последнего добавления
+        self._batches = {}
+        self._batch_updated = {}
+        self._throttled = False
+        # Поставленные задачи: {job_id: {путь: sha256}} - до их завершения
+        self._pending = {}
+
+        self._snapshot = {}
+        self._inotify = None
+        self._watch_dirs = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        self.setup_database()
+
+    def _connect(self):
+        """Открытие соединения с БД отметок"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def setup_database(self):
+        """Создание таблицы успешно сконвертированных файлов"""
+        conn = self._connect()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS watch_processed (
+                path TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                job_id TEXT NOT NULL,
+                processed_at REAL NOT NULL
+            )
+        ''')
+        conn.commit()
+        conn.close()
+
+    def is_processed(self, path, sha256):
+        """Файл с этим содержимым уже сконвертирован или стоит в очереди"""
+        if any(files.get(path) == sha256 for files in self._pending.values()):
+            return True
+        conn = self._connect()
+        row = conn.execute('SELECT sha256 FROM watch_processed WHERE path = ?', (path,)).fetchone()
+        conn.close()
+        return row is not None and row['sha256'] == sha256
+
+    def _check_pending(self):
+        """Отметка файлов успешно завершенных задач; файлы неудачных задач остаются необработанными"""
+        for job_id, files in list(self._pending.items()):
+            job = self.job_queue.get_job(job_id)
+            if job is not None and job['state'] not in FINISHED_STATES:
+                continue
+            del self._pending[job_id]
+
+            if job is None or job['state'] != JOB_SUCCESS:
+                logger.warning(f"Watch folder: job {job_id} {job['state'] if job else 'lost'}, "
+                               f"{len(files)} files will be converted again on next write")
+                continue
+
+            now = time.time()
+            conn = self._connect()
+            conn.executemany('''
+                INSERT OR REPLACE INTO watch_processed (path, sha256, job_id, processed_at) VALUES (?, ?, ?, ?)
+            ''', [(path, sha256, job_id, now) for path, sha256 in files.items()])
+            conn.commit()
+            conn.close()
+
+    def start(self):
+        """Запуск наблюдения в фоновом потоке"""
+        self._thread = threading.Thread(target=self._run, name='watch-folder', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановка наблюдения"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_interval + 1)
+
+    @staticmethod
+    def is_watched_file(name):
+        """Проверка имени файла (скрытые и временные файлы пропускаются)"""
+        return not name.startswith('.') and '.' in name and \
+            name.rsplit('.', 1)[1].lower() in WATCH_EXTENSIONS
+
+    def _scan(self):
+        """Размер и mtime всех отслеживаемых файлов"""
+        snapshot = {}
+        for directory in self.directories:
+            for dirpath, dirnames, filenames in os.walk(directory):
+                dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+                for name in filenames:
+                    if not self.is_watched_file(name):
+                        continue
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def _setup_inotify(self):
+        """Подписка на события записи во всех отслеживаемых папках"""
+        self._inotify = INotify()
+        for directory in self.directories:
+            for dirpath, dirnames, _ in os.walk(directory):
+                dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+                self._add_watch(dirpath)
+
+    def _add_watch(self, directory):
+        """Добавление папки в inotify"""
+        mask = (inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO | inotify_flags.MODIFY
+                | inotify_flags.CREATE)
+        try:
+            wd = self._inotify.add_watch(directory, mask)
+        except OSError as e:
+            logger.warning(f"Failed to watch {directory}: {e}")
+            return
+        self._watch_dirs[wd] = directory
+
+    def _read_inotify(self):
+        """Ожидание событий inotify (не дольше poll_interval)"""
+        for event in self._inotify.read(timeout=int(self.poll_interval * 1000)):
+            directory = self._watch_dirs.get(event.wd)
+            if directory is None or not event.name:
+                continue
+
+            path = os.path.join(directory, event.name)
+            if event.mask & inotify_flags.ISDIR:
+                # Новая папка проекта: следим за ней и забираем уже скопированные файлы
+                if event.mask & (inotify_flags.CREATE | inotify_flags.MOVED_TO) and not event.name.startswith('.'):
+                    self._add_watch(path)
+                    for dirpath, _, filenames in os.walk(path):
+                        for name in filenames:
+                            if self.is_watched_file(name):
+                                self._touch(os.path.join(dirpath, name))
+                continue
+
+            if self.is_watched_file(event.name):
+                self._touch(path)
+
+    def _poll(self):
+        """Сканирование папок и сравнение с предыдущим снимком"""
+        self._stop_event.wait(self.poll_interval)
+        snapshot = self._scan()
+        for path, state in snapshot.items():
+            if self._snapshot.get(path) != state:
+                self._touch(path)
+        self._snapshot = snapshot
+
+    def _touch(self, path):
+        """Файл изменился: откладываем его до окончания записи"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._candidates.pop(path, None)
+            return
+        self._candidates[path] = (stat.st_size, stat.st_mtime_ns, time.monotonic())
+
+    def _settle(self):
+        """Перенос файлов, запись которых закончилась, в пакеты их папок"""
+        now = time.monotonic()
+
+        for path, (size, mtime_ns, changed_at) in list(self._candidates.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Временный файл переименован или удален
+                del self._candidates[path]
+                continue
+
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self._candidates[path] = (stat.st_size, stat.st_mtime_ns, now)
+                continue
+            if now - changed_at < self.settle_seconds or stat.st_size == 0:
+                continue
+
+            del self._candidates[path]
+
+            try:
+                size, sha256, _ = self.ingestor.fingerprint(path)
+            except OSError as e:
+                logger.warning(f"Watch folder: failed to read {path}: {e}")
+                continue
+
+            # Файл перезаписан тем же содержимым, что уже сконвертировано - конвертировать нечего
+            if self.is_processed(path, sha256):
+                continue
+
+            folder = os.path.dirname(path)
+            self._batches.setdefault(folder, {})[path] = {
+                'path': path,
+                'original_name': os.path.basename(path),
+                'size': size,
+                'sha256': sha256,
+                'ingested': True
+            }
+            self._batch_updated[folder] = now
+
+    def _flush(self):
+        """Создание задач из пакетов, в которые давно не добавлялись файлы"""
+        now = time.monotonic()
+
+        for folder in list(self._batches):
+            batch = self._batches[folder]
+            if len(batch) < self.max_batch_files and now - self._batch_updated[folder] < self.batch_window:
+                continue
+
+            # Обратное давление: пока очередь занята, файлы остаются в пакете
+            if self.job_queue.count_unfinished(WATCH_USER_ID) >= self.max_pending_jobs:
+                if not self._throttled:
+                    logger.info(f"Watch folder: job queue busy, holding {sum(len(b) for b in self._batches.values())} files")
+                    self._throttled = True
+                return
+            self._throttled = False
+
+            paths = sorted(batch)[:self.max_batch_files]
+            files = [batch.pop(path) for path in paths]
+            if not batch:
+                del self._batches[folder]
+                del self._batch_updated[folder]
+
+            payload = {
+                'files': files,
+                'area_coefficient': self.area_coefficient,
+                'combined_name': os.path.basename(folder),
+                'upload_to_sheets': self.upload_to_sheets,
+                'user': None
+            }
+            # Ограничения допуска не проверяются (есть свое обратное давление), но бюджет памяти учитывается
+            predicted_seconds, counters = estimate_job_seconds(files)
+            payload['preflight'] = {
+                'entities': sum(c['entities'] for c in counters),
+                'zones': sum(c['zones'] for c in counters)
+            }
+            job_id = self.job_queue.enqueue(payload, user_id=WATCH_USER_ID, client=WATCH_USER_ID,
+                                            memory_mb=estimate_job_memory(files, EXTRACT_WORKERS),
+                                            predicted_seconds=predicted_seconds)
+            self._pending[job_id] = {f['path']: f['sha256'] for f in files}
+            logger.info(f"Watch folder: queued {len(files)} files from {folder} as job {job_id}")
+
+    def _run(self):
+        """Основной цикл наблюдения"""
+        # Файлы, уже лежащие в папках при запуске, не конвертируются
+        self._snapshot = self._scan()
+
+        if INotify is not None:
+            try:
+                self._setup_inotify()
+                logger.info(f"Watching {self.directories} with inotify")
+            except OSError as e:
+                logger.warning(f"inotify unavailable ({e}), falling back to polling")
+                self._inotify = None
+        if self._inotify is None:
+            logger.info(f"Watching {self.directories} by polling every {self.poll_interval}s")
+
+        while not self._stop_event.is_set():
+            try:
+                if self._inotify is not None:
+                    self._read_inotify()
+                else:
+                    self._poll()
+                self._check_pending()
+                self._settle()
+                self._flush()
+            except Exception as e:
+                logger.error(f"Watch folder error: {e}", exc_info=True)
+                self._stop_event.wait(self.poll_interval)
+
+        if self._inotify is not None:
+            self._inotify.close()
+
+
+def watch_directories_from_env():
+    """Папки наблюдения из WATCH_DIRS"""
+    return [directory for directory in os.getenv('WATCH_DIRS', '').split(os.pathsep) if directory]
+
+
+if __name__ == '__main__':
+    from job_queue import JobQueue
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+
+    directories = sys.argv[1:] or watch_directories_from_env()
+    if not directories:
+        print("Usage: python watch_folder.py DIR [DIR ...] (or set WATCH_DIRS)")
+        sys.exit(1)
+
+    # Задачи выполняют обработчики приложения, работающие с той же JOBS_DB_PATH
+    daemon = WatchFolderDaemon(JobQueue(), directories)
+    daemon.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        daemon.stop()